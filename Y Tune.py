@@ -1,68 +1,645 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
 import tkinter as tk
 from tkinter import Entry, Button, Label, Frame, Listbox, Scrollbar, END, Scale, HORIZONTAL
-import pygame
+import tkinter.font as tkfont
 import os
-from mutagen.mp3 import MP3
-import yt_dlp
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')  # pygame's banner would land in --send's JSON output
+import pygame
 import json
+import sqlite3
 import sys
-import time
 import random
 import threading
-from queue import Queue
-from tenacity import retry, stop_after_attempt, wait_fixed
+import traceback
+import itertools
+import heapq
+import bisect
+import mmap
+import shutil
+import subprocess
+import socket
+import signal
+import argparse
+import importlib
+import multiprocessing
+import urllib.parse
+import re
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, fields
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 # Ensure UTF-8 encoding for console output
 sys.stdout.reconfigure(encoding='utf-8')
 
+# Startup timing: (phase, time.perf_counter() when it finished). yt-dlp and mutagen are
+# imported on first use so they stay off the path to the first window.
+startup_phases = []
+
 # Global variables for tracking player state
 is_playing = False
 is_paused = False
 music_length = 0
 seek_offset = 0
-current_playlist_index = -1
 current_song = None
+current_song_path = None
 playback_mode = "off"
 last_click_time = 0  # For debouncing listbox clicks
 is_seeking = False  # Track if user is dragging the progress bar
 last_seek_time = 0  # For debouncing seek events
 
-# Thread-safe queue for UI updates from threads
+# Thread-safe queue for UI updates from threads; the Tk loop is only woken when it has work
 ui_queue = Queue()
+ui_coalesced = {}  # key -> latest (callback, args); repeated updates collapse into one
+ui_lock = threading.Lock()
+ui_wakeup_pending = False
+status_reset_job = None
+progress_job = None  # Pending progress bar tick, only scheduled while a song is playing
+play_started_at = 0.0  # time.monotonic() when playback last (re)started at seek_offset
+paused_at = None
 
-# Initialize cache and data directories
+# Cache and data directories, created by create_data_dirs()
 CACHE_DIR = os.path.join(".cache", ".downloaded")
 DATA_DIR = ".data"
-os.makedirs(CACHE_DIR, exist_ok=True)
-os.makedirs(DATA_DIR, exist_ok=True)
 
-# Lock for thread-safe file operations
-file_lock = threading.Lock()
+# Persistent audio cache keyed by YouTube video ID, evicted least recently used first
+CACHE_INDEX_FILE = os.path.join(CACHE_DIR, 'index.json')
+CACHE_MAX_BYTES = int(os.environ.get('YTUNE_CACHE_MAX_BYTES', 2 * 1024 ** 3))  # 2 GB default
+cache_index = OrderedDict()  # video_id -> {'file', 'size', 'last_used', 'duration'}, oldest first
+cache_lock = threading.Lock()
+
+# Several players on one machine can share the cache; they coordinate through OS file locks in
+# CACHE_LOCK_DIR. Every player holds instances.lock shared while it runs, so unknown files are
+# only cleaned up by a player that starts alone. <video_id>.lock is held exclusively while a song
+# is downloaded or evicted and shared while it is loaded in a mixer, and index.json is merged
+# with the other players' changes under index.lock before it is rewritten.
+CACHE_LOCK_DIR = os.path.join(CACHE_DIR, '.locks')
+CACHE_INDEX_LOCK_FILE = os.path.join(CACHE_LOCK_DIR, 'index.lock')
+INSTANCE_LOCK_FILE = os.path.join(CACHE_LOCK_DIR, 'instances.lock')
+cache_index_stamp = None  # (mtime_ns, size) of index.json when it was last read
+cache_evicted = set()  # Songs this player evicted since index.json was last written
+instance_lock = None
+pinned_entries = {}  # video_id -> shared lock on a song loaded in the mixer
+
+# Seek index stored next to each cached MP3 as <video_id>.seek.json: byte offsets of frames,
+# one per SEEK_INDEX_INTERVAL seconds, so seeking starts decoding at the target frame.
+# Ogg/Opus files are not indexed; SDL_mixer seeks them natively through their granule positions.
+SEEK_INDEX_INTERVAL = 1.0
+MP3_BITRATES = {  # kbps by bitrate index, for MPEG-1 and MPEG-2/2.5 Layer III
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}  # By version bits
+seek_index_cache = (None, None)  # (song path, (times, offsets)) for the last index read
+
+# 'native' keeps YouTube's Opus/Vorbis stream and only remuxes it; 'mp3' re-encodes to MP3 192k
+AUDIO_MODE = os.environ.get('YTUNE_AUDIO_MODE', 'native')
+MP3_BITRATE_KBPS = 192
+
+# Files stored next to each cached song as <video_id>.<kind>.json
+CACHE_SIDECARS = ('seek', 'meta')
+
+# Background prefetch of upcoming songs while the current one plays
+PREFETCH_COUNT = 2  # How many upcoming songs to keep downloaded ahead
+MAX_PREFETCH_DOWNLOADS = 1  # Concurrent background downloads
+downloads_in_flight = {}  # video_id -> threading.Event set when its download finishes
+downloads_lock = threading.Lock()
+
+# Songs download in DOWNLOAD_CHUNK_BYTES range requests over several connections into
+# <video_id>.partial.<ext>.part, with the finished chunks listed in a .json file next to it,
+# so an interrupted download resumes where it stopped, even after a restart. Background
+# downloads (prefetch and sync) are rate limited to leave bandwidth for the song being played.
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_TIMEOUT = 20  # Seconds a connection may stall before it is dropped
+DOWNLOAD_BACKGROUND_RATE = int(os.environ.get('YTUNE_BACKGROUND_RATE', 1024 * 1024))  # Bytes/s per download, 0 for no limit
+DOWNLOAD_PARTIAL_MAX_AGE = 7 * 24 * 3600  # Older partial downloads are deleted at startup
+
+# Bulk offline sync of whole lists into the cache; the pending list survives restarts
+SYNC_STATE_FILE = os.path.join(DATA_DIR, 'sync.json')
+SYNC_DOWNLOADS = 4  # Concurrent sync downloads
+SYNC_TRANSCODE_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # ffmpeg processes
+sync_manager = None
+
+# Progressive playback: audio starts once a short pre-roll has been decoded
+STREAM_PREROLL_SECONDS = 1.5
+STREAM_BUFFER_SECONDS = 10  # Decoded audio held ahead of the mixer before ffmpeg is throttled
+STREAM_CHUNK_SECONDS = 0.25  # Size of each Sound handed to the mixer channel
+active_stream = None
+
+# Playback engine that keeps the audio device open between songs
+engine = None
+
+# Local control API: newline-delimited JSON over a Unix socket, served by the window and by --headless
+CONTROL_SOCKET = os.environ.get('YTUNE_CONTROL_SOCKET', os.path.join(DATA_DIR, 'control.sock'))
+CONTROL_TIMEOUT = 30  # Seconds a command waits for the player
+control_server = None
+control_lock = None  # Held by the player that owns the control socket, see claim_control_socket()
+headless = False
+
+# SQLite database holding favorites, recent history and cached searches
+DB_FILE = os.path.join(DATA_DIR, 'ytune.db')
+store = None
+
+# Write-behind persistence: changes are journaled at once and committed in batches off the UI thread
+JOURNAL_FILE = os.path.join(DATA_DIR, 'journal.jsonl')
+PERSIST_FLUSH_SECONDS = 2.0
+PERSIST_COMPACT_SECONDS = 300.0  # How often the SQLite WAL is checkpointed and truncated
+writer = None
+
+# Search results cached per normalized query, refreshed in the background once stale
+SEARCH_CACHE_FILE = os.path.join('.cache', 'search.json')  # Pre-SQLite location, read once for migration
+SEARCH_CACHE_FRESH_SECONDS = 6 * 3600  # Younger results are shown without searching again
+SEARCH_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600  # Older results are dropped instead of shown
+SEARCH_CACHE_MAX_ENTRIES = 200
+latest_search_query = None  # Only results for this query are shown in the playlist
+latest_search_text = ""  # The query as typed, used to reopen a search for more pages
+
+# Paged search: the first page is shown as soon as it arrives, more load on scroll
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_RESULTS = 200
+search_session = None  # Open result iterator for the query shown in the playlist
+loading_more_results = False
+
+# Background work runs on a fixed pool of workers; lower priority numbers run first
+SCHEDULER_WORKERS = 3
+PRIORITY_CURRENT = 0  # The song or search the user just asked for
+PRIORITY_PREFETCH = 1
+PRIORITY_BATCH = 2
+scheduler = None
+
+# Timing spans of each pipeline stage (search, download, stream, play) kept in a bounded ring.
+# F2 opens a panel with rolling percentiles; the ring can be exported as JSON lines.
+TIMING_RING_SIZE = 2000
+TIMINGS_EXPORT_FILE = os.path.join(DATA_DIR, 'timings.jsonl')
+STATS_REFRESH_MS = 1000
+timings = None
+download_marks = threading.local()  # perf_counter() marks of the yt-dlp download running on this thread
+stats_window = None
+
+# Requests to YouTube go through one fetch layer. Failures are classified as transient,
+# throttled or permanent; only transient ones are retried, after a jittered exponential backoff.
+# Rate limiting opens a circuit breaker that refuses requests until a cooldown has passed.
+FETCH_MAX_ATTEMPTS = 4
+FETCH_BACKOFF_BASE = 0.5  # Seconds; the cap on each retry's random delay doubles per attempt
+FETCH_BACKOFF_MAX = 8.0
+BREAKER_COOLDOWN = 30.0  # Doubles each time a probe after the cooldown is throttled again
+BREAKER_MAX_COOLDOWN = 600.0
+THROTTLED_ERRORS = re.compile(r"HTTP Error 429|Too Many Requests|rate.?limit|confirm you.re not a bot", re.I)
+TRANSIENT_ERRORS = re.compile(
+    r"timed? ?out|Connection (reset|refused|aborted)|Temporary failure|Name or service not known|getaddrinfo"
+    r"|IncompleteRead|Remote end closed|EOF occurred|HTTP Error (408|5\d\d)", re.I)
+fetcher = None
+
+# Warm yt-dlp instances kept per option profile instead of one YoutubeDL per call
+YDL_POOL_SIZE = 2  # Idle instances kept per profile
+extractor_pool = None
+
+# Ordered list of video IDs with a hash index from ID to position
+class TrackList:
+    def __init__(self):
+        self.ids = []
+        self.positions = {}  # video_id -> index of its first occurrence
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, video_id):
+        return video_id in self.positions
+
+    def index_of(self, video_id):
+        return self.positions.get(video_id)
+
+    def set(self, ids):
+        self.ids = list(ids)
+        self.positions = {}
+        self._reindex(0)
+
+    def extend(self, ids):
+        start = len(self.ids)
+        self.ids.extend(ids)
+        self._reindex(start)
+
+    def insert(self, index, video_id):
+        self._forget_from(index)
+        self.ids.insert(index, video_id)
+        self._reindex(index)
+
+    def pop(self, index):
+        self._forget_from(index)
+        video_id = self.ids.pop(index)
+        self._reindex(index)
+        return video_id
+
+    # Drop index entries at or after start; they are rebuilt by _reindex
+    def _forget_from(self, start):
+        for video_id in self.ids[start:]:
+            if self.positions.get(video_id, -1) >= start:
+                del self.positions[video_id]
+
+    def _reindex(self, start):
+        for index in range(start, len(self.ids)):
+            self.positions.setdefault(self.ids[index], index)
+
+# In-memory track library: one record per video ID, shared by the playlist, recent and favorites lists
+class TrackLibrary:
+    def __init__(self, list_names):
+        self.tracks = {}  # video_id -> {'id', 'title', 'url', ...}
+        self.lists = {name: TrackList() for name in list_names}
+
+    # Add or update a track record and return its video ID
+    def add(self, track):
+        video_id = get_track_id(track)
+        record = self.tracks.setdefault(video_id, {})
+        record.update(track)
+        record['id'] = video_id
+        return video_id
+
+    def get(self, list_name, index):
+        ids = self.lists[list_name].ids
+        return self.tracks[ids[index]] if 0 <= index < len(ids) else None
+
+    def index_of(self, list_name, video_id):
+        return self.lists[list_name].index_of(video_id)
+
+    def contains(self, list_name, video_id):
+        return video_id in self.lists[list_name]
+
+    def size(self, list_name):
+        return len(self.lists[list_name])
+
+    def tracks_in(self, list_name):
+        return [self.tracks[video_id] for video_id in self.lists[list_name].ids]
+
+    def set_list(self, list_name, tracks):
+        self.lists[list_name].set([self.add(track) for track in tracks])
+
+    def extend_list(self, list_name, tracks):
+        self.lists[list_name].extend([self.add(track) for track in tracks])
+
+    def insert(self, list_name, index, track):
+        video_id = self.add(track)
+        self.lists[list_name].insert(index, video_id)
+        return video_id
+
+    # Remove a track from a list, returning the position it had
+    def remove(self, list_name, video_id):
+        index = self.lists[list_name].index_of(video_id)
+        if index is not None:
+            self.lists[list_name].pop(index)
+        return index
+
+# The songs that play next, in play order. The queue is a snapshot of the list a song was
+# picked from, so a new search does not change what plays next.
+class PlayQueue:
+    def __init__(self, history_limit):
+        self.tracks = []  # Entries (serial, video_id) in list order; the serial tells repeated songs apart
+        self.order = []  # The same entries in play order for this pass through the queue
+        self.cursor = -1  # Position of the playing entry in order
+        self.mode = "off"
+        self.history = deque(maxlen=history_limit)  # Songs played before the current one, for previous
+        self.next_cycle = None  # Order of the next pass when the queue loops, drawn early so lookahead is exact
+        self.serials = itertools.count()
+
+    @property
+    def current(self):
+        return self.order[self.cursor][1] if 0 <= self.cursor < len(self.order) else None
+
+    def __len__(self):
+        return len(self.order)
+
+    # Replace the queue with a list of songs and start at one of them; start=None picks a random one
+    def load(self, ids, start=0):
+        self._remember_current()
+        self.tracks = [self._entry(video_id) for video_id in ids]
+        self.order, self.cursor, self.next_cycle = [], -1, None
+        if self.tracks:
+            self._arrange(self.tracks[random.randrange(len(self.tracks)) if start is None else start])
+        return self.current
+
+    # Add a song after everything already queued; returns how many songs play before it
+    def enqueue(self, video_id):
+        entry = self._entry(video_id)
+        self.tracks.append(entry)
+        self.order.append(entry)
+        self.next_cycle = None
+        return len(self.order) - self.cursor - 2
+
+    # Make a song the next one to play
+    def insert_next(self, video_id):
+        entry = self._entry(video_id)
+        self.order.insert(self.cursor + 1, entry)
+        current = self.order[self.cursor] if self.cursor >= 0 else None
+        self.tracks.insert(self.tracks.index(current) + 1 if current else 0, entry)
+        self.next_cycle = None
+
+    # Play a song now, ahead of the rest of the queue
+    def jump(self, video_id):
+        self.insert_next(video_id)
+        self._remember_current()
+        self.cursor += 1
+        return self.current
+
+    # Whether the queue starts over when it runs out; shuffle draws a new permutation each time
+    @property
+    def loops(self):
+        return self.mode in ("repeat_all", "shuffle")
+
+    # Move to the next song and return its ID, or None at the end. When the current song has
+    # simply finished (auto), repeat_one plays it again.
+    def next(self, auto=False):
+        if auto and self.mode == "repeat_one" and self.current:
+            return self.current
+        if self.cursor + 1 < len(self.order):
+            self._remember_current()
+            self.cursor += 1
+        elif self.loops and self.order:
+            self._remember_current()
+            self.order, self.cursor, self.next_cycle = self._get_next_cycle(), 0, None
+        else:
+            return None
+        return self.current
+
+    # Go back to the song that played before this one and return its ID, or None at the start
+    def previous(self):
+        if self.history:
+            video_id = self.history.pop()
+            position = self._find(video_id)
+            if position is not None:
+                self.cursor = position
+            else:
+                # It played in an earlier queue or pass; play it before the current song again
+                entry = self._entry(video_id)
+                current = self.order[self.cursor] if self.cursor >= 0 else None
+                self.cursor = max(self.cursor, 0)
+                self.order.insert(self.cursor, entry)
+                self.tracks.insert(self.tracks.index(current) if current else 0, entry)
+                self.next_cycle = None
+        elif self.cursor > 0:
+            self.cursor -= 1
+        elif self.loops and self.order:
+            self.cursor = len(self.order) - 1
+        else:
+            return None
+        return self.current
+
+    # IDs of the songs that will play after the current one, in order, for prefetching
+    def upcoming(self, count):
+        if self.mode == "repeat_one":
+            return [self.current] if self.current else []
+        ids = [video_id for _, video_id in self.order[self.cursor + 1:self.cursor + 1 + count]]
+        if self.loops and len(ids) < count and self.order:
+            ids += [video_id for _, video_id in self._get_next_cycle()[:count - len(ids)]]
+        return ids
+
+    # Switching shuffle on draws a new permutation of the songs still to come in this pass; switching it off returns to list order
+    def set_mode(self, mode):
+        reshuffle = (mode == "shuffle") != (self.mode == "shuffle")
+        self.mode = mode
+        self.next_cycle = None
+        if reshuffle and self.tracks:
+            current = self.order[self.cursor] if self.cursor >= 0 else None
+            self._arrange(current, keep_history=True)
+
+    # Queue contents from the playing song on, and the playing song's position in the play order
+    def get_state(self):
+        return {'position': self.cursor, 'size': len(self.order),
+                'ids': [video_id for _, video_id in self.order[max(self.cursor, 0):]]}
+
+    # Lay out the play order for the mode with the given entry (if any) playing. In shuffle
+    # mode it comes first, followed by a random permutation of the other songs; keep_history
+    # leaves the part of this pass before the cursor in place and shuffles only the rest.
+    def _arrange(self, current, keep_history=False):
+        if self.mode == "shuffle":
+            played = self.order[:self.cursor] if keep_history and current else []
+            others = [entry for entry in self.tracks if entry is not current and entry not in played]
+            random.shuffle(others)
+            self.order = played + ([current] if current else []) + others
+            self.cursor = len(played) if current else -1
+        else:
+            self.order = list(self.tracks)
+            self.cursor = self.order.index(current) if current else -1
+
+    # Position in the play order of a song before the current one, searching back from it. Songs
+    # after the cursor are not looked at: after a shuffle wraps they have not played in this pass.
+    def _find(self, video_id):
+        for position in range(self.cursor - 1, -1, -1):
+            if self.order[position][1] == video_id:
+                return position
+        return None
+
+    # Play order of the next pass through the queue; a new shuffle never starts with the song that just ended
+    def _get_next_cycle(self):
+        if self.next_cycle is None:
+            cycle = list(self.tracks)
+            if self.mode == "shuffle":
+                random.shuffle(cycle)
+                if len(cycle) > 1 and cycle[0] is self.order[-1]:
+                    swap = random.randrange(1, len(cycle))
+                    cycle[0], cycle[swap] = cycle[swap], cycle[0]
+            self.next_cycle = cycle
+        return self.next_cycle
 
-# In-memory caches for JSON data
-favorites_cache = []
-recent_cache = []
-search_cache = []
+    def _remember_current(self):
+        if self.current:
+            self.history.append(self.current)
 
-# Check UI queue for updates
-def check_ui_queue():
+    def _entry(self, video_id):
+        return (next(self.serials), video_id)
+
+RECENT_LIMIT = 50
+QUEUE_HISTORY_LIMIT = 200
+library = TrackLibrary(["playlist", "recent", "favorites"])
+play_queue = PlayQueue(QUEUE_HISTORY_LIMIT)
+
+# Hand a UI update to the Tk thread; updates sharing a key replace each other until drawn
+def post_ui(callback, *args, key=None):
+    global ui_wakeup_pending
+    with ui_lock:
+        if key is None:
+            ui_queue.put((callback, args))
+        else:
+            ui_coalesced[key] = (callback, args)
+        if ui_wakeup_pending:
+            return
+        ui_wakeup_pending = True
     try:
-        while not ui_queue.empty():
-            callback, args = ui_queue.get_nowait()
+        root.after(0, drain_ui_queue)
+    except RuntimeError:
+        pass  # Main loop not running yet; the drain scheduled at startup picks it up
+
+# Run all pending UI updates in one pass
+def drain_ui_queue():
+    global ui_wakeup_pending
+    with ui_lock:
+        ui_wakeup_pending = False
+        coalesced = list(ui_coalesced.values())
+        ui_coalesced.clear()
+    while not ui_queue.empty():
+        callback, args = ui_queue.get_nowait()
+        try:
             callback(*args)
-    except:
-        pass
-    root.after(100, check_ui_queue)
+        except Exception:
+            traceback.print_exc()
+    for callback, args in coalesced:
+        try:
+            callback(*args)
+        except Exception:
+            traceback.print_exc()
+
+# Current position in seconds, measured from the last (re)start so it does not drift after seeks
+def get_position():
+    if active_stream:
+        return active_stream.position()
+    if not is_playing:
+        return seek_offset
+    now = paused_at if paused_at is not None else time.monotonic()
+    return seek_offset + max(0.0, now - play_started_at)
+
+# Restart the position clock at a new offset
+def reset_clock(position):
+    global seek_offset, play_started_at, paused_at
+    seek_offset = position
+    play_started_at = time.monotonic()
+    paused_at = play_started_at if is_paused else None
+
+def pause_clock():
+    global paused_at
+    if paused_at is None:
+        paused_at = time.monotonic()
+
+def resume_clock():
+    global play_started_at, paused_at
+    if paused_at is not None:
+        play_started_at += time.monotonic() - paused_at
+        paused_at = None
+
+# Long-lived playback engine. The audio device is opened once and sources are swapped on it,
+# and the next song can be queued behind the current one so track changes are near gapless.
+class PlaybackEngine:
+    def __init__(self, buffer=2048):
+        self.buffer = buffer
+        self.lock = threading.Lock()
+        self.current_path = None
+        self.queued_path = None
+        self.handoff_path = None  # Queued song the mixer moved on to, until the player adopts it
+        self.handoff_position = 0.0
+        self.loaded_offset = 0  # Byte offset the current file was opened at
+        self.last_pos = 0
+        self.switch_requested_at = None
+        self.last_switch_latency = None
+        self.on_switch = None  # Hook called as on_switch(seconds, source) when a new song starts
+
+    # Open the audio device once; later calls return immediately
+    def open(self):
+        with self.lock:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init(buffer=self.buffer)  # Larger buffer for smoother seeking
+                pygame.mixer.set_reserved(1)  # Channel 0 belongs to progressive streams
+
+    def play(self, path, start=0.0):
+        self.open()
+        self.current_path = path
+        self._start_at(start, reload=True)
+
+    def seek(self, position, paused=False):
+        self._start_at(position, reload=False)
+        if paused:
+            pygame.mixer.music.pause()
+
+    # Start the current file at a position. With a seek index the file is reopened at the
+    # nearest indexed frame so the decoder skips at most SEEK_INDEX_INTERVAL seconds.
+    def _start_at(self, position, reload):
+        frame_time, offset = find_seek_point(self.current_path, position) if position > 0 else (0.0, 0)
+        if reload or offset or self.loaded_offset:
+            source = OffsetFile(self.current_path, offset) if offset else self.current_path
+            pygame.mixer.music.load(source, os.path.splitext(self.current_path)[1].lstrip('.'))
+            self.loaded_offset = offset
+            self.queued_path = None  # Loading drops the mixer's queue
+        pygame.mixer.music.play(start=position - frame_time)
+        self.last_pos = 0
+
+    def pause(self):
+        pygame.mixer.music.pause()
+
+    def unpause(self):
+        pygame.mixer.music.unpause()
+
+    def stop(self):
+        if pygame.mixer.get_init():
+            pygame.mixer.music.stop()
+        self.queued_path = None
+        self.handoff_path = None
+        self.last_pos = 0
+
+    def is_busy(self):
+        return bool(pygame.mixer.get_init()) and pygame.mixer.music.get_busy()
+
+    # Queue a file to start as soon as the current one ends; replaces any earlier queued file
+    def queue(self, path):
+        if path != self.queued_path:
+            pygame.mixer.music.queue(path)
+            self.queued_path = path
+
+    # True once the mixer has moved on to the queued file; get_pos() restarts from zero when it does
+    def poll_handoff(self):
+        if not self.queued_path:
+            return False
+        pos = pygame.mixer.music.get_pos()
+        if pos < 0 or pos >= self.last_pos:
+            self.last_pos = max(pos, self.last_pos)
+            return False
+        self.current_path = self.handoff_path = self.queued_path
+        self.queued_path = None
+        self.loaded_offset = 0
+        self.handoff_position = pos / 1000
+        self.last_pos = pos
+        self.mark_switch()
+        return True
+
+    # Whether the song the player wants next is the one already playing from the queue
+    def take_handoff(self, path):
+        adopted = path is not None and path == self.handoff_path
+        self.handoff_path = None
+        return adopted
+
+    # Track-switch latency: from the request for a new song until its audio starts
+    def mark_switch(self):
+        self.switch_requested_at = time.perf_counter()
+
+    def report_switch(self, source):
+        if self.switch_requested_at is None:
+            return
+        self.last_switch_latency = time.perf_counter() - self.switch_requested_at
+        self.switch_requested_at = None
+        if self.on_switch:
+            self.on_switch(self.last_switch_latency, source)
+
+    def close(self):
+        with self.lock:
+            if pygame.mixer.get_init():
+                pygame.mixer.music.stop()
+                pygame.mixer.quit()
 
 # Play or pause the current song
-def play():
-    global is_playing, is_paused, music_length, current_song, seek_offset
-    song_files = [f for f in os.listdir(CACHE_DIR) if os.path.isfile(os.path.join(CACHE_DIR, f))]
-    if not song_files:
+def play(song_path=None):
+    global is_paused, current_song_path
+    if song_path is None and active_stream and is_playing:
+        toggle_stream_pause()
+        return
+
+    if song_path is not None:
+        current_song_path = song_path
+
+    if not current_song_path:
         set_status("No song file found!")
         return
 
-    song_path = os.path.join(CACHE_DIR, song_files[0])
+    song_path = current_song_path
 
     if not is_playing:
         if not os.path.exists(song_path):
@@ -70,39 +647,68 @@ def play():
             return
 
         try:
-            pygame.mixer.init(buffer=2048)  # Larger buffer for smoother seeking
-            pygame.mixer.music.load(song_path)
-            pygame.mixer.music.play(start=seek_offset)
-            song_name(os.path.basename(song_path))
-            progress_var.set(0)  # Reset progress bar
-            seek_offset = 0
-
-            audio = MP3(song_path)
-            music_length = audio.info.length
-            progress_bar.config(to=music_length)
-            update_time_display(0)
-
-            update_progress_bar()
-            is_playing = True
-            is_paused = False
-            play_button.config(text="⏸")
-            pygame.mixer.music.set_endevent(pygame.USEREVENT)
-            set_status("Playing")
+            with timings.span('play.load', id=os.path.splitext(os.path.basename(song_path))[0]):
+                engine.play(song_path, seek_offset)
+            show_playing(song_path, seek_offset)
+            engine.report_switch('file')
         except Exception as e:
             set_status(f"Error playing song: {e}")
 
     elif is_playing and not is_paused:
-        pygame.mixer.music.pause()
+        engine.pause()
         is_paused = True
+        pause_clock()
+        cancel_progress_update()
         play_button.config(text="▶")
         set_status("Paused")
 
     elif is_playing and is_paused:
-        pygame.mixer.music.unpause()
+        engine.unpause()
         is_paused = False
+        resume_clock()
+        schedule_progress_update()
         play_button.config(text="⏸")
         set_status("Playing")
 
+# Show a song that has just started in the player and line up what plays after it
+def show_playing(song_path, position=0.0):
+    global is_playing, is_paused, music_length
+    pin_cache_files(song_path)
+    song_name(current_song['title'] if current_song else os.path.basename(song_path))
+    music_length = get_song_length(song_path)
+    progress_bar.config(to=music_length)
+    progress_var.set(position)
+    update_time_display(position)
+
+    is_playing = True
+    is_paused = False
+    reset_clock(position)
+    schedule_progress_update()
+    play_button.config(text="⏸")
+    set_status("Playing")
+    prefetch_upcoming()
+    queue_upcoming()
+    if song_path.endswith('.mp3') and not os.path.exists(get_sidecar_path(song_path, 'seek')):
+        scheduler.submit(build_seek_index, song_path, priority=PRIORITY_BATCH, key=('seek_index', song_path))
+
+# Queue the next song behind the current one when it is already cached, so the change is gapless
+def queue_upcoming():
+    if active_stream or not is_playing or not current_song or not music_length:
+        return
+    upcoming = play_queue.upcoming(1)
+    song = library.tracks.get(upcoming[0]) if upcoming else None
+    if not song:
+        return
+    with cache_lock:
+        entry = cache_index.get(song['id'])
+    if entry:
+        queued_path = os.path.join(CACHE_DIR, entry['file'])
+        try:
+            engine.queue(queued_path)
+        except pygame.error:
+            return  # It is loaded normally when its turn comes
+        pin_cache_files(current_song_path, queued_path)
+
 # Display the song name in the UI
 def song_name(name):
     song_title.config(text=name[:50] + "..." if len(name) > 50 else name)
@@ -117,52 +723,46 @@ def update_time_display(seconds):
 
 # Update the progress bar and check for song end
 def update_progress_bar():
-    global is_playing, is_paused, current_playlist_index, is_seeking
-    if is_playing and not is_paused and pygame.mixer.music.get_busy() and not is_seeking:
-        current_time = pygame.mixer.music.get_pos() / 1000
-        total_time = seek_offset + current_time
-        if total_time <= music_length:
-            progress_var.set(total_time)
-            update_time_display(total_time)
-        else:
-            progress_var.set(music_length)
-            update_time_display(music_length)
-    
-    for event in pygame.event.get():
-        if event.type == pygame.USEREVENT and is_playing and not is_paused:
-            handle_song_end()
-    
-    root.after(1000, update_progress_bar)
+    global progress_job
+    progress_job = None
+    if not is_playing or is_paused or is_seeking:
+        return
 
-# Handle song end based on playback mode
-def handle_song_end():
-    global current_playlist_index, playback_mode
-    if playback_mode == "repeat_one":
-        download_play(current_song['url'], current_song['title'])
-    else:
-        playlist = search_cache
-        if not playlist:
-            stop_current_song()
-            set_status("Playlist is empty")
+    if not active_stream:  # Streams report their own end through on_stream_end
+        if engine.poll_handoff() or not engine.is_busy():
+            handle_song_end()
             return
 
-        if playback_mode == "shuffle":
-            current_playlist_index = random.randint(0, len(playlist) - 1)
-        elif playback_mode == "repeat_all" or current_playlist_index < len(playlist) - 1:
-            current_playlist_index = (current_playlist_index + 1) % len(playlist) if playback_mode == "repeat_all" else current_playlist_index + 1
-        else:
-            stop_current_song()
-            set_status("Playback stopped")
-            return
+    total_time = min(get_position(), music_length)
+    progress_var.set(total_time)
+    update_time_display(total_time)
+    schedule_progress_update()
 
-        if 0 <= current_playlist_index < len(playlist):
-            song = playlist[current_playlist_index]
-            current_song = {'title': song['title'], 'url': song['url']}
-            download_play(song['url'], song['title'])
-            update_favorite_button_state(song['title'])
-        else:
-            stop_current_song()
-            set_status("Invalid playlist index")
+# Schedule the next progress tick for when the displayed second changes
+def schedule_progress_update():
+    global progress_job
+    cancel_progress_update()
+    if is_playing and not is_paused and not is_seeking:
+        position = get_position()
+        delay = 1.0 - (position % 1.0)
+        if engine.queued_path and music_length:
+            delay = min(delay, max(0.0, music_length - position) + 0.05)  # Catch the queued song starting
+        progress_job = root.after(max(50, int(delay * 1000) + 10), update_progress_bar)
+
+def cancel_progress_update():
+    global progress_job
+    if progress_job is not None:
+        root.after_cancel(progress_job)
+        progress_job = None
+
+# Handle song end based on playback mode
+def handle_song_end():
+    video_id = play_queue.next(auto=True)
+    if video_id is None:
+        stop_current_song()
+        set_status("Playback stopped")
+        return
+    play_queued(video_id)
 
 # Seek to a specific position in the song
 def on_seek(val, update_audio=True):
@@ -175,13 +775,23 @@ def on_seek(val, update_audio=True):
         return
     last_seek_time = current_time
 
+    if active_stream and float(val) > active_stream.seekable_until():
+        if update_audio:
+            set_status("That part of the song has not downloaded yet")
+            progress_var.set(active_stream.position())
+        return
+
     try:
         seek_offset = float(val)
         progress_var.set(seek_offset)
         update_time_display(seek_offset)
         
-        if update_audio and not is_paused:
-            pygame.mixer.music.play(start=seek_offset)
+        if update_audio and active_stream:
+            active_stream.seek(seek_offset)
+        elif update_audio:
+            engine.seek(seek_offset, is_paused)
+            reset_clock(seek_offset)
+            queue_upcoming()  # Reopening at an indexed frame drops the queued song
     except Exception as e:
         set_status(f"Seek error: {e}")
 
@@ -191,8 +801,9 @@ def on_seek_drag(event):
     if not is_playing:
         return
     is_seeking = True
-    if not is_paused:
-        pygame.mixer.music.pause()
+    cancel_progress_update()
+    if not is_paused and not active_stream:
+        engine.pause()
     val = progress_var.get()
     on_seek(val, update_audio=False)
 
@@ -205,74 +816,223 @@ def on_seek_release(event):
     val = progress_var.get()
     on_seek(val, update_audio=True)
     if not is_paused:
-        pygame.mixer.music.unpause()
+        if not active_stream:
+            engine.unpause()
         set_status("Playing")
+    schedule_progress_update()
 
-# Search for songs by name
-def search_by_name():
-    query = search_entry.get().strip()
+# Search for songs by name, showing cached results immediately. Returns the search job,
+# or None when the cached results are fresh.
+def search_by_name(query=None):
+    global latest_search_query, latest_search_text, loading_more_results
+    query = (search_entry.get() if query is None else query).strip()
     if not query:
         set_status("Please enter a search query")
-        return
+        return None
 
-    set_status("Searching...")
-    threading.Thread(target=perform_search, args=(query,), daemon=True).start()
+    latest_search_query = normalize_query(query)
+    latest_search_text = query
+    # A page still loading belongs to the old results; a cancelled job never reports back
+    scheduler.cancel_group('more')
+    loading_more_results = False
+    entry = lookup_search_cache(latest_search_query)
+    if entry:
+        update_search_results(entry['results'], query=latest_search_query)
+        if time.time() - entry['time'] < SEARCH_CACHE_FRESH_SECONDS:
+            return None
+        set_status("Refreshing results...")
+        refresh_count = len(entry['results'])
+    else:
+        set_status("Searching...")
+        refresh_count = 0
+    return scheduler.submit(perform_search, query, refresh_count, priority=PRIORITY_CURRENT, group='search', supersede=True)
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def perform_search(query):
-    max_results = 50
-    ydl_opts = {
-        'quiet': True,
-        'extract_flat': True,
-        'default_search': 'ytsearch',
+# Fetch the first page of results, or as many as a stale cache entry held when refreshing
+def perform_search(query, refresh_count=0):
+    try:
+        with timings.span('search'):
+            session, video_list = fetcher.call('search', fetch_first_pages, query, refresh_count)
+        store_search_cache(session['query'], video_list)
+        post_ui(start_search_session, session, video_list)
+    except JobCancelled:
+        pass
+    except Exception as e:
+        post_ui(set_status, f"Search error: {e}", key='status')
+
+# One attempt at a search: open a session and read pages until refresh_count results are in
+def fetch_first_pages(query, refresh_count):
+    session = open_search_session(query)
+    video_list = []
+    try:
+        while True:
+            video_list += fetch_search_page(session)
+            if session['exhausted'] or len(video_list) >= refresh_count:
+                return session, video_list
+            raise_if_cancelled()
+    except BaseException:
+        release_search_session(session)
+        raise
+
+# Open a lazy yt-dlp result iterator for a query, skipping results already shown
+def open_search_session(query, skip=0):
+    ydl = extractor_pool.acquire('search')
+    # process=False keeps 'entries' as a generator that requests YouTube pages on demand
+    session = {
+        'query': normalize_query(query),
+        'ydl': ydl,
+        'entries': iter([]),
+        'lock': threading.Lock(),
+        'exhausted': False,
+    }
+    try:
+        with timings.span('search.extract'):
+            search_results = ydl.extract_info(f"ytsearch{SEARCH_MAX_RESULTS}:{query}", download=False, process=False)
+        session['entries'] = iter((search_results or {}).get('entries') or [])
+        for _ in itertools.islice(session['entries'], skip):
+            pass
+    except Exception:
+        release_search_session(session)
+        raise
+    return session
+
+# Pull the next SEARCH_PAGE_SIZE results from a search session
+def fetch_search_page(session):
+    page = []
+    with session['lock'], timings.span('search.page'):
+        if session['exhausted']:
+            return page
+        for entry in session['entries']:
+            if entry:
+                page.append(make_search_entry(entry))
+            if len(page) == SEARCH_PAGE_SIZE:
+                break
+        else:
+            release_search_session(session)
+    return page
+
+# Convert a flat yt-dlp search entry into a playlist item, keeping the numeric duration
+def make_search_entry(entry):
+    meta = TrackMeta.from_info(entry)
+    url = f"https://www.youtube.com/watch?v={meta.id}" if meta.id else "N/A"
+    return {
+        'title': meta.title or 'Unknown Title',
+        'url': url,
+        'duration': meta.duration,
+        'channel': meta.channel,
     }
 
+# Mark a session finished and hand its extractor back to the pool
+def release_search_session(session):
+    if session['ydl'] is not None:
+        extractor_pool.release('search', session['ydl'])
+        session['ydl'] = None
+    session['exhausted'] = True
+
+# Close a search session that is no longer shown, without blocking the UI
+def close_search_session(session):
+    def close():
+        with session['lock']:
+            release_search_session(session)
+    scheduler.submit(close, priority=PRIORITY_BATCH)
+
+# Make a finished search the one that "load more" continues from
+def start_search_session(session, video_list):
+    global search_session
+    if session['query'] != latest_search_query:
+        close_search_session(session)
+        return
+    if search_session and search_session is not session:
+        close_search_session(search_session)
+    search_session = session
+    update_search_results(video_list, query=session['query'])
+
+# Fetch the next page when the playlist is scrolled to the bottom
+def load_more_results():
+    global loading_more_results
+    if loading_more_results or not library.size("playlist") or latest_search_query is None:
+        return
+    session = search_session if search_session and search_session['query'] == latest_search_query else None
+    if session and session['exhausted']:
+        return
+    loading_more_results = True
+    set_status("Loading more songs...")
+    shown = [{key: track.get(key) for key in ('title', 'url', 'duration', 'channel')} for track in library.tracks_in("playlist")]
+    scheduler.submit(perform_load_more, latest_search_text, session, shown,
+                     priority=PRIORITY_CURRENT, key=('more', latest_search_query), group='more')
+
+# Worker for load_more_results; reopens the search when the shown results came from the cache
+def perform_load_more(query, session, shown):
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_results = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
-        
-        video_list = []
-        if search_results and 'entries' in search_results:
-            for entry in search_results['entries']:
-                if entry:
-                    title = entry.get('title', 'Unknown Title')
-                    video_id = entry.get('id', '')
-                    url = f"https://www.youtube.com/watch?v={video_id}" if video_id else "N/A"
-                    duration = entry.get('duration', 0) or 0
-                    video_list.append({
-                        'title': title,
-                        'url': url,
-                        'duration': f"{duration // 60} min {duration % 60} sec"
-                    })
-
-        global search_cache
-        with file_lock:
-            search_cache = video_list
-            os.makedirs('.cache', exist_ok=True)
-            with open(os.path.join('.cache', 'search.json'), 'w', encoding='utf-8') as f:
-                json.dump(video_list, f, indent=2, ensure_ascii=False)
-
-        ui_queue.put((update_search_results, (video_list,)))
+        if session is None:
+            session = fetcher.call('search', open_search_session, query, skip=len(shown))
+        page = fetch_search_page(session)
+        if page:
+            store_search_cache(session['query'], shown + page)
+        post_ui(append_search_results, session, page)
     except Exception as e:
-        ui_queue.put((set_status, (f"Search error: {e}",)))
+        post_ui(append_search_results, None, [])
+        post_ui(set_status, f"Search error: {e}", key='status')
+
+# Append a page of results to the playlist
+def append_search_results(session, page):
+    global search_session, loading_more_results
+    loading_more_results = False
+    if session is None:
+        return
+    if session['query'] != latest_search_query:
+        close_search_session(session)
+        return
+    if search_session and search_session is not session:
+        close_search_session(search_session)
+    search_session = session
+    if page:
+        library.extend_list("playlist", page)
+        playlist_view.extend(video["title"] for video in page)
+    set_status(f"Found {library.size('playlist')} songs")
+
+# Show search results in the playlist, ignoring results for an outdated query
+def update_search_results(video_list, query=None):
+    if query is not None and query != latest_search_query:
+        return
+    if [get_track_id(video) for video in video_list] == library.lists["playlist"].ids:
+        set_status(f"Found {len(video_list)} songs")
+        return
 
-def update_search_results(video_list):
-    playlist_listbox.delete(0, END)
-    for video in video_list:
-        add_to_listbox(section="playlist", item=video["title"])
+    library.set_list("playlist", video_list)
+    playlist_view.set_items(video["title"] for video in video_list)
     set_status(f"Found {len(video_list)} songs")
 
+# Normalize a query so trivial differences share one cache entry
+def normalize_query(query):
+    return ' '.join(query.casefold().split())
+
+# Return the cache entry for a normalized query unless it has expired
+def lookup_search_cache(query):
+    entry = store.get_search(query, SEARCH_CACHE_MAX_AGE_SECONDS)
+    if entry:
+        for video in entry['results']:
+            video['duration'] = parse_duration(video.get('duration'))
+        writer.submit('touch_search', query=query, time=time.time())
+    return entry
+
+# Store fresh results for a query, keeping the cache bounded
+def store_search_cache(query, video_list):
+    writer.submit('put_search', query=query, results=video_list, time=time.time(), max_entries=SEARCH_CACHE_MAX_ENTRIES)
+
 # Stop the current song
 def stop_current_song():
-    global is_playing, is_paused, is_seeking, seek_offset
+    global is_playing, is_paused, is_seeking, seek_offset, active_stream, paused_at
     try:
-        if pygame.mixer.get_init():
-            pygame.mixer.music.stop()
-            pygame.mixer.quit()
+        cancel_progress_update()
+        if active_stream:
+            active_stream.stop()
+            active_stream = None
+        engine.stop()
         is_playing = False
         is_paused = False
         is_seeking = False
         seek_offset = 0
+        paused_at = None
         progress_var.set(0)
         update_time_display(0)
         play_button.config(text="▶")
@@ -280,110 +1040,440 @@ def stop_current_song():
     except Exception as e:
         set_status(f"Error stopping music: {e}")
 
-# Delete the current song file
-def delete_current_song_file():
-    folder = CACHE_DIR
-    for filename in os.listdir(folder):
-        file_path = os.path.join(folder, filename)
-        if os.path.isfile(file_path):
-            for _ in range(3):
+# Library key for a song: its video ID, or the URL when it has none
+def get_track_id(track):
+    return track.get('id') or get_video_id(track['url']) or track['url']
+
+# Extract the YouTube video ID from a song URL
+def get_video_id(video_url):
+    parsed = urllib.parse.urlparse(video_url)
+    if parsed.hostname and parsed.hostname.endswith('youtu.be'):
+        return parsed.path.lstrip('/') or None
+    return urllib.parse.parse_qs(parsed.query).get('v', [None])[0]
+
+# Load the audio cache index and, when no other player is using the cache, remove files it does not know about
+def load_cache_index(keep_ids=()):
+    global cache_index, cache_index_stamp, instance_lock
+    entries, stamp = read_cache_index_file()
+    index = OrderedDict()
+    for video_id, entry in sorted(entries.items(), key=lambda item: item[1].get('last_used', 0)):
+        if os.path.isfile(os.path.join(CACHE_DIR, entry.get('file', ''))):
+            index[video_id] = entry
+
+    instance_lock = FileLock(INSTANCE_LOCK_FILE)
+    if instance_lock.acquire(blocking=False):
+        remove_unknown_cache_files(index, keep_ids)  # Nobody else can be writing into the cache
+        instance_lock.release()
+    instance_lock.acquire(shared=True)
+
+    with cache_lock:
+        cache_index = index
+        cache_index_stamp = stamp
+
+# Delete leftovers from interrupted downloads or the old delete-on-play layout
+def remove_unknown_cache_files(index, keep_ids):
+    known_files = {entry['file'] for entry in index.values()}
+    known_files.update(os.path.basename(get_sidecar_path(entry['file'], kind))
+                       for entry in index.values() for kind in CACHE_SIDECARS)
+    known_files.add(os.path.basename(CACHE_INDEX_FILE))
+    resumable = tuple(f"{video_id}.source." for video_id in keep_ids)  # Partial sync downloads
+    partial_cutoff = time.time() - DOWNLOAD_PARTIAL_MAX_AGE
+    for filename in os.listdir(CACHE_DIR):
+        file_path = os.path.join(CACHE_DIR, filename)
+        if filename in known_files or filename.startswith(resumable) or not os.path.isfile(file_path):
+            continue
+        try:
+            if '.partial.' in filename and os.path.getmtime(file_path) > partial_cutoff:
+                continue  # Resumed the next time the song is downloaded
+            os.remove(file_path)
+        except OSError:
+            pass
+    for filename in os.listdir(CACHE_LOCK_DIR):
+        file_path = os.path.join(CACHE_LOCK_DIR, filename)
+        if file_path not in (CACHE_INDEX_LOCK_FILE, INSTANCE_LOCK_FILE):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+# Entries of index.json and the (mtime_ns, size) stamp of the file they were read from
+def read_cache_index_file():
+    try:
+        with open(CACHE_INDEX_FILE, 'r', encoding='utf-8') as f:
+            stat = os.fstat(f.fileno())
+            entries = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}, None
+    return (entries if isinstance(entries, dict) else {}), (stat.st_mtime_ns, stat.st_size)
+
+# Fold index.json entries written by other players into the in-memory index. The latest use of
+# a song wins, songs this player evicted stay out, and songs missing from the file are kept
+# only while their file exists; otherwise another player has evicted them.
+def merge_cache_entries(entries, stamp):
+    global cache_index, cache_index_stamp
+    with cache_lock:
+        merged = {video_id: entry for video_id, entry in entries.items() if video_id not in cache_evicted}
+        for video_id, entry in cache_index.items():
+            other = merged.get(video_id)
+            if other is not None:
+                if entry.get('last_used', 0) >= other.get('last_used', 0):
+                    merged[video_id] = entry
+            elif os.path.isfile(os.path.join(CACHE_DIR, entry['file'])):
+                merged[video_id] = entry
+        cache_index = OrderedDict(sorted(merged.items(), key=lambda item: item[1].get('last_used', 0)))
+        cache_index_stamp = stamp
+
+# Pick up songs that other players have added to index.json since it was last read
+def refresh_cache_index():
+    try:
+        stat = os.stat(CACHE_INDEX_FILE)
+    except OSError:
+        return
+    if (stat.st_mtime_ns, stat.st_size) != cache_index_stamp:
+        merge_cache_entries(*read_cache_index_file())
+
+# Save the audio cache index to disk on the next persistence flush
+def save_cache_index():
+    writer.schedule('cache_index', write_cache_index)
+
+# Merge index.json with this player's changes and rewrite it; index.lock keeps players
+# sharing the cache from overwriting each other's entries
+def write_cache_index():
+    global cache_index_stamp
+    with FileLock(CACHE_INDEX_LOCK_FILE):
+        merge_cache_entries(*read_cache_index_file())
+        with cache_lock:
+            snapshot = dict(cache_index)
+            cache_evicted.clear()
+        write_file_atomic(CACHE_INDEX_FILE, json.dumps(snapshot, indent=2))
+        stat = os.stat(CACHE_INDEX_FILE)
+        with cache_lock:
+            cache_index_stamp = (stat.st_mtime_ns, stat.st_size)
+
+# Lock file coordinating a song's cache entry between players
+def get_entry_lock_path(video_id):
+    return os.path.join(CACHE_LOCK_DIR, f"{video_id}.lock")
+
+# Exclusive use of a song's cache entry, waiting while another player downloads it
+@contextmanager
+def locked_cache_entry(video_id):
+    if not video_id:
+        yield
+        return
+    lock = FileLock(get_entry_lock_path(video_id))
+    while not lock.acquire(blocking=False):
+        raise_if_cancelled()
+        time.sleep(0.2)
+    try:
+        yield
+    finally:
+        lock.release()
+
+# Hold shared locks on the cached songs loaded in the mixer, so no player evicts them meanwhile
+def pin_cache_files(*song_paths):
+    video_ids = {os.path.splitext(os.path.basename(path))[0] for path in song_paths if path}
+    for video_id in list(pinned_entries):
+        if video_id not in video_ids:
+            pinned_entries.pop(video_id).release()
+    for video_id in video_ids - pinned_entries.keys():
+        lock = FileLock(get_entry_lock_path(video_id))
+        if lock.acquire(shared=True, blocking=False):
+            pinned_entries[video_id] = lock
+
+# Return the cached file for a video ID and mark it as recently used
+def cache_lookup(video_id):
+    with cache_lock:
+        missing = video_id not in cache_index
+    if missing:
+        refresh_cache_index()  # Another player may have downloaded it
+    with cache_lock:
+        entry = cache_index.get(video_id)
+        if not entry:
+            return None
+        song_path = os.path.join(CACHE_DIR, entry['file'])
+        if not os.path.isfile(song_path):
+            del cache_index[video_id]
+            return None
+        entry['last_used'] = time.time()
+        cache_index.move_to_end(video_id)
+    save_cache_index()
+    return song_path
+
+# Register a downloaded file in the cache, save its metadata next to it and evict old songs over the budget
+def cache_store(video_id, song_path, meta=None):
+    meta = meta or TrackMeta(id=video_id)
+    meta.filesize = os.path.getsize(song_path)
+    if song_path.endswith('.mp3') and meta.codec != 'mp3':
+        meta.codec, meta.bitrate = 'mp3', float(MP3_BITRATE_KBPS)  # Re-encoded from the source stream
+    write_file_atomic(get_sidecar_path(song_path, 'meta'), json.dumps(asdict(meta), ensure_ascii=False))
+    with cache_lock:
+        cache_index[video_id] = {
+            'file': os.path.basename(song_path),
+            'size': meta.filesize,
+            'last_used': time.time(),
+            'duration': meta.duration or None,
+        }
+        cache_index.move_to_end(video_id)
+    evict_cache()
+    write_cache_index()  # Published now: other players may be waiting for this song
+
+# Delete least recently used songs until the cache fits in CACHE_MAX_BYTES
+def evict_cache():
+    with cache_lock:
+        total_size = sum(entry['size'] for entry in cache_index.values())
+        for video_id in list(cache_index):
+            if total_size <= CACHE_MAX_BYTES:
+                break
+            entry = cache_index[video_id]
+            file_path = os.path.join(CACHE_DIR, entry['file'])
+            if file_path == current_song_path:
+                continue  # Still loaded by the mixer
+            entry_lock = FileLock(get_entry_lock_path(video_id))
+            if not entry_lock.acquire(blocking=False):
+                continue  # Playing or being downloaded here or in another player
+            try:
                 try:
-                    with file_lock:
-                        os.remove(file_path)
-                    break
-                except PermissionError:
-                    time.sleep(0.5)
-                except Exception as e:
-                    set_status(f"Error deleting file {file_path}: {e}")
-                    break
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                for kind in CACHE_SIDECARS:
+                    try:
+                        os.remove(get_sidecar_path(file_path, kind))
+                    except OSError:
+                        pass
+                try:
+                    os.remove(entry_lock.path)
+                except OSError:
+                    pass
+            finally:
+                entry_lock.release()
+            total_size -= entry['size']
+            del cache_index[video_id]
+            cache_evicted.add(video_id)
+
+# Song length in seconds from the cache index or the metadata sidecar; only files cached
+# before metadata was recorded are opened with mutagen
+def get_song_length(song_path):
+    video_id = os.path.splitext(os.path.basename(song_path))[0]
+    entry = cache_index.get(video_id)
+    if entry and entry.get('duration'):
+        return float(entry['duration'])
+    meta = load_track_meta(song_path)
+    if meta and meta.duration:
+        return meta.duration
+    with timings.span('play.mutagen', id=video_id):
+        from mutagen import File as MutagenFile
+        audio = MutagenFile(song_path)
+    return audio.info.length if audio else 0
+
+# Metadata of one track, captured from yt-dlp at search or download time
+@dataclass
+class TrackMeta:
+    id: str
+    title: str = ''
+    duration: float = 0.0  # Seconds
+    channel: str = ''
+    codec: str = ''
+    bitrate: float = 0.0  # kbps
+    filesize: int = 0  # Bytes of the cached file, 0 until downloaded
+
+    # Build from a yt-dlp info dict or flat search entry
+    @classmethod
+    def from_info(cls, info):
+        return cls(
+            id=info.get('id') or '',
+            title=info.get('title') or '',
+            duration=parse_duration(info.get('duration')),
+            channel=info.get('channel') or info.get('uploader') or '',
+            codec=info.get('acodec') if info.get('acodec') not in (None, 'none') else '',
+            bitrate=float(info.get('abr') or 0),
+            filesize=int(info.get('filesize') or info.get('filesize_approx') or 0),
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+# Duration in seconds from a number or the "X min Y sec" text older search caches stored
+def parse_duration(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r'(\d+) min (\d+) sec', value or '')
+    return float(int(match.group(1)) * 60 + int(match.group(2))) if match else 0.0
+
+# Read the metadata sidecar of a cached song
+def load_track_meta(song_path):
+    try:
+        with open(get_sidecar_path(song_path, 'meta'), 'r', encoding='utf-8') as f:
+            return TrackMeta.from_dict(json.load(f))
+    except (OSError, json.JSONDecodeError, TypeError):
+        return None
+
+# Sidecar file of a cached song: 'seek' holds its seek index, 'meta' its TrackMeta
+def get_sidecar_path(song_path, kind):
+    return f"{os.path.splitext(song_path)[0]}.{kind}.json"
+
+# Scan an MP3 file once and save the byte offset of a frame every SEEK_INDEX_INTERVAL seconds
+def build_seek_index(song_path):
+    with open(song_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        points, duration = scan_mp3_frames(data)
+    index = {'size': os.path.getsize(song_path), 'duration': duration, 'points': points}
+    write_file_atomic(get_sidecar_path(song_path, 'seek'), json.dumps(index))
+
+# Walk the MP3 frame headers, skipping the ID3v2 tag and the Xing/Info frame, and
+# return [[seconds, byte offset], ...] plus the exact duration
+def scan_mp3_frames(data):
+    offset = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        offset = 10 + ((data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f))
+        if data[5] & 0x10:
+            offset += 10  # Tag footer
+
+    points = []
+    seconds = 0.0
+    next_point = 0.0
+    first_frame = True
+    while offset + 4 <= len(data):
+        b1, b2 = data[offset + 1], data[offset + 2]
+        version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+        bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+        if (data[offset] != 0xFF or b1 & 0xE0 != 0xE0 or version == 1 or layer != 1
+                or bitrate_index in (0, 15) or rate_index == 3):
+            offset = data.find(b'\xff', offset + 1)  # Lost sync; look for the next frame header
+            if offset < 0:
+                break
+            continue
+
+        mpeg1 = version == 3
+        sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+        bitrate = MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+        length = (144 if mpeg1 else 72) * bitrate // sample_rate + ((b2 >> 1) & 1)
+        if first_frame:
+            first_frame = False
+            if data.find(b'Xing', offset, offset + 64) >= 0 or data.find(b'Info', offset, offset + 64) >= 0:
+                offset += length  # Header frame with no audio
+                continue
+
+        if seconds >= next_point:
+            points.append([round(seconds, 4), offset])
+            next_point += SEEK_INDEX_INTERVAL
+        seconds += (1152 if mpeg1 else 576) / sample_rate
+        offset += length
+    return points, seconds
+
+# Indexed frame at or before a position as (seconds, byte offset); (0.0, 0) without an index
+def find_seek_point(song_path, position):
+    global seek_index_cache
+    if not song_path or not song_path.endswith('.mp3'):
+        return 0.0, 0
+    if seek_index_cache[0] != song_path:
+        try:
+            with open(get_sidecar_path(song_path, 'seek'), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return 0.0, 0  # Not built yet
+        points = index['points'] if index.get('size') == os.path.getsize(song_path) else []
+        seek_index_cache = (song_path, ([t for t, _ in points], [o for _, o in points]))
+    times, offsets = seek_index_cache[1]
+    i = bisect.bisect_right(times, position) - 1
+    return (times[i], offsets[i]) if i >= 0 else (0.0, 0)
+
+# Read-only view of a file that starts at a byte offset, so the decoder opens it at that frame
+class OffsetFile:
+    def __init__(self, path, offset):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.file.seek(offset)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position += self.offset
+        return self.file.seek(position, whence) - self.offset
+
+    def tell(self):
+        return self.file.tell() - self.offset
+
+    def close(self):
+        self.file.close()
+
+# Find the finished download for a video ID in the cache directory
+def find_downloaded_file(info, video_id):
+    for download in (info or {}).get('requested_downloads') or []:
+        file_path = download.get('filepath')
+        if file_path and os.path.isfile(file_path):
+            return file_path
+    for filename in os.listdir(CACHE_DIR):
+        if (filename.startswith(f"{video_id}.") and not filename.endswith(('.part', '.ytdl', '.json'))
+                and not filename.startswith(f"{video_id}.source.")):
+            return os.path.join(CACHE_DIR, filename)
+    return None
 
 # Toggle favorite status for the current song
 def toggle_favorite():
-    global current_song, favorites_cache
     if not current_song:
         set_status("No song selected")
         return
     
     song_title = current_song['title']
-    song_url = current_song['url']
+    video_id = current_song['id']
     
-    song_data = {'title': song_title, 'url': song_url}
-    if song_data not in favorites_cache:
-        favorites_cache.append(song_data)
-        add_to_listbox("favorites", song_title)
+    if not library.contains("favorites", video_id):
+        library.extend_list("favorites", [current_song])
+        fav_view.extend([song_title])
         favorite_button.config(text="♥")
         set_status(f"Added '{song_title}' to favorites")
+        writer.submit('add_favorite', track=get_track_row(current_song))
     else:
-        favorites_cache[:] = [f for f in favorites_cache if f['title'] != song_title]
-        fav_listbox.delete(0, END)
-        for f in favorites_cache:
-            add_to_listbox("favorites", f['title'])
+        fav_view.remove_at(library.remove("favorites", video_id))
         favorite_button.config(text="♡")
         set_status(f"Removed '{song_title}' from favorites")
-    
-    with file_lock:
-        with open(os.path.join(DATA_DIR, 'favorites.json'), 'w', encoding='utf-8') as f:
-            json.dump(favorites_cache, f, indent=2)
+        writer.submit('remove_favorite', video_id=video_id)
 
 # Play the next song
 def play_next():
-    global current_playlist_index, current_song, playback_mode
-    playlist = search_cache
-    if not playlist:
-        set_status("Playlist is empty")
+    if not len(play_queue):
+        set_status("Queue is empty")
         return
-    
-    if playback_mode == "shuffle":
-        current_playlist_index = random.randint(0, len(playlist) - 1)
-    elif playback_mode != "repeat_one" and current_playlist_index < len(playlist) - 1:
-        current_playlist_index += 1
-    else:
-        current_playlist_index = 0 if playback_mode == "repeat_all" else -1
-        if playback_mode != "repeat_all":
-            stop_current_song()
-            set_status("No more songs")
-            return
-    
-    if 0 <= current_playlist_index < len(playlist):
-        song = playlist[current_playlist_index]
-        current_song = {'title': song['title'], 'url': song['url']}
-        download_play(song['url'], song['title'])
-        update_favorite_button_state(song['title'])
-    else:
+    video_id = play_queue.next()
+    if video_id is None:
         stop_current_song()
-        set_status("Invalid playlist index")
+        set_status("No more songs")
+        return
+    play_queued(video_id)
 
 # Play the previous song
 def play_previous():
-    global current_playlist_index, current_song, playback_mode
-    playlist = search_cache
-    if not playlist:
-        set_status("Playlist is empty")
+    if not len(play_queue) and not play_queue.history:
+        set_status("Queue is empty")
         return
-    
-    if playback_mode == "shuffle":
-        current_playlist_index = random.randint(0, len(playlist) - 1)
-    elif playback_mode != "repeat_one" and current_playlist_index > 0:
-        current_playlist_index -= 1
-    else:
-        current_playlist_index = len(playlist) - 1 if playback_mode == "repeat_all" else -1
-        if playback_mode != "repeat_all":
-            stop_current_song()
-            set_status("No previous songs")
-            return
-    
-    if 0 <= current_playlist_index < len(playlist):
-        song = playlist[current_playlist_index]
-        current_song = {'title': song['title'], 'url': song['url']}
-        download_play(song['url'], song['title'])
-        update_favorite_button_state(song['title'])
-    else:
+    video_id = play_queue.previous()
+    if video_id is None:
+        stop_current_song()
+        set_status("No previous songs")
+        return
+    play_queued(video_id)
+
+# Play the song the queue has moved to
+def play_queued(video_id):
+    global current_song
+    song = library.tracks.get(video_id)
+    if not song:
         stop_current_song()
-        set_status("Invalid playlist index")
+        set_status("Song not found")
+        return
+    current_song = song
+    download_play(song['url'], song['title'])
+    update_favorite_button_state(song['id'])
 
 # Update the favorite button state
-def update_favorite_button_state(song_title):
-    favorite_button.config(text="♥" if any(f['title'] == song_title for f in favorites_cache) else "♡")
+def update_favorite_button_state(video_id):
+    favorite_button.config(text="♥" if library.contains("favorites", video_id) else "♡")
 
 # Cycle through playback modes
 def cycle_playback_mode():
@@ -391,8 +1481,12 @@ def cycle_playback_mode():
     modes = ["off", "shuffle", "repeat_one", "repeat_all"]
     current_index = modes.index(playback_mode)
     playback_mode = modes[(current_index + 1) % len(modes)]
+    play_queue.set_mode(playback_mode)
     update_mode_button()
     set_status(f"Playback mode: {playback_mode.replace('_', ' ').title()}")
+    if is_playing:
+        prefetch_upcoming()
+        queue_upcoming()
 
 # Update the mode button text
 def update_mode_button():
@@ -404,19 +1498,13 @@ def update_mode_button():
     }
     mode_button.config(text=mode_texts[playback_mode])
 
-# Play all songs starting from the first
+# Queue the whole playlist and play it from the first song (a random one in shuffle mode)
 def play_all():
-    global current_playlist_index, current_song
-    playlist = search_cache
-    if not playlist:
+    if not library.size("playlist"):
         set_status("Playlist is empty")
         return
 
-    current_playlist_index = 0
-    song = playlist[current_playlist_index]
-    current_song = {'title': song['title'], 'url': song['url']}
-    download_play(song['url'], song['title'])
-    update_favorite_button_state(song['title'])
+    play_queued(play_queue.load(library.lists["playlist"].ids, start=None if playback_mode == "shuffle" else 0))
     set_status("Playing all songs")
 
 # Add placeholder text to the search entry
@@ -439,335 +1527,2790 @@ def add_placeholder(entry, placeholder_text):
 
 # Handle listbox selection with debouncing
 def on_listbox_click(event, section):
-    global current_playlist_index, current_song, last_click_time
+    global last_click_time
     current_time = time.time()
     if current_time - last_click_time < 0.5:  # 500ms debounce
         return
     last_click_time = current_time
 
-    widget = event.widget
-    selection = widget.curselection()
-    if not selection:
+    index = list_views[section].selected_index()
+    if index is not None:
+        play_from_list(section, index)
+
+# Play the song at an index of the playlist, favorites or recent list; the rest of that list becomes the queue
+def play_from_list(section, index):
+    song = library.get(section, index)
+    if not song:
+        set_status(f"Song not found in {section}")
         return
 
-    index = selection[0]
-    value = widget.get(index)
     song_name("Loading song...")
     set_status("Loading song...")
-
     if section == "playlist":
-        playlist = search_cache
-        for i, video in enumerate(playlist):
-            if video["title"] == value:
-                current_playlist_index = i
-                current_song = {'title': video["title"], 'url': video["url"]}
-                add_recent(title=value, url=video["url"])
-                add_to_listbox(section="recent", item=value)
-                download_play(video["url"], value)
-                update_favorite_button_state(value)
-                break
-        else:
-            set_status("Song not found in playlist")
-
-    elif section == "recent":
-        for video in recent_cache:
-            if video["title"] == value:
-                current_song = {'title': video["title"], 'url': video["url"]}
-                download_play(video["url"], value)
-                update_favorite_button_state(value)
-                playlist = search_cache
-                for i, p in enumerate(playlist):
-                    if p['title'] == value:
-                        current_playlist_index = i
-                        break
-                else:
-                    current_playlist_index = -1
-                break
-        else:
-            set_status("Song not found in recent")
-
-    elif section == "favorites":
-        for video in favorites_cache:
-            if video["title"] == value:
-                current_song = {'title': video["title"], 'url': video["url"]}
-                download_play(video["url"], value)
-                update_favorite_button_state(value)
-                playlist = search_cache
-                for i, p in enumerate(playlist):
-                    if p['title'] == value:
-                        current_playlist_index = i
-                        break
-                else:
-                    current_playlist_index = -1
-                break
-        else:
-            set_status("Song not found in favorites")
+        add_recent(song)
+    play_queued(play_queue.load(library.lists[section].ids, start=index))
+
+# Add the song at an index of a list to the queue, either next or after everything queued
+def queue_from_list(section, index, play_next=False):
+    song = library.get(section, index)
+    if not song:
+        set_status(f"Song not found in {section}")
+        return
+    queue_track(song, play_next)
 
-# Download and play a song
+# Put a track in the queue and line up its download; returns how many songs play before it
+def queue_track(track, play_next=False):
+    video_id = library.add(track)
+    if play_next:
+        play_queue.insert_next(video_id)
+        ahead = 0
+    else:
+        ahead = play_queue.enqueue(video_id)
+    set_status(f"Queued '{library.tracks[video_id]['title']}'" + (" to play next" if play_next else ""))
+    if is_playing:
+        prefetch_upcoming()
+        queue_upcoming()
+    return ahead
+
+# Download and play a song, starting straight from the cache when possible
 def download_play(video_url, name):
-    global current_song, seek_offset
+    global seek_offset, current_song_path
+    writer.write_file(os.path.join('.cache', 'current_url.txt'), video_url)
+    video_id = get_video_id(video_url)
+    cached_path = cache_lookup(video_id) if video_id else None
+
+    if engine.take_handoff(cached_path):
+        # The mixer already moved on to this song from its queue
+        current_song_path = cached_path
+        show_playing(cached_path, engine.handoff_position)
+        engine.report_switch('queued')
+        return
+
+    engine.mark_switch()
     stop_current_song()
-    delete_current_song_file()
     seek_offset = 0
     progress_var.set(0)  # Reset progress bar
 
-    try:
-        with file_lock:
-            with open(os.path.join('.cache', 'current_url.txt'), 'w', encoding='utf-8') as f:
-                f.write(video_url)
-    except Exception as e:
-        set_status(f"Error saving URL: {e}")
-
-    ffmpeg_path = os.path.join(os.getcwd(), 'ffmpeg')
-    if not os.path.exists(ffmpeg_path):
-        ui_queue.put((set_status, ("FFmpeg not found in directory",)))
-        return
-
-    options = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(CACHE_DIR, f'{name}.%(ext)s'),
-        'ffmpeg_location': ffmpeg_path,
-        'postprocessors': [
-            {
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }
-        ],
+    if cached_path:
+        play(cached_path)
+        return
+
+    if not shutil.which(get_ffmpeg_executable()):
+        post_ui(set_status, "FFmpeg not found", key='status')
+        return
+
+    start_stream(video_url, name)
+
+# Raised inside a job once the scheduler has cancelled it
+class JobCancelled(Exception):
+    pass
+
+# A unit of background work submitted to the scheduler
+class Job:
+    def __init__(self, func, args, priority, key, group):
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.key = key
+        self.group = group
+        self.cancelled = threading.Event()
+        self.done = threading.Event()  # Set once the job has finished or was cancelled before it ran
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+
+# Priority scheduler with a fixed worker pool. Jobs with the same key are run once,
+# submitting with supersede=True cancels the rest of the group, and group_limits caps
+# how many jobs of a group run at the same time.
+class JobScheduler:
+    def __init__(self, workers, group_limits=None):
+        self.group_limits = group_limits or {}
+        self.heap = []
+        self.sequence = itertools.count()
+        self.jobs = {}  # key -> queued or running job
+        self.queued = set()
+        self.running = set()
+        self.cond = threading.Condition()
+        self.local = threading.local()
+        self.wait_times = deque(maxlen=200)
+        self.run_times = deque(maxlen=200)
+        self.counts = {'submitted': 0, 'deduplicated': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, func, *args, priority=PRIORITY_BATCH, key=None, group=None, supersede=False):
+        with self.cond:
+            if supersede and group:
+                self._cancel_where(lambda job: job.group == group and (key is None or job.key != key))
+            existing = self.jobs.get(key) if key is not None else None
+            if existing and not existing.cancelled.is_set():
+                self.counts['deduplicated'] += 1
+                if priority < existing.priority and existing in self.queued:
+                    existing.priority = priority  # Promote it; the old heap entry is skipped
+                    heapq.heappush(self.heap, (priority, next(self.sequence), existing))
+                    self.cond.notify()
+                return existing
+
+            job = Job(func, args, priority, key, group)
+            if key is not None:
+                self.jobs[key] = job
+            self.queued.add(job)
+            self.counts['submitted'] += 1
+            heapq.heappush(self.heap, (priority, next(self.sequence), job))
+            self.cond.notify()
+            return job
+
+    # Cancel every job of a group except those whose key is in keep
+    def cancel_group(self, group, keep=()):
+        with self.cond:
+            self._cancel_where(lambda job: job.group == group and job.key not in keep)
+
+    def _cancel_where(self, predicate):
+        for job in list(self.queued) + list(self.running):
+            if predicate(job) and not job.cancelled.is_set():
+                job.cancelled.set()
+                self.counts['cancelled'] += 1
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+                if job in self.queued:
+                    self.queued.discard(job)
+                    job.done.set()
+
+    # The job running on the calling thread, if any
+    def current_job(self):
+        return getattr(self.local, 'job', None)
+
+    def _next_job(self):
+        skipped = []
+        try:
+            while self.heap:
+                priority, sequence, job = heapq.heappop(self.heap)
+                if job not in self.queued or priority != job.priority:
+                    continue  # Cancelled, or a stale entry of a promoted job
+                limit = self.group_limits.get(job.group)
+                if limit is not None and sum(1 for other in self.running if other.group == job.group) >= limit:
+                    skipped.append((priority, sequence, job))
+                    continue
+                return job
+            return None
+        finally:
+            for entry in skipped:
+                heapq.heappush(self.heap, entry)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                job = self._next_job()
+                while job is None:
+                    self.cond.wait()
+                    job = self._next_job()
+                self.queued.discard(job)
+                self.running.add(job)
+                job.started_at = time.monotonic()
+                self.wait_times.append(job.started_at - job.submitted_at)
+
+            self.local.job = job
+            outcome = 'completed'
+            try:
+                job.func(*job.args)
+            except JobCancelled:
+                outcome = None  # Already counted when it was cancelled
+            except Exception:
+                outcome = 'failed'
+            finally:
+                self.local.job = None
+                with self.cond:
+                    self.running.discard(job)
+                    if self.jobs.get(job.key) is job:
+                        del self.jobs[job.key]
+                    self.run_times.append(time.monotonic() - job.started_at)
+                    if outcome and not job.cancelled.is_set():
+                        self.counts[outcome] += 1
+                    job.done.set()
+                    self.cond.notify_all()  # A group slot may have opened up
+
+    # Queue depth, job counts and wait/run latency percentiles in milliseconds
+    def get_stats(self):
+        with self.cond:
+            return {
+                'queued': len(self.queued),
+                'running': len(self.running),
+                **self.counts,
+                'wait_ms_p50': round(percentile(self.wait_times, 0.5) * 1000, 1),
+                'wait_ms_p95': round(percentile(self.wait_times, 0.95) * 1000, 1),
+                'run_ms_p50': round(percentile(self.run_times, 0.5) * 1000, 1),
+                'run_ms_p95': round(percentile(self.run_times, 0.95) * 1000, 1),
+            }
+
+# Nearest-rank percentile of a list of numbers; 0.0 when there are none
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+# True if the scheduler job running on this thread has been cancelled
+def current_job_cancelled():
+    job = scheduler.current_job() if scheduler else None
+    return bool(job and job.cancelled.is_set())
+
+# Stop the running job at a safe point once it has been cancelled; also used as a yt-dlp progress hook
+def raise_if_cancelled(*_):
+    if current_job_cancelled():
+        raise JobCancelled()
+
+# Bounded ring of timing spans, each {'stage', 'at' (wall clock), 'ms', 'outcome', ...fields}
+class SpanRecorder:
+    def __init__(self, capacity):
+        self.spans = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+
+    # Time the body of a with block; failures and cancellations are kept apart from the percentiles
+    @contextmanager
+    def span(self, stage, **fields):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        except JobCancelled:
+            outcome = 'cancelled'
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, outcome, **fields)
+
+    def record(self, stage, seconds, outcome='ok', **fields):
+        span = {'stage': stage, 'at': round(time.time(), 3), 'ms': round(seconds * 1000, 2), 'outcome': outcome, **fields}
+        with self.lock:
+            self.spans.append(span)
+
+    # Count, failures and rolling percentiles in milliseconds per stage, over the spans in the ring
+    def get_stats(self):
+        with self.lock:
+            spans = list(self.spans)
+        samples, failures = {}, {}
+        for span in spans:
+            samples.setdefault(span['stage'], [])
+            if span['outcome'] == 'ok':
+                samples[span['stage']].append(span['ms'])
+            else:
+                failures[span['stage']] = failures.get(span['stage'], 0) + 1
+        return {
+            stage: {
+                'count': len(values),
+                'failed': failures.get(stage, 0),
+                'p50_ms': percentile(values, 0.5),
+                'p95_ms': percentile(values, 0.95),
+                'max_ms': max(values, default=0.0),
+            }
+            for stage, values in sorted(samples.items())
+        }
+
+    # Write the ring as JSON lines tagged with this host's name; returns how many spans were written
+    def export(self, path):
+        with self.lock:
+            spans = list(self.spans)
+        host = socket.gethostname()
+        write_file_atomic(path, ''.join(json.dumps({**span, 'host': host}, ensure_ascii=False) + '\n' for span in spans))
+        return len(spans)
+
+# yt-dlp progress and postprocessor hook noting when the transfer and the post-processing start and end
+def mark_download_stage(progress):
+    marks = getattr(download_marks, 'times', None)
+    if marks is None:
+        return
+    stage = 'postprocess' if 'postprocessor' in progress else 'transfer'
+    now = time.perf_counter()
+    if progress.get('status') in ('downloading', 'started'):
+        marks.setdefault(stage + '_start', now)
+    elif progress.get('status') == 'finished':
+        marks.setdefault(stage + '_start', now)
+        marks[stage + '_end'] = now
+
+# Record one download as extraction (until the first byte), transfer and post-processing spans
+def record_download_stages(marks, outcome, video_id):
+    end = time.perf_counter()
+    extracted = marks.get('transfer_start') or marks.get('postprocess_start') or end
+    timings.record('download.extract', extracted - marks['start'], outcome, id=video_id)
+    for stage in ('transfer', 'postprocess'):
+        if stage + '_start' in marks:
+            seconds = marks.get(stage + '_end', end) - marks[stage + '_start']
+            timings.record('download.' + stage, seconds, outcome, id=video_id)
+
+# Track switches reported by the playback engine, by how the new song started
+def record_switch(seconds, source):
+    timings.record('switch.' + source, seconds)
+
+# Pool of reusable YoutubeDL instances, one set per option profile. Reusing an instance keeps
+# its loaded extractors and HTTP connections; callers beyond the pool size get a temporary one.
+class ExtractorPool:
+    def __init__(self, profiles, size, factory=None):
+        self.profiles = profiles
+        self.size = size
+        self.factory = factory or create_youtube_dl  # Called with a profile's options
+        self.idle = {name: [] for name in profiles}
+        self.lock = threading.Lock()
+
+    def acquire(self, profile):
+        with self.lock:
+            if self.idle[profile]:
+                return self.idle[profile].pop()
+        return self.factory(self.profiles[profile])
+
+    def release(self, profile, ydl):
+        with self.lock:
+            if len(self.idle[profile]) < self.size:
+                self.idle[profile].append(ydl)
+                return
+        ydl.close()
+
+    @contextmanager
+    def extractor(self, profile):
+        ydl = self.acquire(profile)
+        try:
+            yield ydl
+        finally:
+            self.release(profile, ydl)
+
+    # Build one instance per profile and load the YouTube extractors ahead of the first click
+    def warm_up(self):
+        for profile in self.profiles:
+            with self.extractor(profile) as ydl:
+                ydl.get_info_extractor('Youtube')
+                ydl.get_info_extractor('YoutubeSearch')
+
+    def close(self):
+        with self.lock:
+            instances = [ydl for idle in self.idle.values() for ydl in idle]
+            for idle in self.idle.values():
+                idle.clear()
+        for ydl in instances:
+            ydl.close()
+
+# Default extractor factory; yt-dlp is imported on first use
+def create_youtube_dl(options):
+    import yt_dlp
+    return yt_dlp.YoutubeDL(options)
+
+# Load an extractor factory given as "module:callable", e.g. a fake one for local testing
+def load_extractor_factory(spec):
+    if not spec or callable(spec):
+        return spec or None
+    module_name, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'create_extractor')
+
+# A request that failed for good; kind is 'transient' (retries used up), 'throttled' or 'permanent'
+class FetchError(Exception):
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+# Runs requests to YouTube with retries, a circuit breaker for rate limiting, and failure counts
+class Fetcher:
+    def __init__(self, max_attempts, backoff_base, backoff_max, cooldown, max_cooldown):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.lock = threading.Lock()
+        self.state = 'closed'  # 'open' refuses requests; 'half_open' lets a single probe through
+        self.cooldown = cooldown
+        self.open_until = 0.0
+        self.counts = {'requests': 0, 'succeeded': 0, 'retried': 0, 'transient': 0, 'throttled': 0,
+                       'permanent': 0, 'rejected': 0, 'breaker_opened': 0}
+        self.last_error = None
+
+    # Call fetch(*args, **kwargs), retrying transient failures; raises FetchError once it gives up
+    def call(self, operation, fetch, *args, **kwargs):
+        for attempt in itertools.count(1):
+            probe = self._admit()
+            try:
+                result = fetch(*args, **kwargs)
+            except JobCancelled:
+                self._release_probe(probe)
+                raise
+            except Exception as e:
+                kind = classify_error(e)
+                self._failed(operation, kind, e, probe)
+                if kind != 'transient' or attempt >= self.max_attempts:
+                    raise FetchError(kind, str(e)) from e
+                with self.lock:
+                    self.counts['retried'] += 1
+                wait_unless_cancelled(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))))
+            else:
+                self._succeeded(probe)
+                return result
+
+    # Let a request through, or refuse it while the breaker is open; True if it is the half-open probe
+    def _admit(self):
+        with self.lock:
+            self.counts['requests'] += 1
+            if self.state == 'closed':
+                return False
+            remaining = self.open_until - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+                return True
+            self.counts['rejected'] += 1
+        raise FetchError('throttled', f"YouTube is rate limiting requests; retrying in {max(1, round(remaining))} s")
+
+    def _succeeded(self, probe):
+        with self.lock:
+            self.counts['succeeded'] += 1
+            if probe:
+                self.state = 'closed'
+                self.cooldown = self.base_cooldown
+
+    def _failed(self, operation, kind, error, probe):
+        with self.lock:
+            self.counts[kind] += 1
+            self.last_error = f"{operation}: {error}"
+            if kind == 'throttled':
+                if probe:
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                if self.state != 'open':
+                    self.counts['breaker_opened'] += 1
+                self.state = 'open'
+                self.open_until = time.monotonic() + self.cooldown
+            elif probe:
+                self.state = 'closed'  # Not rate limited any more, whatever else went wrong
+
+    # A cancelled probe proves nothing; the next request probes again
+    def _release_probe(self, probe):
+        if probe:
+            with self.lock:
+                self.state = 'open'
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'breaker': self.state,
+                'retry_in': max(0.0, round(self.open_until - time.monotonic(), 1)) if self.state == 'open' else 0.0,
+                **self.counts,
+                'last_error': self.last_error,
+            }
+
+# 'throttled', 'transient' or 'permanent', from the HTTP status or message anywhere in the error's cause chain
+def classify_error(error):
+    chain = list(iter_error_chain(error))
+    for cause in chain:
+        status = getattr(cause, 'status', None) or getattr(cause, 'code', None)
+        if isinstance(status, int) and 400 <= status < 600:
+            if status == 429:
+                return 'throttled'
+            return 'transient' if status == 408 or status >= 500 else 'permanent'
+    messages = [str(cause) for cause in chain]
+    if any(THROTTLED_ERRORS.search(message) for message in messages):
+        return 'throttled'
+    if any(isinstance(cause, (TimeoutError, ConnectionError, socket.gaierror)) for cause in chain):
+        return 'transient'
+    if any(TRANSIENT_ERRORS.search(message) for message in messages):
+        return 'transient'
+    # Unavailable videos (private, members-only and geo-blocked ones answer 403), unsupported
+    # formats, missing files and anything unknown, including yt-dlp's bare "Unable to download"
+    return 'permanent'
+
+# An error followed by what caused it; yt-dlp keeps the original exception in exc_info
+def iter_error_chain(error):
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        exc_info = getattr(error, 'exc_info', None)
+        wrapped = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+        error = wrapped or error.__cause__ or error.__context__
+
+# Sleep before a retry, giving up early if the scheduler job on this thread is cancelled
+def wait_unless_cancelled(seconds):
+    job = scheduler.current_job() if scheduler else None
+    if job is None:
+        time.sleep(seconds)
+    elif job.cancelled.wait(seconds):
+        raise JobCancelled()
+
+# Option profiles served by the extractor pool
+def get_extractor_profiles():
+    return {
+        'search': {
+            'quiet': True,
+            'extract_flat': True,
+            'default_search': 'ytsearch',
+        },
+        'stream': {
+            'format': 'bestaudio[acodec=opus]/bestaudio[acodec=vorbis]' if AUDIO_MODE == 'native' else 'bestaudio/best',
+            'quiet': True,
+            'noplaylist': True,
+        },
+        'download': get_download_options(),
+        'download_mp3': get_download_options('mp3'),
+        # Raw audio only; the sync process pool converts it into the cache format
+        'sync': {
+            'format': 'bestaudio[acodec=opus]/bestaudio[acodec=vorbis]/bestaudio/best' if AUDIO_MODE == 'native' else 'bestaudio/best',
+            'outtmpl': os.path.join(CACHE_DIR, '%(id)s.source.%(ext)s'),
+            'quiet': True,
+            'noplaylist': True,
+            'continuedl': True,  # Resume a partial download left by an interrupted sync
+            'ratelimit': DOWNLOAD_BACKGROUND_RATE or None,
+            'progress_hooks': [sync_progress_hook],
+        },
+    }
+
+# yt-dlp options for downloading a song into the cache
+def get_download_options(mode=AUDIO_MODE):
+    if mode == 'native':
+        # Opus/Vorbis are copied into an Ogg container the mixer decodes directly
+        audio_format = 'bestaudio[acodec=opus]/bestaudio[acodec=vorbis]/bestaudio[ext=mp3]'
+        extract_audio = {'key': 'FFmpegExtractAudio', 'preferredcodec': 'best'}
+    else:
+        audio_format = 'bestaudio/best'
+        extract_audio = {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': str(MP3_BITRATE_KBPS)}
+
+    return {
+        'format': audio_format,
+        'outtmpl': os.path.join(CACHE_DIR, '%(id)s.%(ext)s'),
+        'ffmpeg_location': get_ffmpeg_executable(),
+        'postprocessors': [extract_audio],
         'postprocessor_args': ['-vn'],
         'quiet': True,
         'noplaylist': True,
         'keepvideo': False,
+        'continuedl': True,
+        'concurrent_fragment_downloads': DOWNLOAD_CONNECTIONS,  # For fragmented (DASH/HLS) formats
+        'progress_hooks': [raise_if_cancelled, mark_download_stage],
+        'postprocessor_hooks': [mark_download_stage],
     }
 
-    threading.Thread(target=perform_download, args=(video_url, options, name), daemon=True).start()
+# Download one song: in resumable chunks when its audio is a plain HTTP file in a format the
+# cache can hold, otherwise with yt-dlp, re-encoding only when no natively playable stream exists
+def download_audio(video_url):
+    video_id = get_video_id(video_url)
+    started = time.perf_counter()
+    info = None
+    try:
+        info = extract_stream_info(video_url)
+    except JobCancelled:
+        timings.record('download.extract', time.perf_counter() - started, 'cancelled', id=video_id)
+        raise
+    except Exception as e:
+        if 'Requested format is not available' not in str(e):
+            timings.record('download.extract', time.perf_counter() - started, 'error', id=video_id)
+            raise
+    if info and info.get('url', '').startswith(('http://', 'https://')) and get_stream_cache_format(info):
+        timings.record('download.extract', time.perf_counter() - started, id=video_id)
+        return download_in_chunks(info)
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def perform_download(video_url, options, name):
+    # yt-dlp extracts again; its extraction span starts with the probe so the song is counted once
     try:
-        with yt_dlp.YoutubeDL(options) as ydl:
-            ydl.download([video_url])
-        ui_queue.put((play, ()))
+        return run_download('download', video_url, started)
     except Exception as e:
-        ui_queue.put((set_status, (f"Download error: {e}",)))
-
-# Add items to listboxes
-def add_to_listbox(section, item):
-    if section == "favorites":
-        if item not in set(fav_listbox.get(0, END)):
-            fav_listbox.insert(END, item)
-    elif section == "playlist":
-        playlist_listbox.insert(END, item)
-    elif section == "recent":
-        if item not in set(recent_listbox.get(0, END)):
-            recent_listbox.insert(0, item)
-            if recent_listbox.size() > 50:
-                recent_listbox.delete(END)
-
-# Save a song to the recent list
-def add_recent(title, url):
-    global recent_cache
-    new_item = {"title": title, "url": url}
-    
-    recent_cache[:] = [item for item in recent_cache if item['title'] != title]
-    recent_cache.insert(0, new_item)
-    recent_cache = recent_cache[:50]
-    
-    with file_lock:
-        with open(os.path.join(DATA_DIR, 'recent.json'), 'w', encoding='utf-8') as f:
-            json.dump(recent_cache, f, indent=2)
+        if AUDIO_MODE != 'native' or 'Requested format is not available' not in str(e):
+            raise
+    return run_download('download_mp3', video_url)
+
+# One yt-dlp download with a download profile, timed stage by stage through its hooks
+def run_download(profile, video_url, started=None):
+    marks = download_marks.times = {'start': started or time.perf_counter()}
+    outcome = 'error'
+    try:
+        with extractor_pool.extractor(profile) as ydl:
+            info = ydl.extract_info(video_url, download=True)
+        outcome = 'ok'
+        return info
+    except JobCancelled:
+        outcome = 'cancelled'
+        raise
+    finally:
+        download_marks.times = None
+        record_download_stages(marks, outcome, get_video_id(video_url))
+
+# Fetch the audio file of a resolved song in chunks and convert it into its cache file
+def download_in_chunks(info):
+    video_id = info['id']
+    extension, cache_args = get_stream_cache_format(info)
+    job = scheduler.current_job() if scheduler else None
+    background = job is None or job.priority != PRIORITY_CURRENT
+    download = get_chunked_download(
+        info,
+        # A rate limited download gains nothing from more connections, and with one it
+        # finishes its chunks in order, so an interruption loses at most one chunk
+        connections=1 if background and DOWNLOAD_BACKGROUND_RATE else DOWNLOAD_CONNECTIONS,
+        rate=DOWNLOAD_BACKGROUND_RATE if background else 0,
+        cancelled=job.cancelled if job else None,
+    )
+    with timings.span('download.transfer', id=video_id):
+        download.run()
+
+    target = os.path.join(CACHE_DIR, f"{video_id}.{extension}")
+    with timings.span('download.postprocess', id=video_id):
+        transcode_audio(get_ffmpeg_executable(), download.part_path, target, cache_args)
+    download.discard()
+    return {**info, 'requested_downloads': [{'filepath': target}]}
+
+# Download of a resolved song's audio file into <video_id>.partial.<ext>.part; downloads and
+# streams of the same song share it, so either one resumes what the other left
+def get_chunked_download(info, **options):
+    part_path = os.path.join(CACHE_DIR, f"{info['id']}.partial.{info.get('ext') or 'audio'}.part")
+    key = f"{info.get('format_id')}:{info.get('filesize') or info.get('filesize_approx')}"
+    return ChunkedDownload(info['url'], info.get('http_headers'), part_path, key, **options)
+
+# Keeps a download under a byte rate; shared by all of its connections
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    # Account for bytes just received, sleeping until the rate allows more
+    def consume(self, size):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_slot = max(self.next_slot, now) + size / self.rate
+            delay = self.next_slot - now
+        time.sleep(delay)
+
+# Download of one file over parallel HTTP range requests into a preallocated .part file.
+# Finished chunks are recorded in <part>.json, keyed by the file's identity, so a later run
+# resumes them; servers without range support get a plain single request instead.
+class ChunkedDownload:
+    def __init__(self, url, headers, part_path, key, connections=DOWNLOAD_CONNECTIONS, rate=0, cancelled=None):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.part_path = part_path
+        self.state_path = part_path + '.json'
+        self.key = key  # Format and size of the file; a partial file of anything else is started over
+        self.connections = connections
+        self.limiter = RateLimiter(rate)
+        self.cancelled = cancelled or threading.Event()
+        self.size = None
+        self.done = set()  # Indices of finished chunks
+        self.available = 0  # Bytes from the start of the file that are on disk, for readers following it
+        self.ended = False
+        self.lock = threading.Condition()
+        self.failure = None
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            with self.lock:
+                self.ended = True
+                self.lock.notify_all()
+
+    # Block until more than offset bytes from the start are on disk or the download has ended;
+    # returns how many there are. Chunks are taken in order, so this grows steadily.
+    def wait_available(self, offset):
+        with self.lock:
+            while self.available <= offset and not self.ended:
+                self.lock.wait()
+            return self.available
+
+    def _run(self):
+        self.size = self._probe_size()
+        if self.size is None:
+            self._fetch_whole()
+            return
+
+        chunk_count = -(-self.size // DOWNLOAD_CHUNK_BYTES)
+        self._load_state()
+        if not os.path.isfile(self.part_path) or os.path.getsize(self.part_path) != self.size:
+            self.done = set()
+            with open(self.part_path, 'wb') as f:
+                f.truncate(self.size)
+        self._update_available()
+
+        pending = Queue()
+        for index in range(chunk_count):
+            if index not in self.done:
+                pending.put(index)
+        workers = [threading.Thread(target=self._worker, args=(pending,), daemon=True)
+                   for _ in range(min(self.connections, pending.qsize()))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if self.failure:
+            raise self.failure
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def _update_available(self):
+        with self.lock:
+            finished = 0
+            while finished in self.done:
+                finished += 1
+            self.available = min(finished * DOWNLOAD_CHUNK_BYTES, self.size)
+            self.lock.notify_all()
+
+    # Delete the partial file and its state once the download has been used
+    def discard(self):
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _open(self, headers=None):
+        import urllib.request
+        request = urllib.request.Request(self.url, headers={**self.headers, **(headers or {})})
+        return urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+
+    # Total size from a one-byte range request; None when the server does not serve ranges
+    def _probe_size(self):
+        with self._open({'Range': 'bytes=0-0'}) as response:
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            return int(total) if response.status == 206 and total.isdigit() else None
+
+    def _worker(self, pending):
+        with open(self.part_path, 'r+b') as f:
+            while not self.cancelled.is_set() and self.failure is None:
+                try:
+                    index = pending.get_nowait()
+                except Empty:
+                    return
+                try:
+                    self._fetch_chunk(f, index)
+                except JobCancelled:
+                    return
+                except Exception as e:
+                    self.failure = self.failure or e
+                    return
+                with self.lock:
+                    self.done.add(index)
+                    self._save_state()
+                self._update_available()
+
+    def _fetch_chunk(self, f, index):
+        start = index * DOWNLOAD_CHUNK_BYTES
+        end = min(start + DOWNLOAD_CHUNK_BYTES, self.size) - 1
+        with self._open({'Range': f"bytes={start}-{end}"}) as response:
+            if response.status != 206:
+                raise ConnectionError(f"Range request answered with HTTP {response.status}")
+            f.seek(start)
+            self._copy(response, f, end - start + 1)
+        f.flush()
+        os.fsync(f.fileno())  # On disk before the state file lists the chunk
+
+    # Servers without range support: one request, started over on every attempt
+    def _fetch_whole(self):
+        with self._open() as response, open(self.part_path, 'wb') as f:
+            length = response.headers.get('Content-Length')
+            self._copy(response, f, int(length) if length and length.isdigit() else None)
+
+    # Copy a response body into the file, rate limited and stopping once cancelled
+    def _copy(self, response, f, remaining):
+        while remaining is None or remaining > 0:
+            if self.cancelled.is_set():
+                raise JobCancelled()
+            data = response.read(64 * 1024 if remaining is None else min(64 * 1024, remaining))
+            if not data:
+                if remaining:
+                    raise ConnectionError("Connection closed before the download was complete")
+                return
+            f.write(data)
+            if remaining is not None:
+                remaining -= len(data)
+            if self.size is None:  # A single request writes the file in order
+                f.flush()
+                with self.lock:
+                    self.available += len(data)
+                    self.lock.notify_all()
+            self.limiter.consume(len(data))
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if (state.get('key'), state.get('size'), state.get('chunk')) == (self.key, self.size, DOWNLOAD_CHUNK_BYTES):
+            self.done = set(state.get('done', []))
+
+    def _save_state(self):
+        state = {'key': self.key, 'size': self.size, 'chunk': DOWNLOAD_CHUNK_BYTES, 'done': sorted(self.done)}
+        write_file_atomic(self.state_path, json.dumps(state))
+
+# Download a song into the cache, sharing the work if it is already being fetched
+def fetch_to_cache(video_url, download=None):
+    video_id = get_video_id(video_url)
+    download_key = video_id
+    while True:
+        cached_path = cache_lookup(video_id) if video_id else None
+        if cached_path:
+            return cached_path
+
+        with downloads_lock:
+            done = downloads_in_flight.get(download_key)
+            is_owner = done is None
+            if is_owner:
+                done = downloads_in_flight[download_key] = threading.Event()
+
+        if not is_owner:
+            while not done.wait(0.2):  # Another thread is fetching it; reuse its result
+                raise_if_cancelled()
+            continue
+
+        try:
+            with locked_cache_entry(video_id):
+                cached_path = cache_lookup(video_id) if video_id else None
+                if cached_path:
+                    return cached_path  # Another player downloaded it while this one waited
+                info = fetcher.call('download', download or download_audio, video_url)
+                video_id = (info or {}).get('id') or video_id
+                song_path = find_downloaded_file(info, video_id)
+                if not song_path:
+                    raise FileNotFoundError(f"No audio file produced for {video_url}")
+                cache_store(video_id, song_path, TrackMeta.from_info({**(info or {}), 'id': video_id}))
+                return song_path
+        finally:
+            with downloads_lock:
+                downloads_in_flight.pop(download_key, None)
+            done.set()
+
+def perform_download(video_url, name):
+    try:
+        with timings.span('download', id=get_video_id(video_url)):
+            song_path = fetch_to_cache(video_url)
+        post_ui(play_downloaded, video_url, song_path)
+    except JobCancelled:
+        pass
+    except Exception as e:
+        post_ui(set_status, f"Download error: {e}", key='status')
+
+# Play a finished download unless the user has moved on to another song
+def play_downloaded(video_url, song_path):
+    if current_song and current_song['url'] != video_url:
+        return
+    play(song_path)
+
+# Download the next few songs in the background so track changes load from disk
+def prefetch_upcoming():
+    wanted = []
+    for video_id in play_queue.upcoming(PREFETCH_COUNT):
+        song = library.tracks.get(video_id)
+        if song and video_id not in cache_index and video_id != play_queue.current:
+            wanted.append((('prefetch', video_id), song['url']))
+
+    # Songs that are no longer coming up should stop using bandwidth
+    scheduler.cancel_group('prefetch', keep={key for key, _ in wanted})
+    for key, video_url in wanted:
+        scheduler.submit(perform_prefetch, video_url, priority=PRIORITY_PREFETCH, key=key, group='prefetch')
+
+# Worker for a single background download
+def perform_prefetch(video_url):
+    try:
+        fetch_to_cache(video_url)
+        post_ui(queue_upcoming, key='queue_upcoming')
+    except Exception:
+        pass  # The song is downloaded again when it is actually played
+
+# Bulk offline sync. Songs download SYNC_DOWNLOADS at a time and their ffmpeg conversions run
+# on a process pool. Songs already cached are skipped, and the pending list is saved to
+# SYNC_STATE_FILE so a sync interrupted by closing the player continues on the next start.
+class SyncManager:
+    def __init__(self, state_path, downloads, transcoders):
+        self.state_path = state_path
+        self.transcoders = transcoders
+        self.executor = ThreadPoolExecutor(downloads, thread_name_prefix='sync')
+        self.process_pool = None
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()  # video_id -> track still to sync
+        self.bytes = {}  # video_id -> bytes downloaded in this run
+        self.counts = {'total': 0, 'downloaded': 0, 'skipped': 0, 'failed': 0}
+        self.last_error = None
+        self.last_report = 0.0
+        self.cancelled = threading.Event()
+
+    # Tracks left over from an interrupted sync
+    def load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('pending', [])
+        except (OSError, json.JSONDecodeError, AttributeError):
+            return []
+
+    def sync(self, tracks):
+        with self.lock:
+            if not self.pending:  # A new run
+                self.bytes.clear()
+                self.counts = dict.fromkeys(self.counts, 0)
+                self.last_error = None
+            self.cancelled.clear()
+            added = []
+            for track in tracks:
+                video_id = get_track_id(track)
+                if video_id not in self.pending:
+                    self.pending[video_id] = {'id': video_id, 'title': track['title'], 'url': track['url']}
+                    added.append(self.pending[video_id])
+            self.counts['total'] += len(added)
+            self._save_state()
+        for track in added:
+            self.executor.submit(self._sync_one, track)
+        self._report(force=True)
+        return self.get_progress()
+
+    # Stop the current run and forget its pending songs
+    def cancel(self):
+        self.cancelled.set()
+        with self.lock:
+            self.pending.clear()
+            self._save_state()
+        post_ui(set_status, "Sync cancelled", key='status')
+
+    # Stop on exit, keeping the pending list for the next start
+    def close(self):
+        self.cancelled.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def get_progress(self):
+        with self.lock:
+            return {**self.counts, 'pending': len(self.pending),
+                    'downloaded_mb': round(sum(self.bytes.values()) / 1024 ** 2, 1), 'last_error': self.last_error}
+
+    def _sync_one(self, track):
+        video_id = track['id']
+        outcome = 'failed'
+        keep_pending = False
+        try:
+            if self.cancelled.is_set():
+                return
+            if cache_index.get(video_id):
+                outcome = 'skipped'
+            else:
+                fetch_to_cache(track['url'], download=self._download)
+                outcome = 'downloaded'
+        except JobCancelled:
+            return
+        except Exception as e:
+            self.last_error = f"{track['title']}: {e}"
+            keep_pending = isinstance(e, FetchError) and e.kind == 'throttled'  # Retried by the next sync
+        finally:
+            if not self.cancelled.is_set():
+                with self.lock:
+                    if not keep_pending:
+                        self.pending.pop(video_id, None)
+                    self.counts[outcome] += 1
+                    self._save_state()
+                self._report(force=True)
+
+    # Download the raw audio, convert it on the process pool and describe the result like yt-dlp would
+    def _download(self, video_url):
+        with extractor_pool.extractor('sync') as ydl:
+            info = ydl.extract_info(video_url, download=True)
+        downloads = info.get('requested_downloads') or [{}]
+        source = downloads[0].get('filepath') or ydl.prepare_filename(info)
+        extension, args = get_stream_cache_format(info) or ('mp3', ['-c:a', 'libmp3lame', '-b:a', f'{MP3_BITRATE_KBPS}k', '-f', 'mp3'])
+        target = os.path.join(CACHE_DIR, f"{info['id']}.{extension}")
+        future = self._pool().submit(transcode_audio, get_ffmpeg_executable(), source, target, args)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                break
+            except FutureTimeoutError:
+                if self.cancelled.is_set():
+                    future.cancel()
+                    raise JobCancelled()
+        try:
+            os.remove(source)
+        except OSError:
+            pass
+        return {**info, 'requested_downloads': [{'filepath': target}]}
+
+    def _pool(self):
+        with self.lock:
+            if self.process_pool is None:
+                # spawn rather than fork: the player process has live threads and an audio device
+                self.process_pool = ProcessPoolExecutor(self.transcoders, mp_context=multiprocessing.get_context('spawn'))
+            return self.process_pool
+
+    def on_progress(self, progress):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        video_id = (progress.get('info_dict') or {}).get('id')
+        if video_id:
+            with self.lock:
+                self.bytes[video_id] = progress.get('downloaded_bytes') or 0
+            self._report()
+
+    def _save_state(self):
+        writer.write_file(self.state_path, json.dumps({'pending': list(self.pending.values())}, ensure_ascii=False))
+
+    # Aggregate progress in the status bar, at most twice a second
+    def _report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < 0.5:
+            return
+        self.last_report = now
+        progress = self.get_progress()
+        finished = progress['downloaded'] + progress['skipped'] + progress['failed']
+        if progress['pending']:
+            message = (f"Syncing {finished}/{progress['total']} songs, "
+                       f"{progress['downloaded_mb']:.0f} MB downloaded")
+        else:
+            message = (f"Sync finished: {progress['downloaded']} downloaded, "
+                       f"{progress['skipped']} already cached, {progress['failed']} failed")
+        post_ui(set_status, message, key='status')
+
+# yt-dlp progress hook of the sync profile
+def sync_progress_hook(progress):
+    if sync_manager:
+        sync_manager.on_progress(progress)
+
+# Convert one downloaded file into its cache format; runs in the sync process pool
+def transcode_audio(ffmpeg, source, target, args):
+    part_path = target + '.part'
+    subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', source, '-map', '0:a:0', *args, part_path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+        creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+    )
+    os.replace(part_path, target)
+    return target
+
+# Download a whole list into the cache for offline use
+def start_sync(section="favorites"):
+    tracks = library.tracks_in(section)
+    if not tracks:
+        set_status(f"No songs in {section} to sync")
+        return sync_manager.get_progress()
+    return sync_manager.sync(tracks)
+
+# Bounded PCM buffer between the ffmpeg decoder and the mixer; writers block while it is full
+class AudioRingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.start = 0
+        self.size = 0
+        self.eof = False  # Writer finished; readers drain what is left
+        self.closed = False  # Playback aborted; everyone stops
+        self.cond = threading.Condition()
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            with self.cond:
+                while self.size == self.capacity and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return False
+                count = min(len(view), self.capacity - self.size)
+                end = (self.start + self.size) % self.capacity
+                first = min(count, self.capacity - end)
+                self.buffer[end:end + first] = view[:first]
+                self.buffer[:count - first] = view[first:count]
+                self.size += count
+                self.cond.notify_all()
+            view = view[count:]
+        return True
+
+    # Read up to max_bytes, a multiple of align; returns b'' at end of stream
+    def read(self, max_bytes, align=1):
+        with self.cond:
+            while self.size < align and not self.eof and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return b''
+            count = min(max_bytes, self.size)
+            count -= count % align
+            if count == 0:
+                return b''
+            first = min(count, self.capacity - self.start)
+            data = bytes(self.buffer[self.start:self.start + first]) + bytes(self.buffer[:count - first])
+            self.start = (self.start + count) % self.capacity
+            self.size -= count
+            self.cond.notify_all()
+            return data
+
+    # Block until min_bytes are buffered; False if the stream ended empty or was closed
+    def wait_for(self, min_bytes):
+        with self.cond:
+            while self.size < min(min_bytes, self.capacity) and not self.eof and not self.closed:
+                self.cond.wait()
+            return self.size > 0 and not self.closed
+
+    def finish(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+# One song played while it downloads. The source is fetched at full speed (in resumable chunks
+# when it is an HTTP file) and remuxed by one ffmpeg into <cache file>.part; a second ffmpeg
+# decodes that growing file to PCM for the mixer. Only the decoder runs at playback speed, so
+# seeking works across everything downloaded so far, and an interrupted download is resumed
+# the next time the song is played or downloaded.
+class ProgressiveStream:
+    def __init__(self, video_url, video_id, meta):
+        self.video_url = video_url
+        self.video_id = video_id
+        self.meta = meta
+        self.duration = meta.duration
+        self.download = None  # ChunkedDownload of an HTTP source
+        self.remux = None  # ffmpeg writing the cache file
+        self.decoder = None  # ffmpeg decoding it for the mixer
+        self.ring = None
+        self.channel = None
+        self.cached_path = None
+        self.stopped = threading.Event()
+        self.fetched = threading.Event()  # The fetch has ended, successfully or not
+        self.remuxed = threading.Event()  # The cache file is complete
+        self.published = False
+        self.on_download_done = None
+        self.lock = threading.Lock()
+        self.generation = 0  # Bumped by every seek
+        self.decoding = True  # A _decode thread is running
+        self.seek_base = 0.0  # Song position the current decoder started from
+        self.started_at = None
+        self.paused_at = None
+        self.paused_total = 0.0
+        self.bytes_fed = 0
+        self.launched_at = None
+
+    def start(self, info, cache_path, cache_args, on_download_done):
+        frequency, _, channels = pygame.mixer.get_init()
+        self.frequency, self.channels = frequency, channels
+        self.frame_bytes = channels * 2
+        self.bytes_per_second = frequency * self.frame_bytes
+        self.ring = AudioRingBuffer(int(self.bytes_per_second * STREAM_BUFFER_SECONDS))
+        self.cache_path = cache_path
+        self.part_path = cache_path + '.part'
+        self.on_download_done = on_download_done
+        self.source = info['url']
+        if self.source.startswith(('http://', 'https://')):
+            self.download = get_chunked_download({**info, 'id': self.video_id}, cancelled=self.stopped)
+        self.launched_at = time.perf_counter()
+        threading.Thread(target=self._fetch, args=(cache_args,), daemon=True).start()
+        threading.Thread(target=self._decode, daemon=True).start()
+        threading.Thread(target=self._feed, daemon=True).start()
+
+    # Download the source and remux it into the cache file, then publish it
+    def _fetch(self, cache_args):
+        complete = False
+        try:
+            self.remux = subprocess.Popen(
+                [get_ffmpeg_executable(), '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+                 '-i', 'pipe:0' if self.download else self.source, '-map', '0:a:0', *cache_args, self.part_path],
+                stdin=subprocess.PIPE if self.download else subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+            )
+            if self.download:
+                feeder = threading.Thread(target=self._feed_remux, daemon=True)
+                feeder.start()
+                try:
+                    self.download.run()
+                finally:
+                    feeder.join()
+            complete = self.remux.wait() == 0 and not self.stopped.is_set()
+        except JobCancelled:
+            pass  # Stopped; the partial download is kept for next time
+        except Exception as e:
+            if not self.stopped.is_set():
+                post_ui(set_status, f"Streaming error: {e}", key='status')
+        finally:
+            if self.remux and self.remux.poll() is None:
+                self.remux.kill()
+                self.remux.wait()
+            if complete:
+                self.remuxed.set()
+                self.fetched.set()
+                self._publish()
+            else:
+                self.fetched.set()
+                try:
+                    os.remove(self.part_path)
+                except OSError:
+                    pass
+                self.on_download_done()
+
+    # Pipe the downloaded part of the source into the remuxing ffmpeg as it arrives
+    def _feed_remux(self):
+        offset = 0
+        try:
+            while True:
+                available = self.download.wait_available(offset)
+                if available <= offset:
+                    break
+                with open(self.download.part_path, 'rb') as f:
+                    f.seek(offset)
+                    while offset < available:
+                        data = f.read(min(256 * 1024, available - offset))
+                        self.remux.stdin.write(data)
+                        offset += len(data)
+        except (OSError, ValueError):
+            pass  # The remux was killed
+        finally:
+            try:
+                self.remux.stdin.close()
+            except OSError:
+                pass
+
+    # Move the finished cache file into place and register it. On Windows a file cannot be
+    # renamed while a decoder has it open, so this is retried each time a decoder exits.
+    def _publish(self):
+        with self.lock:
+            if self.published or not self.remuxed.is_set():
+                return
+            try:
+                os.replace(self.part_path, self.cache_path)
+            except OSError:
+                return
+            self.published = True
+        if self.download:
+            self.download.discard()
+        cache_store(self.video_id, self.cache_path, self.meta)
+        self.cached_path = self.cache_path
+        self.on_download_done()
+
+    # Decode the cache file into the ring buffer from the current position. A decoder that
+    # catches up with the remux is restarted where it stopped; a seek restarts it at the target.
+    def _decode(self):
+        with self.lock:
+            generation, position = self.generation, self.seek_base
+        try:
+            while not self.stopped.is_set():
+                with self.lock:
+                    generation, ring = self.generation, self.ring
+                    path = self.cache_path if self.published else self.part_path
+                final = self.fetched.is_set()  # The file will not grow, so its end is the song's end
+                if not os.path.isfile(path):
+                    if final:
+                        break  # The download failed
+                    self.stopped.wait(0.05)
+                    continue
+
+                command = [get_ffmpeg_executable(), '-hide_banner', '-loglevel', 'error', '-nostdin']
+                if position:
+                    command += ['-ss', f"{position:.3f}"]
+                command += ['-i', path, '-map', '0:a:0', '-f', 's16le', '-ac', str(self.channels), '-ar', str(self.frequency), 'pipe:1']
+                self.decoder = subprocess.Popen(
+                    command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+                )
+                if generation != self.generation or self.stopped.is_set():
+                    self.decoder.kill()  # A seek or stop came in while it was launching
+                decoded = 0
+                while True:
+                    data = self.decoder.stdout.read(64 * 1024)
+                    if not data or not ring.write(data):
+                        break
+                    decoded += len(data)
+                self.decoder.kill()
+                self.decoder.wait()
+                self.decoder.stdout.close()
+                self._publish()
+
+                with self.lock:
+                    if generation != self.generation:
+                        position = self.seek_base
+                        continue
+                if final and (self.remuxed.is_set() or not decoded):
+                    break
+                position += decoded / self.bytes_per_second
+                if decoded < self.bytes_per_second:
+                    self.stopped.wait(0.2)  # Caught up with the download; let it get ahead
+        finally:
+            with self.lock:
+                if generation == self.generation or self.stopped.is_set():
+                    self.ring.finish()
+                    self.decoding = False
+                else:  # A seek came in as this decoder was finishing
+                    threading.Thread(target=self._decode, daemon=True).start()
+
+    # Hand decoded chunks to the mixer channel, keeping one chunk queued behind the playing one
+    def _feed(self):
+        if not self.ring.wait_for(int(self.bytes_per_second * STREAM_PREROLL_SECONDS)):
+            if not self.stopped.is_set():
+                post_ui(set_status, "Stream ended before any audio arrived", key='status')
+            return
+
+        # Connecting, downloading and decoding until the pre-roll is buffered
+        timings.record('stream.preroll', time.perf_counter() - self.launched_at, id=self.video_id)
+        self.channel = pygame.mixer.Channel(0)
+        self.started_at = time.monotonic()
+        post_ui(start_stream_playback, self)
+
+        chunk_bytes = int(self.bytes_per_second * STREAM_CHUNK_SECONDS)
+        try:
+            while not self.stopped.is_set():
+                with self.lock:
+                    generation, ring = self.generation, self.ring
+                chunk = ring.read(chunk_bytes, self.frame_bytes)
+                if not chunk:
+                    if ring is not self.ring:
+                        continue  # Replaced by a seek
+                    break
+                sound = pygame.mixer.Sound(buffer=chunk)
+                while self.channel.get_queue() is not None and not self.stopped.is_set() and generation == self.generation:
+                    time.sleep(0.02)
+                with self.lock:
+                    if self.stopped.is_set():
+                        break
+                    if generation != self.generation:
+                        continue  # Decoded before the seek
+                    if self.channel.get_busy():
+                        self.channel.queue(sound)
+                    else:
+                        self.channel.play(sound)
+                        if self.paused_at is not None:
+                            self.channel.pause()  # Restarted by a seek while paused
+                    self.bytes_fed += len(chunk)
+
+            while self.channel.get_busy() and not self.stopped.is_set():
+                time.sleep(0.05)
+        except pygame.error:
+            return  # Mixer was closed under us on exit
+        if not self.stopped.is_set():
+            post_ui(on_stream_end, self)
+
+    # Seconds from the start that are downloaded, as far as a seek can go
+    def seekable_until(self):
+        if self.remuxed.is_set():
+            return self.duration
+        if self.download and self.download.size:
+            return self.duration * self.download.available / self.download.size
+        return 0.0
+
+    # Continue playback at position; the decoder restarts there and the mixer drops what it had queued
+    def seek(self, position):
+        with self.lock:
+            self.generation += 1
+            self.seek_base = position
+            self.ring.close()
+            self.ring = AudioRingBuffer(self.ring.capacity)
+            self.bytes_fed = 0
+            self.started_at = time.monotonic()
+            self.paused_total = 0.0
+            if self.paused_at is not None:
+                self.paused_at = self.started_at
+            if self.channel:
+                self.channel.stop()
+            if not self.decoding:  # It had already decoded to the end
+                self.decoding = True
+                threading.Thread(target=self._decode, daemon=True).start()
+        decoder = self.decoder
+        if decoder and decoder.poll() is None:
+            decoder.kill()
+
+    # Seconds played so far, never ahead of the audio actually handed to the mixer
+    def position(self):
+        if self.started_at is None:
+            return 0
+        now = self.paused_at or time.monotonic()
+        elapsed = now - self.started_at - self.paused_total
+        return self.seek_base + max(0, min(elapsed, self.bytes_fed / self.bytes_per_second))
+
+    def pause(self):
+        if self.channel and self.paused_at is None:
+            self.channel.pause()
+            self.paused_at = time.monotonic()
+
+    def resume(self):
+        if self.channel and self.paused_at is not None:
+            self.channel.unpause()
+            self.paused_total += time.monotonic() - self.paused_at
+            self.paused_at = None
+
+    def stop(self):
+        self.stopped.set()
+        with self.lock:
+            if self.ring:
+                self.ring.close()
+        if self.channel:
+            self.channel.stop()
+        for process in (self.decoder, self.remux):
+            if process and process.poll() is None:
+                process.kill()
+
+# Path of the ffmpeg executable, preferring the bundled copy
+def get_ffmpeg_executable():
+    ffmpeg_dir = os.path.join(os.getcwd(), 'ffmpeg')
+    return shutil.which('ffmpeg', path=ffmpeg_dir) or shutil.which('ffmpeg') or 'ffmpeg'
+
+# Cache file extension and ffmpeg output options for a resolved stream
+def get_stream_cache_format(info):
+    if AUDIO_MODE == 'native':
+        if info.get('acodec') == 'opus':
+            return 'opus', ['-c:a', 'copy', '-f', 'opus']
+        if info.get('acodec') == 'vorbis':
+            return 'ogg', ['-c:a', 'copy', '-f', 'ogg']
+        return None  # Needs a real download with the re-encode fallback
+    return 'mp3', ['-c:a', 'libmp3lame', '-b:a', f'{MP3_BITRATE_KBPS}k', '-f', 'mp3']
+
+# Begin progressive playback of a song that is not in the cache yet
+def start_stream(video_url, name):
+    engine.open()
+    # Only the latest song the user picked keeps downloading
+    scheduler.submit(perform_stream, video_url, name, priority=PRIORITY_CURRENT, group='current', supersede=True)
+
+# Resolve the audio URL and start streaming it, falling back to a full download
+def perform_stream(video_url, name):
+    video_id = get_video_id(video_url)
+    with downloads_lock:
+        if video_id in downloads_in_flight:
+            busy = True  # Already being prefetched; wait for that download instead
+        else:
+            busy = False
+            done = downloads_in_flight[video_id] = threading.Event()
+    if busy:
+        perform_download(video_url, name)
+        return
+
+    entry_lock = FileLock(get_entry_lock_path(video_id)) if video_id else None
+
+    def release():
+        if entry_lock:
+            entry_lock.release()
+        with downloads_lock:
+            downloads_in_flight.pop(video_id, None)
+        done.set()
+
+    if entry_lock and not entry_lock.acquire(blocking=False):
+        release()
+        perform_download(video_url, name)  # Another player is downloading it; wait for that download
+        return
+
+    try:
+        with timings.span('stream.extract', id=video_id):
+            info = fetcher.call('stream', extract_stream_info, video_url)
+        cache_format = get_stream_cache_format(info)
+        if not info.get('url') or not cache_format:
+            raise ValueError("No streamable audio format")
+    except JobCancelled:
+        release()
+        return
+    except FetchError as e:
+        release()
+        if e.kind == 'throttled':
+            post_ui(set_status, f"Download error: {e}", key='status')
+        else:
+            perform_download(video_url, name)  # A full download may still find a format it can convert
+        return
+    except Exception:
+        release()
+        perform_download(video_url, name)
+        return
+
+    post_ui(begin_stream, scheduler.current_job(), video_url, {**info, 'id': info.get('id') or video_id}, cache_format, release)
+
+# Start a resolved stream on the UI thread, unless the user has moved on since it was requested
+def begin_stream(job, video_url, info, cache_format, release):
+    global active_stream
+    if (job and job.cancelled.is_set()) or not current_song or current_song['url'] != video_url or active_stream:
+        release()
+        return
+
+    extension, cache_args = cache_format
+    stream = ProgressiveStream(video_url, info['id'], TrackMeta.from_info(info))
+    try:
+        stream.start(info, os.path.join(CACHE_DIR, f"{info['id']}.{extension}"), cache_args, release)
+    except Exception as e:
+        release()
+        set_status(f"Streaming error: {e}")
+        return
+    active_stream = stream
+
+# Resolve the direct audio URL of a song without downloading it
+def extract_stream_info(video_url):
+    with extractor_pool.extractor('stream') as ydl:
+        return ydl.extract_info(video_url, download=False)
+
+# Switch the player UI to the stream once its pre-roll is buffered
+def start_stream_playback(stream):
+    global is_playing, is_paused, music_length
+    if stream is not active_stream:
+        return
+    song_name(current_song['title'] if current_song else stream.video_id)
+    music_length = stream.duration
+    progress_bar.config(to=music_length)
+    progress_var.set(0)
+    update_time_display(0)
+
+    is_playing = True
+    is_paused = False
+    schedule_progress_update()
+    play_button.config(text="⏸")
+    set_status("Playing")
+    engine.report_switch('stream')
+    prefetch_upcoming()
+
+# Pause or resume the song that is currently streaming
+def toggle_stream_pause():
+    global is_paused
+    if is_paused:
+        active_stream.resume()
+        is_paused = False
+        schedule_progress_update()
+        play_button.config(text="⏸")
+        set_status("Playing")
+    else:
+        active_stream.pause()
+        is_paused = True
+        cancel_progress_update()
+        play_button.config(text="▶")
+        set_status("Paused")
+
+# Continue with the next song when a stream has played to the end
+def on_stream_end(stream):
+    global active_stream, current_song_path
+    if stream is not active_stream:
+        return
+    active_stream = None
+    if stream.cached_path:
+        current_song_path = stream.cached_path
+    handle_song_end()
+
+# Virtualized view over a Listbox: the full list lives in Python and only the visible
+# rows are inserted into the widget, so thousands of entries load and scroll instantly.
+class ListView:
+    def __init__(self, listbox, scrollbar, on_scroll_end=None):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.on_scroll_end = on_scroll_end
+        self.items = []
+        self.counts = {}  # item -> occurrences, for O(1) membership checks
+        self.top = 0  # Index of the first visible row
+        self.rows = int(listbox.cget('height'))
+        self.selected = None  # Absolute index of the selected row
+        self.line_height = tkfont.Font(font=listbox.cget('font')).metrics('linespace') + 1
+
+        listbox.config(yscrollcommand='')
+        scrollbar.config(command=self.yview)
+        listbox.bind("<Configure>", self._on_configure)
+        listbox.bind("<MouseWheel>", self._on_wheel)
+        listbox.bind("<Button-4>", lambda e: self.yview('scroll', -3, 'units') or "break")
+        listbox.bind("<Button-5>", lambda e: self.yview('scroll', 3, 'units') or "break")
+        listbox.bind("<<ListboxSelect>>", self._on_select, add=True)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def size(self):
+        return len(self.items)
+
+    def get(self, index):
+        return self.items[index]
+
+    def selected_index(self):
+        return self.selected
+
+    # Absolute index of the row at a y coordinate in the listbox, or None past the last row
+    def index_at(self, y):
+        index = self.top + self.listbox.nearest(y)
+        return index if 0 <= index < len(self.items) else None
+
+    def set_items(self, items):
+        self.items = list(items)
+        self.counts = {}
+        for item in self.items:
+            self.counts[item] = self.counts.get(item, 0) + 1
+        self.top = 0
+        self.selected = None
+        self.render()
+
+    def extend(self, items):
+        items = list(items)
+        self.items.extend(items)
+        for item in items:
+            self.counts[item] = self.counts.get(item, 0) + 1
+        self.render()
+
+    def insert(self, index, item):
+        self.items.insert(index, item)
+        self.counts[item] = self.counts.get(item, 0) + 1
+        if self.selected is not None and self.selected >= index:
+            self.selected += 1
+        self.render()
+
+    def remove_at(self, index):
+        item = self.items.pop(index)
+        self.counts[item] -= 1
+        if not self.counts[item]:
+            del self.counts[item]
+        if self.selected == index:
+            self.selected = None
+        elif self.selected is not None and self.selected > index:
+            self.selected -= 1
+        self.render()
+
+    def remove(self, item):
+        if item in self.counts:
+            self.remove_at(self.items.index(item))
+
+    # Scrollbar protocol: ('moveto', fraction) or ('scroll', count, 'units' | 'pages')
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.items))
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (self.rows if args[2] == 'pages' else 1)
+            self.top += step
+        self.render()
+
+    # Redraw the visible window of rows and update the scrollbar
+    def render(self):
+        self.top = max(0, min(self.top, len(self.items) - self.rows))
+        window = self.items[self.top:self.top + self.rows + 1]
+        self.listbox.delete(0, END)
+        if window:
+            self.listbox.insert(END, *window)
+        if self.selected is not None and self.top <= self.selected < self.top + len(window):
+            self.listbox.selection_set(self.selected - self.top)
+
+        if self.items:
+            first = self.top / len(self.items)
+            last = min(1.0, (self.top + self.rows) / len(self.items))
+        else:
+            first, last = 0.0, 1.0
+        self.scrollbar.set(first, last)
+        if self.on_scroll_end and self.items and last >= 1.0:
+            self.on_scroll_end()
+
+    def _on_select(self, event):
+        selection = self.listbox.curselection()
+        self.selected = self.top + selection[0] if selection else None
+
+    def _on_wheel(self, event):
+        self.yview('scroll', -3 if event.delta > 0 else 3, 'units')
+        return "break"
+
+    def _on_configure(self, event):
+        rows = max(1, event.height // self.line_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.render()
+
+# Headless stand-in for a widget: keeps its options so the player can update it as usual
+class HeadlessWidget:
+    def __init__(self, **options):
+        self.options = options
+
+    def config(self, **options):
+        self.options.update(options)
+
+    configure = config
+
+    def cget(self, key):
+        return self.options.get(key)
+
+    def get(self):
+        return self.options.get('text', '')
+
+    def bind(self, *args, **kwargs):
+        pass
+
+class HeadlessVar:
+    def __init__(self, value=0.0):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+# Headless stand-in for a ListView: the items without a Listbox
+class HeadlessListView:
+    def __init__(self):
+        self.items = []
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def size(self):
+        return len(self.items)
+
+    def get(self, index):
+        return self.items[index]
+
+    def selected_index(self):
+        return None
+
+    def set_items(self, items):
+        self.items = list(items)
+
+    def extend(self, items):
+        self.items.extend(items)
+
+    def insert(self, index, item):
+        self.items.insert(index, item)
+
+    def remove_at(self, index):
+        if index is not None and 0 <= index < len(self.items):
+            del self.items[index]
+
+    def remove(self, item):
+        if item in self.items:
+            self.items.remove(item)
+
+# Event loop that stands in for Tk in headless mode. after() may be called from any thread;
+# callbacks run in due order on the thread running mainloop().
+class HeadlessRoot:
+    def __init__(self):
+        self.timers = []  # Heap of (due, job id, callback, args)
+        self.sequence = itertools.count()
+        self.cancelled = set()
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def after(self, ms, callback, *args):
+        with self.cond:
+            job = next(self.sequence)
+            heapq.heappush(self.timers, (time.monotonic() + ms / 1000, job, callback, args))
+            self.cond.notify()
+            return job
+
+    def after_cancel(self, job):
+        with self.cond:
+            self.cancelled.add(job)
+
+    def mainloop(self):
+        while True:
+            with self.cond:
+                while not self.stopped and (not self.timers or self.timers[0][0] > time.monotonic()):
+                    self.cond.wait(self.timers[0][0] - time.monotonic() if self.timers else None)
+                if self.stopped:
+                    return
+                _, job, callback, args = heapq.heappop(self.timers)
+                if job in self.cancelled:
+                    self.cancelled.discard(job)
+                    continue
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def destroy(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def bind(self, *args, **kwargs):
+        pass
+
+    def protocol(self, *args):
+        pass
+
+# Run a function on the UI thread and wait for its result
+def call_in_ui(func, *args, timeout=CONTROL_TIMEOUT):
+    done = threading.Event()
+    result = {}
+
+    def run():
+        try:
+            result['value'] = func(*args)
+        except Exception as e:
+            result['error'] = e
+        finally:
+            done.set()
+
+    post_ui(run)
+    if not done.wait(timeout):
+        raise TimeoutError("The player did not respond")
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+# Control socket server. Each connection sends one JSON request per line, e.g.
+# {"cmd": "search", "query": "lofi"}, and gets one {"ok": ..., "result"/"error": ...} line back.
+class ControlServer:
+    def __init__(self, path, handlers):
+        self.path = path
+        self.handlers = handlers
+        self.sock = None
+
+    def start(self):
+        if not claim_control_socket(self.path):
+            raise OSError(f"{self.path} is in use by another player")
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Left behind by a player that did not shut down cleanly
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(8)
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return  # Closed
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn, conn.makefile('rwb') as stream:
+            for line in stream:
+                try:
+                    reply = {'ok': True, 'result': self.dispatch(json.loads(line))}
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                try:
+                    stream.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+                    stream.flush()
+                except OSError:
+                    return
+
+    def dispatch(self, request):
+        return dispatch_command(request, self.handlers)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            if control_lock:
+                control_lock.release()
+
+# Run one control request with its handler
+def dispatch_command(request, handlers):
+    command = request.get('cmd')
+    handler = handlers.get(command)
+    if handler is None:
+        raise ValueError(f"Unknown command: {command}")
+    return handler(**{key: value for key, value in request.items() if key != 'cmd'})
+
+# Make this process the owner of a control socket path. The lock next to the socket is held
+# until exit, so a socket file whose lock is free was left behind by a crashed player.
+def claim_control_socket(path):
+    global control_lock
+    if control_lock is None:
+        lock = FileLock(path + '.lock')
+        if not lock.acquire(blocking=False):
+            return False
+        control_lock = lock
+    return True
+
+# Send a request to the player that owns the control socket, waiting while it is still starting up
+def forward_command(request, path):
+    deadline = time.monotonic() + CONTROL_TIMEOUT
+    while True:
+        try:
+            return send_command(request, path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+# Send one request to a running player and return its reply
+def send_command(request, path=CONTROL_SOCKET, timeout=CONTROL_TIMEOUT + 5):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode('utf-8') + b'\n')
+            stream.flush()
+            return json.loads(stream.readline())
+
+# Snapshot of the player for the status command
+def get_player_status():
+    return {
+        'state': 'paused' if is_paused else 'playing' if is_playing else 'stopped',
+        'title': current_song['title'] if current_song else None,
+        'id': current_song['id'] if current_song else None,
+        'url': current_song['url'] if current_song else None,
+        'position': round(get_position(), 2),
+        'length': music_length,
+        'streaming': active_stream is not None,
+        'mode': playback_mode,
+        'queue_position': play_queue.cursor,
+        'queue_size': len(play_queue),
+        'playlist_size': library.size("playlist"),
+        'status': status_label.cget('text'),
+        'sync': sync_manager.get_progress(),
+    }
+
+# Tracks of a list for the control API
+def get_list_tracks(section):
+    return [{key: track.get(key) for key in ('id', 'title', 'url', 'duration')} for track in library.tracks_in(section)]
+
+# The queue from the playing song on, for the control API
+def get_queue_tracks():
+    state = play_queue.get_state()
+    tracks = [{key: library.tracks[video_id].get(key) for key in ('id', 'title', 'url', 'duration')} for video_id in state['ids']]
+    return {'position': state['position'], 'size': state['size'], 'tracks': tracks}
+
+# Play a track that may not be in any list yet
+def play_track(track):
+    library.add(track)
+    video_id = get_track_id(track)
+    index = library.index_of("playlist", video_id)
+    play_from_list("playlist", index) if index is not None else play_song(library.tracks[video_id])
+
+# Play a song right away, keeping the rest of the queue after it
+def play_song(song):
+    add_recent(song)
+    play_queued(play_queue.jump(song['id']))
+
+# Seek the playing song to a position in seconds
+def seek_to(position):
+    global last_seek_time
+    last_seek_time = 0  # Commands are not debounced like slider drags
+    on_seek(position, update_audio=True)
+    schedule_progress_update()
+
+def set_playback_mode(mode):
+    global playback_mode
+    if mode not in ("off", "shuffle", "repeat_one", "repeat_all"):
+        raise ValueError(f"Unknown playback mode: {mode}")
+    # cycle_playback_mode advances from the mode before the requested one
+    modes = ["off", "shuffle", "repeat_one", "repeat_all"]
+    playback_mode = modes[modes.index(mode) - 1]
+    cycle_playback_mode()
+
+# Control API commands; they run on the connection's thread and touch player state only through call_in_ui
+def control_search(query, wait=True):
+    job = call_in_ui(search_by_name, query)
+    if job and wait:
+        job.done.wait(CONTROL_TIMEOUT)
+    return call_in_ui(get_list_tracks, "playlist")
+
+def control_play(index=None, url=None, title=None, section="playlist"):
+    if url:
+        call_in_ui(play_track, {'title': title or url, 'url': url})
+    elif index is not None:
+        if not 0 <= int(index) < call_in_ui(library.size, section):
+            raise IndexError(f"No song at index {index} in {section}")
+        call_in_ui(play_from_list, section, int(index))
+    elif not call_in_ui(lambda: is_playing and not is_paused):
+        call_in_ui(play)
+    return call_in_ui(get_player_status)
+
+def control_pause():
+    call_in_ui(lambda: play() if is_playing and not is_paused else None)
+    return call_in_ui(get_player_status)
+
+def control_enqueue(url, title=None, next=False):
+    ahead = call_in_ui(queue_track, {'title': title or url, 'url': url}, bool(next))
+    return {'ahead': ahead, **call_in_ui(get_queue_tracks)}
+
+def control_seek(position):
+    call_in_ui(seek_to, float(position))
+    return call_in_ui(get_player_status)
+
+def control_command(func):
+    def command():
+        call_in_ui(func)
+        return call_in_ui(get_player_status)
+    return command
+
+CONTROL_COMMANDS = {
+    'status': lambda: call_in_ui(get_player_status),
+    'show': lambda: call_in_ui(show_window),
+    'search': control_search,
+    'playlist': lambda section="playlist": call_in_ui(get_list_tracks, section),
+    'enqueue': control_enqueue,
+    'queue': lambda: call_in_ui(get_queue_tracks),
+    'play': control_play,
+    'pause': control_pause,
+    'seek': control_seek,
+    'next': control_command(play_next),
+    'previous': control_command(play_previous),
+    'stop': control_command(stop_current_song),
+    'mode': lambda mode: call_in_ui(set_playback_mode, mode) or call_in_ui(get_player_status),
+    'sync': lambda section="favorites": call_in_ui(start_sync, section),
+    'cancel_sync': lambda: sync_manager.cancel() or sync_manager.get_progress(),
+    'stats': lambda: get_performance_stats(),
+    'export_timings': lambda path=TIMINGS_EXPORT_FILE: export_timings(path),
+    'quit': lambda: post_ui(on_closing) or {},
+}
+
+# Bring the window to the front, e.g. when the player is launched again in single-instance mode
+def show_window():
+    if not headless:
+        root.deiconify()
+        root.lift()
+        root.focus_force()
+    return get_player_status()
+
+# Start the control socket where the platform supports Unix sockets
+def start_control_server(path):
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    server = ControlServer(path, CONTROL_COMMANDS)
+    try:
+        server.start()
+    except OSError:
+        traceback.print_exc()  # The player still works, just without remote control
+        return None
+    return server
+
+# Move a song to the top of the recent list
+def add_recent(song):
+    old_index = library.remove("recent", song['id'])
+    if old_index is not None:
+        recent_view.remove_at(old_index)
+    library.insert("recent", 0, song)
+    recent_view.insert(0, song['title'])
+    while library.size("recent") > RECENT_LIMIT:
+        last_id = library.lists["recent"].ids[-1]
+        recent_view.remove_at(library.remove("recent", last_id))
+
+    writer.submit('touch_recent', track=get_track_row(song), played_at=time.time(), limit=RECENT_LIMIT)
+
+# The persisted fields of a library record
+def get_track_row(track):
+    return {'id': track['id'], 'title': track['title'], 'url': track['url']}
+
+# SQLite persistence in WAL mode. Each change only touches the rows it affects, so its cost
+# does not grow with the size of the library.
+class LibraryStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS favorites (
+            video_id TEXT PRIMARY KEY, title TEXT NOT NULL, url TEXT NOT NULL, position INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS recent (
+            video_id TEXT PRIMARY KEY, title TEXT NOT NULL, url TEXT NOT NULL, played_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS recent_played_at ON recent (played_at);
+        CREATE TABLE IF NOT EXISTS search_cache (
+            query TEXT PRIMARY KEY, fetched_at REAL NOT NULL, last_used REAL NOT NULL, results TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS search_cache_last_used ON search_cache (last_used);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                yield self.conn
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    # Import the JSON files written by older versions, once
+    def migrate_json(self):
+        if self.query("SELECT 1 FROM meta WHERE key = 'json_migrated'"):
+            return
+
+        def read_json(file_path, default):
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError):
+                return default
+
+        favorites = read_json(os.path.join(DATA_DIR, 'favorites.json'), [])
+        recent = read_json(os.path.join(DATA_DIR, 'recent.json'), [])
+        searches = read_json(SEARCH_CACHE_FILE, {})
+        now = time.time()
+        with self.transaction() as conn:
+            for position, song in enumerate(favorites):
+                conn.execute("INSERT OR IGNORE INTO favorites VALUES (?, ?, ?, ?)",
+                             (get_track_id(song), song['title'], song['url'], position))
+            for age, song in enumerate(recent):  # Newest first in the JSON file
+                conn.execute("INSERT OR IGNORE INTO recent VALUES (?, ?, ?, ?)",
+                             (get_track_id(song), song['title'], song['url'], now - age))
+            if isinstance(searches, dict):
+                for query, entry in searches.items():
+                    conn.execute("INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?)",
+                                 (query, entry['time'], entry.get('last_used', entry['time']),
+                                  json.dumps(entry['results'], ensure_ascii=False)))
+            conn.execute("INSERT INTO meta VALUES ('json_migrated', ?)", (str(now),))
+
+    def load_favorites(self):
+        rows = self.query("SELECT video_id, title, url FROM favorites ORDER BY position")
+        return [{'id': video_id, 'title': title, 'url': url} for video_id, title, url in rows]
+
+    def load_recent(self, limit):
+        rows = self.query("SELECT video_id, title, url FROM recent ORDER BY played_at DESC LIMIT ?", (limit,))
+        return [{'id': video_id, 'title': title, 'url': url} for video_id, title, url in rows]
+
+    def get_search(self, query, max_age):
+        now = time.time()
+        rows = self.query("SELECT fetched_at, results FROM search_cache WHERE query = ? AND fetched_at > ?",
+                          (query, now - max_age))
+        if not rows:
+            return None
+        return {'time': rows[0][0], 'results': json.loads(rows[0][1])}
+
+    def purge_searches(self, max_age):
+        self.query("DELETE FROM search_cache WHERE fetched_at <= ?", (time.time() - max_age,))
+
+    # Apply a batch of journaled mutations in one transaction. Every mutation carries its own
+    # timestamps, so replaying a batch after a crash gives the same result.
+    def apply_batch(self, mutations):
+        with self.transaction() as conn:
+            for mutation in mutations:
+                self._apply(conn, mutation)
+
+    def _apply(self, conn, mutation):
+        op = mutation['op']
+        if op == 'add_favorite':
+            track = mutation['track']
+            conn.execute("INSERT OR IGNORE INTO favorites "
+                         "SELECT ?, ?, ?, COALESCE(MAX(position), -1) + 1 FROM favorites",
+                         (track['id'], track['title'], track['url']))
+        elif op == 'remove_favorite':
+            conn.execute("DELETE FROM favorites WHERE video_id = ?", (mutation['video_id'],))
+        elif op == 'touch_recent':
+            track = mutation['track']
+            conn.execute("INSERT OR REPLACE INTO recent VALUES (?, ?, ?, ?)",
+                         (track['id'], track['title'], track['url'], mutation['played_at']))
+            conn.execute("DELETE FROM recent WHERE video_id NOT IN "
+                         "(SELECT video_id FROM recent ORDER BY played_at DESC LIMIT ?)", (mutation['limit'],))
+        elif op == 'put_search':
+            conn.execute("INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?)",
+                         (mutation['query'], mutation['time'], mutation['time'],
+                          json.dumps(mutation['results'], ensure_ascii=False)))
+            conn.execute("DELETE FROM search_cache WHERE query NOT IN "
+                         "(SELECT query FROM search_cache ORDER BY last_used DESC LIMIT ?)", (mutation['max_entries'],))
+        elif op == 'touch_search':
+            conn.execute("UPDATE search_cache SET last_used = ? WHERE query = ?", (mutation['time'], mutation['query']))
+
+    # Fold the WAL back into the database file and truncate it
+    def checkpoint(self):
+        self.query("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Background writer that takes all disk I/O off the interaction paths. Mutations are appended
+# to a journal as soon as the writer wakes, committed to SQLite every flush_interval seconds
+# (or at shutdown), and the journal is cleared after each commit. Whole-file snapshots such
+# as the cache index keep only their latest version and are written atomically.
+class PersistenceWriter:
+    def __init__(self, store, journal_path, flush_interval, compact_interval):
+        self.store = store
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.queue = Queue()
+        self.pending = []  # Journaled but not yet committed
+        self.files = {}  # path -> latest text
+        self.tasks = {}  # key -> callable run on the next flush
+        self.files_lock = threading.Lock()
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    # Replay mutations left in the journal by a crash, then start the writer thread
+    def start(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = []
+        mutations = []
+        for line in lines:
+            try:
+                mutations.append(json.loads(line))
+            except json.JSONDecodeError:
+                break  # Torn final line from the crash
+        if mutations:
+            self.store.apply_batch(mutations)
+        open(self.journal_path, 'w').close()
+        self.thread.start()
+
+    def submit(self, op, **fields):
+        self.queue.put({'op': op, **fields})
+
+    def write_file(self, path, text):
+        with self.files_lock:
+            self.files[path] = text
+
+    # Run func on the next flush; scheduling the same key again before then runs it once
+    def schedule(self, key, func):
+        with self.files_lock:
+            self.tasks[key] = func
+
+    # Commit everything still pending and stop the writer
+    def close(self, timeout=10):
+        self.closing = True
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        last_commit = last_compact = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, last_commit + self.flush_interval - time.monotonic()))
+            except Empty:
+                item = None
+            batch = [item] if item else []
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+                if item:
+                    batch.append(item)
+
+            try:
+                if batch:
+                    self._append_journal(batch)
+                    self.pending += batch
+                now = time.monotonic()
+                if self.closing or now - last_commit >= self.flush_interval:
+                    self._commit()
+                    last_commit = now
+                    if now - last_compact >= self.compact_interval:
+                        self.store.checkpoint()
+                        last_compact = now
+            except Exception:
+                traceback.print_exc()  # Pending work is retried on the next flush
+            if self.closing:
+                return
+
+    def _append_journal(self, batch):
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(mutation, ensure_ascii=False) + '\n' for mutation in batch)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _commit(self):
+        if self.pending:
+            self.store.apply_batch(self.pending)
+            self.pending = []
+            open(self.journal_path, 'w').close()  # Compact: everything in it is now in SQLite
+        with self.files_lock:
+            files, self.files = self.files, {}
+            tasks, self.tasks = self.tasks, {}
+        for path, text in files.items():
+            write_file_atomic(path, text)
+        for task in tasks.values():
+            task()
+
+# Write a file through a temp file and rename, so a crash never leaves it half written. The temp
+# name is unique per thread, so players sharing a folder can publish the same file at once.
+def write_file_atomic(path, text):
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+# Advisory lock on a file, shared by all processes on the machine: flock() on POSIX, and msvcrt
+# byte locks on Windows, where a shared holder locks one of SHARED_SLOTS bytes and an exclusive
+# holder locks them all. Each instance is one hold; use a new one per holder.
+class FileLock:
+    SHARED_SLOTS = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.region = None  # Windows: (offset, length) of the locked bytes
+
+    def acquire(self, shared=False, blocking=True):
+        while not self._try_acquire(shared):
+            if not blocking:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                os.lseek(self.fd, self.region[0], os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, self.region[1])
+            else:
+                import fcntl
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _try_acquire(self, shared):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            locked = self._lock_windows(fd, shared) if os.name == 'nt' else self._lock_posix(fd, shared)
+            if locked and os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                locked = False  # The holder deleted the file while we waited; lock the new one
+        except FileNotFoundError:
+            locked = False
+        if not locked:
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def _lock_posix(self, fd, shared):
+        import fcntl
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _lock_windows(self, fd, shared):
+        import msvcrt
+        if shared:
+            regions = [(slot, 1) for slot in random.sample(range(1, self.SHARED_SLOTS + 1), self.SHARED_SLOTS)]
+        else:
+            regions = [(0, self.SHARED_SLOTS + 1)]
+        for region in regions:
+            os.lseek(fd, region[0], os.SEEK_SET)
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, region[1])
+            except OSError:
+                continue
+            self.region = region
+            return True
+        return False
+
+# Load a stored song list into the library and its list view. Tracks added since launch are
+# kept: recent plays stay in front of the stored history, new favorites after the stored ones.
+def load_track_list(list_name, songs, view):
+    current = library.tracks_in(list_name)
+    current_ids = {track['id'] for track in current}
+    stored = [song for song in songs if get_track_id(song) not in current_ids]
+    if list_name == "recent":
+        tracks = (current + stored)[:RECENT_LIMIT]
+    else:
+        tracks = stored + current
+    library.set_list(list_name, tracks)
+    view.set_items(track['title'] for track in library.tracks_in(list_name))
+
+# Read the stored lists off the Tk thread and show them once loaded
+def hydrate_library():
+    store.purge_searches(SEARCH_CACHE_MAX_AGE_SECONDS)
+    recent = store.load_recent(RECENT_LIMIT)
+    favorites = store.load_favorites()
+    post_ui(finish_hydration, recent, favorites)
+
+def finish_hydration(recent, favorites):
+    load_track_list("recent", recent, recent_view)
+    load_track_list("favorites", favorites, fav_view)
+    if current_song:
+        update_favorite_button_state(current_song['id'])
+    mark_startup("library lists")
+
+# Record a finished startup phase; the breakdown is printed once the window is up and the lists are loaded
+def mark_startup(phase):
+    startup_phases.append((phase, time.perf_counter()))
+    finished = {name for name, _ in startup_phases}
+    if {"ready" if headless else "first paint", "library lists"} <= finished:
+        report_startup()
+
+def report_startup():
+    previous = STARTUP_BEGAN
+    parts = []
+    for phase, finished_at in sorted(startup_phases, key=lambda item: item[1]):
+        parts.append(f"{phase} {(finished_at - previous) * 1000:.0f} ms")
+        previous = finished_at
+    # stderr, so a startup command's JSON reply is all there is on stdout
+    print(f"Startup {(previous - STARTUP_BEGAN) * 1000:.0f} ms: " + ", ".join(parts), file=sys.stderr)
+
+# The first time the main window is mapped, note it and start the deferred warm-up work
+def on_first_map(event):
+    if event.widget is not root or any(name == "first paint" for name, _ in startup_phases):
+        return
+    mark_startup("first paint")
+    start_warm_up()
+
+# Open the audio device and warm up yt-dlp in the background
+def start_warm_up():
+    scheduler.submit(engine.open, priority=PRIORITY_BATCH)
+    scheduler.submit(extractor_pool.warm_up, priority=PRIORITY_BATCH)
 
 # Display status messages
 def set_status(message):
+    global status_reset_job
     status_label.config(text=message)
-    root.after(5000, lambda: status_label.config(text="Ready") if status_label.cget("text") == message else None)
+    if status_reset_job is not None:
+        root.after_cancel(status_reset_job)
+    status_reset_job = root.after(5000, reset_status)
+
+def reset_status():
+    global status_reset_job
+    status_reset_job = None
+    status_label.config(text="Ready")
 
-# Create the main window
-root = tk.Tk()
-root.title("Y TUNE")
-root.geometry("700x550")
-root.configure(bg="#333333")
+# Stage latency percentiles, scheduler queue stats and the last track switch, for the panel and the control API
+def get_performance_stats():
+    latency = engine.last_switch_latency
+    return {
+        'stages': timings.get_stats(),
+        'scheduler': scheduler.get_stats(),
+        'fetch': fetcher.get_stats(),
+        'last_switch_ms': round(latency * 1000, 1) if latency is not None else None,
+    }
 
-# Title label
-title_label = Label(root, text="Y TUNE", font=("Arial", 18, "bold"), fg="#ff0000", bg="#333333")
-title_label.pack(pady=10)
+# Save the timing ring as JSON lines for offline analysis
+def export_timings(path=TIMINGS_EXPORT_FILE):
+    count = timings.export(path)
+    post_ui(set_status, f"Exported {count} timings to {path}", key='status')
+    return {'path': path, 'count': count}
 
-# Search bar frame
-search_frame = Frame(root, bg="#222222")
-search_frame.pack(pady=5, fill="x", padx=10)
+# Open or close the performance panel
+def toggle_stats_panel(event=None):
+    global stats_window
+    if stats_window is not None:
+        stats_window.destroy()
+        stats_window = None
+        return
+    stats_window = tk.Toplevel(root)
+    stats_window.title("Y TUNE - Performance")
+    stats_window.configure(bg="#333333")
+    stats_window.protocol("WM_DELETE_WINDOW", toggle_stats_panel)
 
-search_entry = Entry(search_frame, font=("Arial", 12), bg="#888888", fg="white", bd=0, insertbackground="white")
-search_entry.pack(side="left", fill="x", expand=True, padx=(10, 5), ipady=5)
-add_placeholder(search_entry, "Search for songs...")
+    stats_text = Label(stats_window, font=("Courier", 10), fg="white", bg="#333333", justify="left", anchor="nw")
+    stats_text.pack(fill="both", expand=True, padx=10, pady=10)
+    export_button = Button(stats_window, text="Export JSONL", font=("Arial", 10), bg="white",
+                           command=lambda: scheduler.submit(export_timings, priority=PRIORITY_BATCH))
+    export_button.pack(pady=(0, 10))
+    refresh_stats_panel(stats_window, stats_text)
 
-search_button = Button(search_frame, text="🔍", font=("Arial", 12), bg="#aaaaaa", fg="black", command=search_by_name)
-search_button.pack(side="right", padx=(5, 10))
+# Redraw the panel every STATS_REFRESH_MS while it stays open
+def refresh_stats_panel(window, stats_text):
+    if window is not stats_window:
+        return
+    stats = get_performance_stats()
+    lines = [f"{'stage':<20}{'n':>6}{'fail':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+    for stage, row in stats['stages'].items():
+        lines.append(f"{stage:<20}{row['count']:>6}{row['failed']:>6}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    jobs = stats['scheduler']
+    lines += ["", f"jobs: {jobs['queued']} queued, {jobs['running']} running, "
+                  f"wait p95 {jobs['wait_ms_p95']} ms, run p95 {jobs['run_ms_p95']} ms"]
+    fetch = stats['fetch']
+    lines.append(f"fetch: {fetch['requests']} requests, {fetch['retried']} retried, {fetch['transient']} transient, "
+                 f"{fetch['throttled']} throttled, {fetch['permanent']} permanent, breaker {fetch['breaker']}")
+    if stats['last_switch_ms'] is not None:
+        lines.append(f"last track switch: {stats['last_switch_ms']} ms")
+    stats_text.config(text="\n".join(lines))
+    root.after(STATS_REFRESH_MS, refresh_stats_panel, window, stats_text)
 
-# Status label for feedback
-status_label = Label(root, text="Ready", font=("Arial", 10), fg="white", bg="#333333")
-status_label.pack(pady=5)
+mark_startup("imports")
 
-# Main content frame for listboxes
-main_frame = Frame(root, bg="#444444", height=300)
-main_frame.pack(fill="x", padx=10, pady=5)
-main_frame.pack_propagate(False)
+# Build the Tk window; the widgets the player updates are module globals
+def build_window():
+    global root, search_entry, status_label, song_title, song_duration, progress_var, progress_bar
+    global play_button, favorite_button, mode_button, fav_view, playlist_view, recent_view, list_views
+    root = tk.Tk()
+    root.title("Y TUNE")
+    root.geometry("700x550")
+    root.configure(bg="#333333")
 
-main_frame.grid_columnconfigure(1, weight=3)
-main_frame.grid_columnconfigure(0, weight=1)
-main_frame.grid_columnconfigure(2, weight=1)
+    # Title label
+    title_label = Label(root, text="Y TUNE", font=("Arial", 18, "bold"), fg="#ff0000", bg="#333333")
+    title_label.pack(pady=10)
 
-# Favorites section
-favorites_frame = Frame(main_frame, bg="#555555", width=150, height=250)
-favorites_frame.grid(row=0, column=0, sticky="ns")
-favorites_frame.pack_propagate(False)
+    # Search bar frame
+    search_frame = Frame(root, bg="#222222")
+    search_frame.pack(pady=5, fill="x", padx=10)
 
-fav_label = Label(favorites_frame, text="Favorites", font=("Arial", 12, "bold"), fg="white", bg="#777777")
-fav_label.pack(fill="x", pady=5)
+    search_entry = Entry(search_frame, font=("Arial", 12), bg="#888888", fg="white", bd=0, insertbackground="white")
+    search_entry.pack(side="left", fill="x", expand=True, padx=(10, 5), ipady=5)
+    add_placeholder(search_entry, "Search for songs...")
 
-fav_scroll = Scrollbar(favorites_frame)
-fav_scroll.pack(side="right", fill="y")
+    search_button = Button(search_frame, text="🔍", font=("Arial", 12), bg="#aaaaaa", fg="black", command=search_by_name)
+    search_button.pack(side="right", padx=(5, 10))
 
-fav_listbox = Listbox(favorites_frame, yscrollcommand=fav_scroll.set, bg="#666666", fg="white", font=("Arial", 10))
-fav_listbox.pack(fill="both", expand=True)
+    # Status label for feedback
+    status_label = Label(root, text="Ready", font=("Arial", 10), fg="white", bg="#333333")
+    status_label.pack(pady=5)
 
-fav_scroll.config(command=fav_listbox.yview)
+    # Main content frame for listboxes
+    main_frame = Frame(root, bg="#444444", height=300)
+    main_frame.pack(fill="x", padx=10, pady=5)
+    main_frame.pack_propagate(False)
 
-# Playlist section
-playlist_frame = Frame(main_frame, bg="#666666", height=250)
-playlist_frame.grid(row=0, column=1, sticky="nsew", padx=10)
-playlist_frame.pack_propagate(False)
+    main_frame.grid_columnconfigure(1, weight=3)
+    main_frame.grid_columnconfigure(0, weight=1)
+    main_frame.grid_columnconfigure(2, weight=1)
 
-playlist_scroll = Scrollbar(playlist_frame)
-playlist_scroll.pack(side="right", fill="y")
+    # Favorites section
+    favorites_frame = Frame(main_frame, bg="#555555", width=150, height=250)
+    favorites_frame.grid(row=0, column=0, sticky="ns")
+    favorites_frame.pack_propagate(False)
 
-playlist_listbox = Listbox(playlist_frame, yscrollcommand=playlist_scroll.set, bg="#777777", fg="white", font=("Arial", 10))
-playlist_listbox.pack(fill="both", expand=True)
+    fav_label = Label(favorites_frame, text="Favorites", font=("Arial", 12, "bold"), fg="white", bg="#777777")
+    fav_label.pack(fill="x", pady=5)
 
-playlist_scroll.config(command=playlist_listbox.yview)
+    fav_scroll = Scrollbar(favorites_frame)
+    fav_scroll.pack(side="right", fill="y")
 
-# Recent section
-recent_frame = Frame(main_frame, bg="#555555", width=150, height=250)
-recent_frame.grid(row=0, column=2, sticky="ns")
-recent_frame.pack_propagate(False)
+    fav_listbox = Listbox(favorites_frame, yscrollcommand=fav_scroll.set, bg="#666666", fg="white", font=("Arial", 10))
+    fav_listbox.pack(fill="both", expand=True)
 
-recent_label = Label(recent_frame, text="Recent", font=("Arial", 12, "bold"), fg="white", bg="#777777")
-recent_label.pack(fill="x", pady=5)
+    fav_scroll.config(command=fav_listbox.yview)
 
-recent_scroll = Scrollbar(recent_frame)
-recent_scroll.pack(side="right", fill="y")
+    # Playlist section
+    playlist_frame = Frame(main_frame, bg="#666666", height=250)
+    playlist_frame.grid(row=0, column=1, sticky="nsew", padx=10)
+    playlist_frame.pack_propagate(False)
 
-recent_listbox = Listbox(recent_frame, yscrollcommand=recent_scroll.set, bg="#666666", fg="white", font=("Arial", 10))
-recent_listbox.pack(fill="both", expand=True)
+    playlist_scroll = Scrollbar(playlist_frame)
+    playlist_scroll.pack(side="right", fill="y")
 
-recent_scroll.config(command=recent_listbox.yview)
+    playlist_listbox = Listbox(playlist_frame, yscrollcommand=playlist_scroll.set, bg="#777777", fg="white", font=("Arial", 10))
+    playlist_listbox.pack(fill="both", expand=True)
 
-# Bottom frame for controls
-bottom_frame = Frame(root, bg="#222222")
-bottom_frame.pack(fill="x", side="bottom", pady=10)
+    playlist_scroll.config(command=playlist_listbox.yview)
 
-song_title = Label(bottom_frame, text="No song selected", font=("Arial", 12), fg="white", bg="#222222")
-song_title.pack(pady=(10, 0))
+    # Recent section
+    recent_frame = Frame(main_frame, bg="#555555", width=150, height=250)
+    recent_frame.grid(row=0, column=2, sticky="ns")
+    recent_frame.pack_propagate(False)
 
-song_duration = Label(bottom_frame, text="Time: 0:00 / 0:00", font=("Arial", 10), fg="white", bg="#222222")
-song_duration.pack()
+    recent_label = Label(recent_frame, text="Recent", font=("Arial", 12, "bold"), fg="white", bg="#777777")
+    recent_label.pack(fill="x", pady=5)
 
-progress_var = tk.DoubleVar()
-progress_bar = Scale(
-    bottom_frame, variable=progress_var, from_=0, to=100,
-    orient=HORIZONTAL, showvalue=0, sliderlength=15,
-    troughcolor="#555555", bg="#920000", activebackground="#ff0000",
-    highlightthickness=0, length=600, resolution=0.1
-)
-progress_bar.pack(fill="x", pady=(10, 5))
+    recent_scroll = Scrollbar(recent_frame)
+    recent_scroll.pack(side="right", fill="y")
 
-# Control buttons frame
-controls_frame = Frame(bottom_frame, bg="#222222")
-controls_frame.pack(pady=10)
+    recent_listbox = Listbox(recent_frame, yscrollcommand=recent_scroll.set, bg="#666666", fg="white", font=("Arial", 10))
+    recent_listbox.pack(fill="both", expand=True)
 
-prev_button = Button(controls_frame, text="⏮", font=("Arial", 12), bg="white", width=5, command=play_previous)
-prev_button.pack(side="left", padx=5)
+    recent_scroll.config(command=recent_listbox.yview)
 
-play_button = Button(controls_frame, text="▶", font=("Arial", 12, "bold"), bg="white", width=5, command=play)
-play_button.pack(side="left", padx=5)
+    # Bottom frame for controls
+    bottom_frame = Frame(root, bg="#222222")
+    bottom_frame.pack(fill="x", side="bottom", pady=10)
 
-next_button = Button(controls_frame, text="⏭", font=("Arial", 12), bg="white", width=5, command=play_next)
-next_button.pack(side="left", padx=5)
+    song_title = Label(bottom_frame, text="No song selected", font=("Arial", 12), fg="white", bg="#222222")
+    song_title.pack(pady=(10, 0))
 
-favorite_button = Button(controls_frame, text="♡", font=("Arial", 12), bg="white", width=5, command=toggle_favorite)
-favorite_button.pack(side="left", padx=5)
+    song_duration = Label(bottom_frame, text="Time: 0:00 / 0:00", font=("Arial", 10), fg="white", bg="#222222")
+    song_duration.pack()
 
-mode_button = Button(controls_frame, text="Off", font=("Arial", 12), bg="white", width=8, command=cycle_playback_mode)
-mode_button.pack(side="left", padx=5)
+    progress_var = tk.DoubleVar()
+    progress_bar = Scale(
+        bottom_frame, variable=progress_var, from_=0, to=100,
+        orient=HORIZONTAL, showvalue=0, sliderlength=15,
+        troughcolor="#555555", bg="#920000", activebackground="#ff0000",
+        highlightthickness=0, length=600, resolution=0.1
+    )
+    progress_bar.pack(fill="x", pady=(10, 5))
 
-play_all_button = Button(controls_frame, text="▶ All", font=("Arial", 12), bg="white", width=6, command=play_all)
-play_all_button.pack(side="left", padx=5)
+    # Control buttons frame
+    controls_frame = Frame(bottom_frame, bg="#222222")
+    controls_frame.pack(pady=10)
 
-# Bind progress bar events
-progress_bar.bind("<B1-Motion>", on_seek_drag)
-progress_bar.bind("<ButtonRelease-1>", on_seek_release)
+    prev_button = Button(controls_frame, text="⏮", font=("Arial", 12), bg="white", width=5, command=play_previous)
+    prev_button.pack(side="left", padx=5)
 
-# Bind listbox events
-fav_listbox.bind("<<ListboxSelect>>", lambda e: on_listbox_click(e, "favorites"))
-playlist_listbox.bind("<<ListboxSelect>>", lambda e: on_listbox_click(e, "playlist"))
-recent_listbox.bind("<<ListboxSelect>>", lambda e: on_listbox_click(e, "recent"))
+    play_button = Button(controls_frame, text="▶", font=("Arial", 12, "bold"), bg="white", width=5, command=play)
+    play_button.pack(side="left", padx=5)
 
-# Bind shortcut keys
-search_entry.bind("<Return>", lambda event: search_by_name())
+    next_button = Button(controls_frame, text="⏭", font=("Arial", 12), bg="white", width=5, command=play_next)
+    next_button.pack(side="left", padx=5)
 
-def handle_space(event):
-    if event.widget != search_entry and current_song:
-        play()
-    return "break"
+    favorite_button = Button(controls_frame, text="♡", font=("Arial", 12), bg="white", width=5, command=toggle_favorite)
+    favorite_button.pack(side="left", padx=5)
 
-root.bind("<space>", handle_space)
+    mode_button = Button(controls_frame, text="Off", font=("Arial", 12), bg="white", width=8, command=cycle_playback_mode)
+    mode_button.pack(side="left", padx=5)
 
-# Initialize pygame for audio and event handling
-pygame.init()
+    play_all_button = Button(controls_frame, text="▶ All", font=("Arial", 12), bg="white", width=6, command=play_all)
+    play_all_button.pack(side="left", padx=5)
 
-# Load initial data into memory
-recent_file = os.path.join(DATA_DIR, 'recent.json')
-if not os.path.exists(recent_file) or os.path.getsize(recent_file) == 0:
-    with file_lock:
-        with open(recent_file, 'w', encoding='utf-8') as f:
-            json.dump([], f)
+    sync_button = Button(controls_frame, text="⬇ Sync", font=("Arial", 12), bg="white", width=6, command=start_sync)
+    sync_button.pack(side="left", padx=5)
 
-with file_lock:
-    with open(recent_file, 'r', encoding='utf-8') as f:
-        try:
-            recent_cache = json.load(f)
-        except json.JSONDecodeError:
-            recent_cache = []
-for song in recent_cache:
-    add_to_listbox("recent", song["title"])
-
-favorites_file = os.path.join(DATA_DIR, 'favorites.json')
-if not os.path.exists(favorites_file) or os.path.getsize(favorites_file) == 0:
-    with file_lock:
-        with open(favorites_file, 'w', encoding='utf-8') as f:
-            json.dump([], f)
-
-with file_lock:
-    with open(favorites_file, 'r', encoding='utf-8') as f:
-        try:
-            favorites_cache = json.load(f)
-        except json.JSONDecodeError:
-            favorites_cache = []
-for song in favorites_cache:
-    add_to_listbox("favorites", song["title"])
+    # Bind progress bar events
+    progress_bar.bind("<B1-Motion>", on_seek_drag)
+    progress_bar.bind("<ButtonRelease-1>", on_seek_release)
+
+    # Only the visible rows of each list are materialized in its Listbox
+    fav_view = ListView(fav_listbox, fav_scroll)
+    playlist_view = ListView(playlist_listbox, playlist_scroll, on_scroll_end=load_more_results)
+    recent_view = ListView(recent_listbox, recent_scroll)
+    list_views = {"favorites": fav_view, "playlist": playlist_view, "recent": recent_view}
+
+    # Bind listbox events
+    fav_listbox.bind("<<ListboxSelect>>", lambda e: on_listbox_click(e, "favorites"), add=True)
+    playlist_listbox.bind("<<ListboxSelect>>", lambda e: on_listbox_click(e, "playlist"), add=True)
+    recent_listbox.bind("<<ListboxSelect>>", lambda e: on_listbox_click(e, "recent"), add=True)
+
+    # Right-click a song to put it in the play queue
+    queue_menu = tk.Menu(root, tearoff=0)
+
+    def show_queue_menu(event, section):
+        index = list_views[section].index_at(event.y)
+        if index is None:
+            return
+        queue_menu.delete(0, END)
+        queue_menu.add_command(label="Play next", command=lambda: queue_from_list(section, index, play_next=True))
+        queue_menu.add_command(label="Add to queue", command=lambda: queue_from_list(section, index))
+        queue_menu.tk_popup(event.x_root, event.y_root)
 
-# Start UI queue checker
-root.after(100, check_ui_queue)
+    fav_listbox.bind("<Button-3>", lambda e: show_queue_menu(e, "favorites"))
+    playlist_listbox.bind("<Button-3>", lambda e: show_queue_menu(e, "playlist"))
+    recent_listbox.bind("<Button-3>", lambda e: show_queue_menu(e, "recent"))
+
+    # Bind shortcut keys
+    search_entry.bind("<Return>", lambda event: search_by_name())
+
+    def handle_space(event):
+        if event.widget != search_entry and current_song:
+            play()
+        return "break"
+
+    root.bind("<space>", handle_space)
+    root.bind("<F2>", toggle_stats_panel)
+
+# Headless stand-ins for the same globals, so the player runs without a display
+def build_headless():
+    global root, search_entry, status_label, song_title, song_duration, progress_var, progress_bar
+    global play_button, favorite_button, mode_button, fav_view, playlist_view, recent_view, list_views
+    root = HeadlessRoot()
+    search_entry = HeadlessWidget(text="")
+    status_label = HeadlessWidget(text="Ready")
+    song_title = HeadlessWidget(text="No song selected")
+    song_duration = HeadlessWidget(text="Time: 0:00 / 0:00")
+    progress_var = HeadlessVar()
+    progress_bar = HeadlessWidget(to=100)
+    play_button = HeadlessWidget(text="▶")
+    favorite_button = HeadlessWidget(text="♡")
+    mode_button = HeadlessWidget(text="Off")
+    fav_view = HeadlessListView()
+    playlist_view = HeadlessListView()
+    recent_view = HeadlessListView()
+    list_views = {"favorites": fav_view, "playlist": playlist_view, "recent": recent_view}
+
+# Build the window (or its headless stand-ins), start the services and run the main loop
+def start_player(options, command=None):
+    start_services(options)
+    if command:
+        threading.Thread(target=run_startup_command, args=(command,), daemon=True).start()
+    if headless:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: root.after(0, on_closing))
+    root.mainloop()
+
+# Create the cache and data directories; a --send client only talks to the socket and needs none
+def create_data_dirs():
+    for folder in (CACHE_DIR, DATA_DIR, CACHE_LOCK_DIR):
+        os.makedirs(folder, exist_ok=True)
+
+# Everything start_player() does before entering the main loop; also used by benchmark.py
+def start_services(options):
+    global headless, engine, store, writer, scheduler, extractor_pool, control_server, sync_manager, timings, fetcher
+    headless = options.headless
+    create_data_dirs()
+    timings = SpanRecorder(TIMING_RING_SIZE)
+    fetcher = Fetcher(FETCH_MAX_ATTEMPTS, FETCH_BACKOFF_BASE, FETCH_BACKOFF_MAX, BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN)
+    if headless:
+        build_headless()
+    else:
+        build_window()
+    mark_startup("window")
+
+    # Only the mixer is used; the engine opens it once the window is up or when the first song plays
+    engine = PlaybackEngine()
+    engine.on_switch = record_switch
+
+    # Open the database, importing the old JSON files on first run
+    store = LibraryStore(DB_FILE)
+    store.migrate_json()
+    writer = PersistenceWriter(store, JOURNAL_FILE, PERSIST_FLUSH_SECONDS, PERSIST_COMPACT_SECONDS)
+    writer.start()
+    mark_startup("library store")
+
+    # Load the audio cache index, keeping partial downloads of an interrupted sync
+    sync_manager = SyncManager(SYNC_STATE_FILE, SYNC_DOWNLOADS, SYNC_TRANSCODE_WORKERS)
+    pending_sync = sync_manager.load_state()
+    load_cache_index(keep_ids=[track['id'] for track in pending_sync])
+    mark_startup("cache index")
+
+    # Start the background job scheduler and load the favorites and recent lists on it
+    scheduler = JobScheduler(SCHEDULER_WORKERS, group_limits={'prefetch': MAX_PREFETCH_DOWNLOADS})
+    scheduler.submit(hydrate_library, priority=PRIORITY_CURRENT)
+
+    # yt-dlp is imported and warmed up in the background once the window is on screen
+    extractor_pool = ExtractorPool(get_extractor_profiles(), YDL_POOL_SIZE, load_extractor_factory(options.extractor))
+    control_server = start_control_server(options.socket)
+    if pending_sync:
+        sync_manager.sync(pending_sync)  # Continue where the last run stopped
+    if headless:
+        start_warm_up()
+        mark_startup("ready")
+    else:
+        root.bind("<Map>", on_first_map, add=True)
+
+    # Run any UI updates posted by workers before the main loop started
+    root.after(0, drain_ui_queue)
+    root.protocol("WM_DELETE_WINDOW", on_closing)
 
 # Clean up on exit
 def on_closing():
+    if control_server:
+        control_server.close()
     stop_current_song()
+    sync_manager.close()
+    extractor_pool.close()
+    writer.close()
+    store.close()
     try:
+        engine.close()
         pygame.quit()
     except:
         pass
     root.destroy()
 
-root.protocol("WM_DELETE_WINDOW", on_closing)
+# Run the command a --single-instance launch would have forwarded, now that this is the first player
+def run_startup_command(request):
+    try:
+        reply = {'ok': True, 'result': dispatch_command(request, CONTROL_COMMANDS)}
+    except Exception as e:
+        reply = {'ok': False, 'error': str(e)}
+    print(json.dumps(reply, indent=2, ensure_ascii=False))
+
+# Turn "--send CMD key=value ..." into a control request; values are parsed as JSON when possible
+def parse_command(words):
+    request = {'cmd': words[0]}
+    for word in words[1:]:
+        key, _, value = word.partition('=')
+        try:
+            request[key] = json.loads(value)
+        except json.JSONDecodeError:
+            request[key] = value
+    return request
+
+def main():
+    multiprocessing.freeze_support()  # The sync process pool in a frozen executable
+    parser = argparse.ArgumentParser(description="Y TUNE music player")
+    parser.add_argument('--headless', action='store_true', help="run without a window, controlled through the socket")
+    parser.add_argument('--socket', default=CONTROL_SOCKET, help="path of the control socket")
+    parser.add_argument('--extractor', help="extractor factory as module:callable, e.g. a fake one for testing")
+    parser.add_argument('--send', nargs='+', metavar='CMD', help="send a command (e.g. status, search query=lofi) to a running player")
+    parser.add_argument('--single-instance', action='store_true', default=bool(os.environ.get('YTUNE_SINGLE_INSTANCE')),
+                        help="if a player already owns the socket, pass it the --send command (default: show) and exit")
+    options = parser.parse_args()
+    if options.single_instance and hasattr(socket, 'AF_UNIX'):
+        os.makedirs(os.path.dirname(options.socket) or '.', exist_ok=True)  # For the lock next to the socket
+        if not claim_control_socket(options.socket):
+            request = parse_command(options.send or ['show'])
+            print(json.dumps(forward_command(request, options.socket), indent=2, ensure_ascii=False))
+            return
+        start_player(options, parse_command(options.send) if options.send else None)
+        return
+    if options.send:
+        print(json.dumps(send_command(parse_command(options.send), options.socket), indent=2, ensure_ascii=False))
+        return
+    start_player(options)
 
-# Start the main loop
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,486 @@
+import argparse
+import contextlib
+import http.server
+import importlib.util
+import json
+import os
+import platform
+import queue
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+# Benchmark harness for the search -> download -> play pipeline of Y Tune.py.
+# It runs the player headless against a fake yt-dlp extractor and synthetic audio files,
+# so no network or sound card is needed, and prints the results as JSON.
+
+PLAYER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Y Tune.py')
+AUDIO_ENV = 'YTUNE_BENCH_AUDIO'  # Synthetic file the fake extractor serves for every video
+DOWNLOAD_ENV = 'YTUNE_BENCH_DOWNLOAD_URL'  # HTTP URL served for videos whose id starts with "dl"
+LATENCY_ENV = 'YTUNE_BENCH_LATENCY_MS'  # Simulated network latency of each fake request
+FAULTS_ENV = 'YTUNE_BENCH_FAULTS'  # Injected failure rates, e.g. "transient=0.1,throttled=0.01"
+FAULTS = {  # Errors shaped like the ones yt-dlp raises
+    'transient': lambda: ConnectionResetError("[Errno 104] Connection reset by peer"),
+    'throttled': lambda: Exception("ERROR: [youtube] HTTP Error 429: Too Many Requests"),
+    'permanent': lambda: Exception("ERROR: [youtube] Video unavailable"),
+}
+SWITCH_TIMEOUT = 30
+
+# Stand-in for yt_dlp.YoutubeDL: search results are generated and every video is the synthetic file
+class FakeExtractor:
+    def __init__(self, options):
+        self.options = options
+
+    def get_info_extractor(self, name):
+        return None
+
+    def close(self):
+        pass
+
+    def prepare_filename(self, info):
+        return self.options['outtmpl'].replace('%(id)s', info['id']).replace('%(ext)s', info['ext'])
+
+    def extract_info(self, url, download=False, process=True):
+        time.sleep(float(os.environ.get(LATENCY_ENV, 0)) / 1000)
+        for fault in filter(None, os.environ.get(FAULTS_ENV, '').split(',')):
+            kind, _, rate = fault.partition('=')
+            if random.random() < float(rate):
+                raise FAULTS[kind]()
+        if url.startswith('ytsearch'):
+            count, _, query = url[len('ytsearch'):].partition(':')
+            prefix = re.sub(r'[^A-Za-z0-9]', '', query)[:4].ljust(4, 'x')
+            entries = ({'id': f"{prefix}{i:07d}", 'title': f"{query} #{i}", 'duration': 5, 'channel': 'bench'}
+                       for i in range(int(count)))
+            return {'entries': entries}
+
+        source = os.environ[AUDIO_ENV]
+        video_id = url.split('v=')[-1]
+        if video_id.startswith('dl') and os.environ.get(DOWNLOAD_ENV):
+            source = os.environ[DOWNLOAD_ENV]  # Fetched over HTTP by the chunked downloader
+        info = {'id': video_id, 'title': video_id, 'duration': 5, 'channel': 'bench',
+                'acodec': 'opus', 'abr': 96, 'ext': 'opus', 'url': source}
+        if download:
+            target = self.prepare_filename(info)
+            shutil.copy(source, target)
+            info['requested_downloads'] = [{'filepath': target}]
+        return info
+
+# Static file handler that answers single byte range requests, like the audio hosts do
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def send_head(self):
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start > end:
+            self.send_error(416)
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, 'remaining', None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            data = source.read(min(64 * 1024, remaining))
+            if not data:
+                break
+            outputfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+# Serve a folder over HTTP on a free local port
+def start_file_server(folder):
+    handler = lambda *args, **kwargs: RangeRequestHandler(*args, directory=folder, **kwargs)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Import Y Tune.py as a module; start_services() creates its cache and data folders in the current directory
+def load_player():
+    spec = importlib.util.spec_from_file_location('ytune', PLAYER_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['ytune'] = module
+    spec.loader.exec_module(module)
+    return module
+
+# Summary of timings given in seconds, reported in milliseconds
+def summarize(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {
+        'n': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(pick(0.5) * 1000, 3),
+        'p95_ms': round(pick(0.95) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+# Generate a sine tone with ffmpeg
+def make_audio(ffmpeg, path, seconds, codec_args):
+    subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f"sine=f=440:d={seconds}",
+         '-ac', '2', *codec_args, path],
+        check=True, stdin=subprocess.DEVNULL,
+    )
+    return path
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+# Put a synthetic file into the player's cache as if it had been downloaded
+def seed_cache(ytune, video_id, source, duration):
+    target = os.path.join(ytune.CACHE_DIR, video_id + os.path.splitext(source)[1])
+    shutil.copy(source, target)
+    ytune.cache_store(video_id, target, ytune.TrackMeta(id=video_id, title=video_id, duration=duration))
+    return {'id': video_id, 'title': video_id, 'url': video_url(video_id), 'duration': duration}
+
+# Collects (latency, source) reports from PlaybackEngine.on_switch
+class SwitchRecorder:
+    def __init__(self, engine):
+        self.reports = queue.Queue()
+        self.chained = engine.on_switch
+        engine.on_switch = self.on_switch
+
+    def on_switch(self, latency, source):
+        if self.chained:
+            self.chained(latency, source)
+        self.reports.put((latency, source))
+
+    def clear(self):
+        while not self.reports.empty():
+            self.reports.get_nowait()
+
+    def wait(self, timeout=SWITCH_TIMEOUT):
+        return self.reports.get(timeout=timeout)
+
+# Search through the control API: a fresh query runs the extractor, a repeated one hits the cache
+def bench_search(ytune, repeat):
+    fresh, cached = [], []
+    for i in range(repeat):
+        query = f"benchmark query {i} {random.random()}"
+        started = time.perf_counter()
+        results = ytune.control_search(query)
+        fresh.append(time.perf_counter() - started)
+        if not results:
+            raise RuntimeError("Search returned no results")
+
+        started = time.perf_counter()
+        ytune.control_search(query)
+        cached.append(time.perf_counter() - started)
+    return {'first_page': summarize(fresh), 'cached': summarize(cached)}
+
+# Time from picking a song to the start of its audio, for uncached (streamed) and cached songs
+def bench_first_audio(ytune, recorder, repeat, opus_source):
+    streamed, cached, sources = [], [], {}
+    for i in range(repeat):
+        recorder.clear()
+        ytune.call_in_ui(ytune.play_track, {'title': f"stream {i}", 'url': video_url(f"strm{i:07d}")})
+        latency, source = recorder.wait()
+        sources[source] = sources.get(source, 0) + 1
+        streamed.append(latency)
+
+    track = seed_cache(ytune, 'cachedtrack', opus_source, 5)
+    for _ in range(repeat):
+        recorder.clear()
+        ytune.call_in_ui(ytune.play_track, track)
+        latency, _ = recorder.wait()
+        cached.append(latency)
+    ytune.call_in_ui(ytune.stop_current_song)
+    return {'uncached': summarize(streamed), 'uncached_sources': sources, 'cached': summarize(cached)}
+
+# Track changes: reloading a cached song, and the gapless handoff to a queued one
+def bench_track_switch(ytune, recorder, repeat, short_source):
+    tracks = [seed_cache(ytune, f"switch{i:05d}", short_source, 1) for i in range(repeat + 1)]
+    ytune.call_in_ui(ytune.set_playback_mode, "off")
+    ytune.call_in_ui(ytune.update_search_results, tracks)
+
+    recorder.clear()
+    ytune.call_in_ui(ytune.play_from_list, "playlist", 0)
+    recorder.wait()
+    handoffs, lags, other = [], [], 0
+    for _ in range(repeat):
+        latency, source = recorder.wait()
+        if source == 'queued':
+            handoffs.append(latency)
+            lags.append(ytune.engine.handoff_position)
+        else:
+            other += 1
+
+    reloads = []
+    for i in range(repeat):
+        recorder.clear()
+        ytune.call_in_ui(ytune.play_from_list, "playlist", i % len(tracks))
+        latency, _ = recorder.wait()
+        reloads.append(latency)
+    ytune.call_in_ui(ytune.stop_current_song)
+    return {
+        'queued_handoff': summarize(handoffs),
+        'queued_detection_lag': summarize(lags),
+        'not_queued': other,
+        'reload': summarize(reloads),
+    }
+
+# Time engine.seek() on the UI thread for random positions in the playing song
+def measure_seeks(ytune, length, repeat):
+    def timed_seek(position):
+        started = time.perf_counter()
+        ytune.engine.seek(position, ytune.is_paused)
+        ytune.reset_clock(position)
+        return time.perf_counter() - started
+
+    return [ytune.call_in_ui(timed_seek, random.uniform(0.1, length - 1)) for _ in range(repeat)]
+
+# Seek latency in a long MP3 with and without its seek index, and in a long Ogg/Opus file
+def bench_seek(ytune, recorder, repeat, long_mp3, long_opus, length):
+    results = {}
+    mp3_track = seed_cache(ytune, 'longmp3trck', long_mp3, length)
+    recorder.clear()
+    ytune.call_in_ui(ytune.play_track, mp3_track)
+    recorder.wait()
+
+    song_path = ytune.cache_lookup(mp3_track['id'])
+    index_path = ytune.get_sidecar_path(song_path, 'seek')
+    deadline = time.monotonic() + 60
+    while not os.path.exists(index_path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    results['mp3_indexed'] = summarize(measure_seeks(ytune, length, repeat))
+
+    os.rename(index_path, index_path + '.off')
+    ytune.seek_index_cache = (None, None)
+    results['mp3_unindexed'] = summarize(measure_seeks(ytune, length, repeat))
+    os.rename(index_path + '.off', index_path)
+    ytune.seek_index_cache = (None, None)
+
+    opus_track = seed_cache(ytune, 'longopustrk', long_opus, length)
+    recorder.clear()
+    ytune.call_in_ui(ytune.play_track, opus_track)
+    recorder.wait()
+    results['opus'] = summarize(measure_seeks(ytune, length, repeat))
+    ytune.call_in_ui(ytune.stop_current_song)
+    return results
+
+# Chunked downloads from the local HTTP server, run as current-song and as rate limited prefetch jobs
+def bench_download(ytune, repeat, size):
+    results = {}
+    for name, priority, count in (('foreground', ytune.PRIORITY_CURRENT, repeat),
+                                  ('background', ytune.PRIORITY_PREFETCH, min(repeat, 3))):
+        times = []
+        for i in range(count):
+            url = video_url(f"dl{name[:2]}{i:07d}")
+            started = time.perf_counter()
+            job = ytune.scheduler.submit(ytune.fetch_to_cache, url, priority=priority)
+            job.done.wait(300)
+            if not ytune.cache_lookup(url.split('v=')[-1]):
+                raise RuntimeError(f"{name} download of {url} failed")
+            times.append(time.perf_counter() - started)
+        results[name] = {**summarize(times), 'mib_per_s': round(size * count / sum(times) / 2**20, 2)}
+    results['file_bytes'] = size
+    results['background_rate'] = ytune.DOWNLOAD_BACKGROUND_RATE
+    return results
+
+# Launch the headless player until its control socket answers, repeat times in fresh folders
+def bench_cold_start(ytune, workspace, repeat):
+    ready, phases = [], []
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                                      os.environ.get('PYTHONPATH')])))
+    for i in range(repeat):
+        folder = os.path.join(workspace, f"cold{i}")
+        os.makedirs(folder)
+        sock_path = os.path.join(folder, 'control.sock')
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, PLAYER_SCRIPT, '--headless', '--socket', sock_path, '--extractor', 'benchmark:FakeExtractor'],
+            cwd=folder, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Player exited during startup: {process.stdout.read()}")
+                try:
+                    if ytune.send_command({'cmd': 'status'}, sock_path, timeout=5)['ok']:
+                        break
+                except (OSError, ValueError):
+                    time.sleep(0.005)
+            ready.append(time.perf_counter() - started)
+            ytune.send_command({'cmd': 'quit'}, sock_path, timeout=5)
+            output, _ = process.communicate(timeout=30)
+        finally:
+            if process.poll() is None:
+                process.kill()
+        match = re.search(r'^Startup (\d+) ms: (.*)$', output, re.M)
+        if match:
+            phases.append({name: int(ms) for name, ms in re.findall(r'([a-z][a-z ]*) (\d+) ms', match.group(2))})
+    return {'ready': summarize(ready), 'phases': phases}
+
+# Cost of persisting favorites and recent plays as the stored lists grow
+def bench_persistence(ytune, workspace, sizes, batch_size=100):
+    results = {}
+    for size in sizes:
+        folder = os.path.join(workspace, f"persist{size}")
+        os.makedirs(folder)
+        store = ytune.LibraryStore(os.path.join(folder, 'ytune.db'))
+        tracks = [{'id': f"p{i:010d}", 'title': f"song {i}", 'url': video_url(f"p{i:010d}")} for i in range(size)]
+        store.apply_batch([{'op': 'add_favorite', 'track': track} for track in tracks]
+                          + [{'op': 'touch_recent', 'track': track, 'played_at': i, 'limit': size}
+                             for i, track in enumerate(tracks)])
+
+        # What the UI thread pays per change
+        writer = ytune.PersistenceWriter(store, os.path.join(folder, 'journal.jsonl'), 3600, 3600)
+        writer.start()
+        submits = []
+        for i in range(batch_size):
+            track = random.choice(tracks)
+            started = time.perf_counter()
+            writer.submit('touch_recent', track=track, played_at=size + i, limit=size)
+            submits.append(time.perf_counter() - started)
+        writer.close()
+
+        # What the writer thread pays to commit a batch
+        commits = []
+        for round_number in range(5):
+            batch = []
+            for i in range(batch_size):
+                track = random.choice(tracks)
+                batch.append({'op': 'touch_recent', 'track': track, 'played_at': size * 2 + round_number * batch_size + i, 'limit': size})
+                batch.append({'op': 'add_favorite', 'track': {**track, 'id': f"n{round_number}-{i}"}})
+            started = time.perf_counter()
+            store.apply_batch(batch)
+            commits.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        store.load_favorites()
+        load_favorites = time.perf_counter() - started
+        started = time.perf_counter()
+        store.load_recent(size)
+        load_recent = time.perf_counter() - started
+        store.close()
+        results[str(size)] = {
+            'submit': summarize(submits),
+            f'commit_{batch_size * 2}_changes': summarize(commits),
+            'load_favorites_ms': round(load_favorites * 1000, 3),
+            'load_recent_ms': round(load_recent * 1000, 3),
+        }
+    return results
+
+# Generate the audio, then run every benchmark with the player's data folders inside workspace
+def run_benchmarks(args, ffmpeg, workspace):
+    player_dir = os.path.join(workspace, 'player')
+    audio_dir = os.path.join(workspace, 'audio')
+    os.makedirs(player_dir)
+    os.makedirs(audio_dir)
+    os.chdir(player_dir)
+    opus_args, mp3_args = ['-c:a', 'libopus', '-b:a', '96k'], ['-c:a', 'libmp3lame', '-b:a', '192k']
+    opus_source = make_audio(ffmpeg, os.path.join(audio_dir, 'tone.opus'), 5, opus_args)
+    short_source = make_audio(ffmpeg, os.path.join(audio_dir, 'short.opus'), 1, opus_args)
+    long_mp3 = make_audio(ffmpeg, os.path.join(audio_dir, 'long.mp3'), args.seek_length, mp3_args)
+    long_opus = make_audio(ffmpeg, os.path.join(audio_dir, 'long.opus'), args.seek_length, opus_args)
+    os.environ[AUDIO_ENV] = opus_source
+    file_server = start_file_server(audio_dir)
+    os.environ[DOWNLOAD_ENV] = f"http://127.0.0.1:{file_server.server_address[1]}/long.opus"
+
+    ytune = load_player()
+    results = {
+        'persistence': bench_persistence(ytune, workspace, [int(size) for size in args.sizes.split(',')]),
+        'cold_start': bench_cold_start(ytune, workspace, args.cold_starts),
+    }
+
+    options = argparse.Namespace(headless=True, socket=os.path.join(player_dir, 'control.sock'), extractor=FakeExtractor)
+    ytune.start_services(options)
+    loop = threading.Thread(target=ytune.root.mainloop, daemon=True)
+    loop.start()
+    recorder = SwitchRecorder(ytune.engine)
+    try:
+        results['search'] = bench_search(ytune, args.repeat)
+        results['time_to_first_audio'] = bench_first_audio(ytune, recorder, args.repeat, opus_source)
+        results['track_switch'] = bench_track_switch(ytune, recorder, args.repeat, short_source)
+        results['seek'] = bench_seek(ytune, recorder, args.repeat, long_mp3, long_opus, args.seek_length)
+        results['download'] = bench_download(ytune, args.repeat, os.path.getsize(long_opus))
+        results['player'] = ytune.get_performance_stats()  # The player's own stage spans and scheduler stats
+    finally:
+        ytune.post_ui(ytune.on_closing)
+        loop.join(30)
+        file_server.shutdown()
+    return results
+
+def get_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(PLAYER_SCRIPT),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Y TUNE search, download and playback pipeline")
+    parser.add_argument('--repeat', type=int, default=20, help="samples per measurement")
+    parser.add_argument('--cold-starts', type=int, default=5, help="player launches for the cold start measurement")
+    parser.add_argument('--sizes', default='100,1000,10000', help="favorites/recent list sizes for the persistence benchmark")
+    parser.add_argument('--latency-ms', type=float, default=0, help="simulated network latency of each extractor request")
+    parser.add_argument('--faults', default='', help="failure rates injected into extractor requests, e.g. transient=0.1")
+    parser.add_argument('--seek-length', type=int, default=600, help="length in seconds of the long files used for seeking")
+    parser.add_argument('--ffmpeg', help="ffmpeg executable used to generate the synthetic audio")
+    parser.add_argument('--real-audio', action='store_true', help="play through the sound card instead of a dummy device")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary workspace")
+    args = parser.parse_args()
+
+    if not args.real_audio:
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    os.environ[LATENCY_ENV] = str(args.latency_ms)
+    os.environ[FAULTS_ENV] = args.faults
+    ffmpeg = args.ffmpeg or shutil.which('ffmpeg')
+    if not ffmpeg:
+        parser.error("ffmpeg not found; pass --ffmpeg")
+    os.environ['PATH'] = os.path.dirname(os.path.abspath(ffmpeg)) + os.pathsep + os.environ['PATH']
+
+    workspace = tempfile.mkdtemp(prefix='ytune-bench-')
+    cwd = os.getcwd()
+    try:
+        # The player prints its own progress messages; keep stdout for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run_benchmarks(args, ffmpeg, workspace)
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    report = {
+        'version': get_version(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'keep')},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
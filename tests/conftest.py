@@ -0,0 +1,48 @@
+import http.server
+import importlib.util
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLAYER_SCRIPT = os.path.join(ROOT, 'Y Tune.py')
+
+sys.path.insert(0, ROOT)
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+# The player script, loaded once; tests run in a scratch directory, where start_services() and
+# create_data_dirs() put the .cache and .data folders
+@pytest.fixture(scope='session')
+def ytune(tmp_path_factory):
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('player'))
+    try:
+        spec = importlib.util.spec_from_file_location('ytune', PLAYER_SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['ytune'] = module
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        os.chdir(previous)
+
+
+# Serve tmp_path/served over HTTP with a handler class; returns the folder and the URL of song.opus in it
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def start(handler):
+        folder = tmp_path / 'served'
+        folder.mkdir(exist_ok=True)
+        server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), lambda *args, **kwargs: handler(*args, directory=str(folder), **kwargs))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return folder, f"http://127.0.0.1:{server.server_address[1]}/song.opus"
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,111 @@
+import http.server
+import json
+import os
+import threading
+
+import pytest
+
+import benchmark
+
+CHUNK = 64 * 1024
+CHUNKS = 16
+
+
+# Range server from the benchmark that also notes the Range header of every request
+class RecordingHandler(benchmark.RangeRequestHandler):
+    ranges = []
+
+    def send_head(self):
+        self.ranges.append(self.headers.get('Range'))
+        return super().send_head()
+
+
+# A server that ignores Range headers and always sends the whole file
+class PlainHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(ytune, monkeypatch):
+    monkeypatch.setattr(ytune, 'DOWNLOAD_CHUNK_BYTES', CHUNK)
+    RecordingHandler.ranges = []
+
+
+# Run a download rate limited on a thread and cancel it once a few chunks are on disk
+def interrupt(ytune, url, part_path, key):
+    download = ytune.ChunkedDownload(url, {}, part_path, key, connections=1, rate=CHUNK * 8)
+    errors = []
+
+    def run():
+        try:
+            download.run()
+        except BaseException as e:
+            errors.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    download.wait_available(3 * CHUNK)
+    download.cancelled.set()
+    thread.join(10)
+    assert [type(e) for e in errors] == [ytune.JobCancelled]
+    with open(part_path + '.json', encoding='utf-8') as f:
+        done = set(json.load(f)['done'])
+    assert 3 < len(done) < CHUNKS
+    return done
+
+
+def chunk_range(index):
+    return f"bytes={index * CHUNK}-{(index + 1) * CHUNK - 1}"
+
+
+def test_cancelled_download_resumes_where_it_stopped(ytune, serve, tmp_path):
+    folder, url = serve(RecordingHandler)
+    content = os.urandom(CHUNK * CHUNKS - 1000)
+    (folder / 'song.opus').write_bytes(content)
+    part_path = str(tmp_path / 'song.part')
+
+    done = interrupt(ytune, url, part_path, 'opus:1')
+    RecordingHandler.ranges = []
+    download = ytune.ChunkedDownload(url, {}, part_path, 'opus:1')
+    download.run()
+
+    with open(part_path, 'rb') as f:
+        assert f.read() == content
+    assert download.available == len(content)
+    fetched = set(RecordingHandler.ranges) - {'bytes=0-0'}
+    assert not fetched & {chunk_range(index) for index in done}
+    assert len(fetched) == CHUNKS - len(done)
+    download.discard()
+    assert not os.path.exists(part_path) and not os.path.exists(part_path + '.json')
+
+
+def test_partial_file_of_another_version_is_started_over(ytune, serve, tmp_path):
+    folder, url = serve(RecordingHandler)
+    (folder / 'song.opus').write_bytes(os.urandom(CHUNK * CHUNKS))
+    part_path = str(tmp_path / 'song.part')
+    interrupt(ytune, url, part_path, 'opus:1')
+
+    replacement = os.urandom(CHUNK * CHUNKS)
+    (folder / 'song.opus').write_bytes(replacement)
+    RecordingHandler.ranges = []
+    ytune.ChunkedDownload(url, {}, part_path, 'opus:2').run()
+
+    with open(part_path, 'rb') as f:
+        assert f.read() == replacement
+    assert len(set(RecordingHandler.ranges) - {'bytes=0-0'}) == CHUNKS
+
+
+def test_server_without_range_support_gets_one_plain_request(ytune, serve, tmp_path):
+    folder, url = serve(PlainHandler)
+    content = os.urandom(CHUNK * 3 + 5)
+    (folder / 'song.opus').write_bytes(content)
+    part_path = str(tmp_path / 'song.part')
+
+    download = ytune.ChunkedDownload(url, {}, part_path, 'opus:1')
+    download.run()
+
+    assert download.size is None
+    assert download.available == len(content)
+    with open(part_path, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(part_path + '.json')
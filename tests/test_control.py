@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import PLAYER_SCRIPT, ROOT
+
+
+# Environment of a headless player process: no sound card, and the benchmark's fake extractor
+# serving one local audio file for every video
+@pytest.fixture(scope='module')
+def player_env(ytune, tmp_path_factory):
+    ffmpeg = ytune.get_ffmpeg_executable()
+    if not hasattr(ytune.socket, 'AF_UNIX') or not shutil.which(ffmpeg):
+        pytest.skip("needs Unix sockets and ffmpeg")
+    audio = tmp_path_factory.mktemp('audio') / 'tone.opus'
+    subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'sine=f=440:d=5',
+         '-ac', '2', '-c:a', 'libopus', '-b:a', '96k', str(audio)],
+        check=True)
+    return {**os.environ, 'SDL_AUDIODRIVER': 'dummy', 'PYGAME_HIDE_SUPPORT_PROMPT': '1',
+            'PYTHONPATH': ROOT, 'YTUNE_BENCH_AUDIO': str(audio)}
+
+
+def launch(env, folder, sock_path, *args):
+    folder.mkdir(exist_ok=True)
+    return subprocess.Popen(
+        [sys.executable, PLAYER_SCRIPT, '--socket', str(sock_path), '--extractor', 'benchmark:FakeExtractor', *args],
+        cwd=folder, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def shut_down(ytune, process, sock_path):
+    try:
+        if process.poll() is None:
+            ytune.send_command({'cmd': 'quit'}, str(sock_path), timeout=10)
+        return process.communicate(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.communicate()
+
+
+@pytest.fixture(scope='module')
+def player(ytune, player_env, tmp_path_factory):
+    folder = tmp_path_factory.mktemp('headless')
+    sock_path = folder / 'control.sock'
+    process = launch(player_env, folder, sock_path, '--headless')
+    send = lambda cmd, **args: ytune.forward_command({'cmd': cmd, **args}, str(sock_path))
+    assert send('status')['ok']
+    yield send
+    shut_down(ytune, process, sock_path)
+
+
+def wait_for_status(send, condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = send('status')['result']
+        if condition(status):
+            return status
+        assert time.monotonic() < deadline, status
+        time.sleep(0.05)
+
+
+def test_parse_command(ytune):
+    assert ytune.parse_command(['search', 'query=lofi beats', 'wait=false', 'count=3']) == {
+        'cmd': 'search', 'query': 'lofi beats', 'wait': False, 'count': 3}
+    assert ytune.parse_command(['status']) == {'cmd': 'status'}
+
+
+def test_dispatch_command(ytune):
+    handlers = {'add': lambda a, b=1: a + b}
+    assert ytune.dispatch_command({'cmd': 'add', 'a': 2}, handlers) == 3
+    with pytest.raises(ValueError, match='Unknown command: nope'):
+        ytune.dispatch_command({'cmd': 'nope'}, handlers)
+
+
+def test_search_enqueue_play_and_seek(player):
+    reply = player('search', query='lofi')
+    assert reply['ok']
+    tracks = reply['result']
+    assert [track['title'] for track in tracks[:2]] == ['lofi #0', 'lofi #1']
+
+    reply = player('enqueue', url=tracks[3]['url'])
+    assert reply['ok']
+    assert [track['id'] for track in reply['result']['tracks']][-1] == tracks[3]['id']
+
+    reply = player('play', index=0)
+    assert reply['ok']
+    status = wait_for_status(player, lambda status: status['state'] == 'playing' and status['id'] == tracks[0]['id'])
+    assert status['length'] == 5
+
+    reply = player('seek', position=3)
+    assert reply['ok']
+    status = wait_for_status(player, lambda status: status['position'] >= 3)
+    assert status['position'] < 5
+
+
+def test_errors_are_replied_not_raised(player):
+    assert player('nope') == {'ok': False, 'error': 'Unknown command: nope'}
+    reply = player('play', index=99)
+    assert not reply['ok'] and 'No song at index 99' in reply['error']
+    reply = player('seek')
+    assert not reply['ok'] and 'position' in reply['error']
+    reply = player('mode', mode='sideways')
+    assert reply == {'ok': False, 'error': 'Unknown playback mode: sideways'}
+    assert player('status')['ok']
+
+
+def test_single_instance_forwards_to_the_running_player(ytune, player_env, tmp_path):
+    sock_path = tmp_path / 'control.sock'
+    first = launch(player_env, tmp_path / 'first', sock_path, '--headless', '--single-instance', '--send', 'status')
+    try:
+        assert ytune.forward_command({'cmd': 'status'}, str(sock_path))['ok']
+        second = launch(player_env, tmp_path / 'second', sock_path, '--single-instance', '--send', 'search', 'query=jazz')
+        output, _ = second.communicate(timeout=60)
+        assert second.returncode == 0
+        reply = json.loads(output)  # Nothing but the JSON reply on stdout
+        assert reply['ok'] and reply['result'][0]['title'] == 'jazz #0'
+        assert not os.path.exists(tmp_path / 'second' / '.data')
+    finally:
+        output, _ = shut_down(ytune, first, sock_path)
+    # The first launch found no player, so it became one and ran its command itself
+    reply = json.loads(output)
+    assert reply['ok'] and reply['result']['state'] == 'stopped'
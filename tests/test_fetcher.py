@@ -0,0 +1,168 @@
+import threading
+import time
+import types
+
+import pytest
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message or f"HTTP Error {status}")
+        self.status = status
+
+
+# yt-dlp wraps the original exception and keeps it in exc_info
+class DownloadError(Exception):
+    def __init__(self, message, cause):
+        super().__init__(message)
+        self.exc_info = (type(cause), cause, None)
+
+
+# Stands in for the time module inside the player so the breaker's cooldowns run on a fake clock
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def failing(*errors):
+    calls = []
+
+    def fetch():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return 'ok'
+    fetch.calls = calls
+    return fetch
+
+
+@pytest.mark.parametrize('error, kind', [
+    (HTTPError(429), 'throttled'),
+    (HTTPError(503), 'transient'),
+    (HTTPError(403), 'permanent'),
+    (HTTPError(404), 'permanent'),
+    (ConnectionResetError('reset by peer'), 'transient'),
+    (TimeoutError('read'), 'transient'),
+    (DownloadError('ERROR: Unable to extract', HTTPError(429)), 'throttled'),
+    (DownloadError('ERROR: Sign in to confirm you’re not a bot', ValueError()), 'throttled'),
+    (DownloadError('ERROR: Connection reset by peer', OSError()), 'transient'),
+    (DownloadError('ERROR: Unable to download webpage: HTTP Error 403: Forbidden', ValueError()), 'permanent'),
+    (DownloadError('ERROR: Unable to download webpage: <urlopen error timed out>', ValueError()), 'transient'),
+    (DownloadError('ERROR: Unable to download video data: HTTP Error 503', ValueError()), 'transient'),
+    (DownloadError('ERROR: Unable to download video data', ValueError()), 'permanent'),
+    (DownloadError('ERROR: Video unavailable', ValueError()), 'permanent'),
+    (ValueError('unknown'), 'permanent'),
+])
+def test_classify_error(ytune, error, kind):
+    assert ytune.classify_error(error) == kind
+
+
+def test_classify_error_follows_the_cause_chain(ytune):
+    try:
+        try:
+            raise HTTPError(502)
+        except HTTPError as e:
+            raise RuntimeError('extractor failed') from e
+    except RuntimeError as e:
+        assert ytune.classify_error(e) == 'transient'
+
+
+def test_transient_errors_are_retried_up_to_max_attempts(ytune):
+    fetcher = ytune.Fetcher(3, 0, 0, 30, 600)
+    fetch = failing(*[HTTPError(503)] * 3)
+    with pytest.raises(ytune.FetchError) as raised:
+        fetcher.call('search', fetch)
+    assert raised.value.kind == 'transient'
+    assert len(fetch.calls) == 3
+    assert fetcher.counts['retried'] == 2
+    assert fetcher.counts['transient'] == 3
+
+    fetch = failing(HTTPError(503))
+    assert fetcher.call('search', fetch) == 'ok'
+    assert len(fetch.calls) == 2
+
+
+def test_permanent_and_throttled_errors_are_not_retried(ytune):
+    for error, kind in ((HTTPError(404), 'permanent'), (HTTPError(429), 'throttled')):
+        fetcher = ytune.Fetcher(3, 0, 0, 30, 600)
+        fetch = failing(error)
+        with pytest.raises(ytune.FetchError) as raised:
+            fetcher.call('search', fetch)
+        assert raised.value.kind == kind
+        assert len(fetch.calls) == 1
+        assert fetcher.counts['retried'] == 0
+
+
+def test_backoff_is_cut_short_when_the_job_is_cancelled(ytune, monkeypatch):
+    scheduler = ytune.JobScheduler(1)
+    monkeypatch.setattr(ytune, 'scheduler', scheduler)
+    fetcher = ytune.Fetcher(5, 60, 60, 30, 600)
+    failed = threading.Event()
+    outcome = []
+
+    def fetch():
+        failed.set()
+        raise HTTPError(503)
+
+    def run():
+        try:
+            fetcher.call('search', fetch)
+        except BaseException as e:
+            outcome.append(e)
+
+    job = scheduler.submit(run, group='test')
+    assert failed.wait(5)
+    started = time.monotonic()
+    scheduler.cancel_group('test')
+    assert job.done.wait(5)
+    assert time.monotonic() - started < 5
+    assert [type(e) for e in outcome] == [ytune.JobCancelled]
+    assert fetcher.counts['transient'] == 1
+
+
+def test_breaker_opens_probes_and_closes_with_doubling_cooldown(ytune, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ytune, 'time', types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    fetcher = ytune.Fetcher(3, 0, 0, 10, 40)
+    states = []
+
+    def throttled():
+        states.append(fetcher.state)
+        raise HTTPError(429)
+
+    def succeeds():
+        states.append(fetcher.state)
+        return 'ok'
+
+    with pytest.raises(ytune.FetchError):
+        fetcher.call('search', throttled)
+    assert fetcher.state == 'open'
+    assert fetcher.counts['breaker_opened'] == 1
+
+    # The expected cooldown before each probe: it doubles after every throttled probe, up to the maximum
+    for cooldown in (10, 20, 40, 40):
+        clock.now += cooldown - 1
+        with pytest.raises(ytune.FetchError) as raised:
+            fetcher.call('search', succeeds)
+        assert raised.value.kind == 'throttled'
+        clock.now += 1
+        with pytest.raises(ytune.FetchError):
+            fetcher.call('search', throttled)
+        assert states[-1] == 'half_open'
+        assert fetcher.state == 'open'
+    assert fetcher.counts['rejected'] == 4
+    assert fetcher.counts['breaker_opened'] == 5  # Every failed probe reopens it
+
+    clock.now += 40
+    assert fetcher.call('search', succeeds) == 'ok'
+    assert states[-1] == 'half_open'
+    assert fetcher.state == 'closed'
+    assert fetcher.cooldown == 10
+    assert fetcher.call('search', succeeds) == 'ok'
+    assert states[-1] == 'closed'
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def queue(ytune):
+    return ytune.PlayQueue(history_limit=50)
+
+
+def order_ids(queue):
+    return [video_id for _, video_id in queue.order]
+
+
+def test_next_and_previous_walk_the_list(queue):
+    assert queue.load(['a', 'b', 'c']) == 'a'
+    assert queue.next() == 'b'
+    assert queue.next() == 'c'
+    assert queue.next() is None
+    assert queue.previous() == 'b'
+    assert queue.previous() == 'a'
+    assert queue.previous() is None
+
+
+def test_repeat_all_wraps_and_repeat_one_replays(queue):
+    queue.load(['a', 'b'])
+    queue.set_mode('repeat_all')
+    queue.next()
+    assert queue.next() == 'a'
+    queue.set_mode('repeat_one')
+    assert queue.next(auto=True) == 'a'
+    assert queue.next() == 'b'
+
+
+def test_previous_after_shuffle_wraps_does_not_skip_ahead(queue):
+    queue.load(['a', 'b', 'c', 'd', 'e', 'f'])
+    queue.set_mode('shuffle')
+    while queue.next() != queue.order[-1][1]:
+        pass
+    last = queue.order[-1]
+    # Draw the next pass so the song that just ended sits ahead of the cursor in it
+    others = [entry for entry in queue.tracks if entry is not last]
+    queue.next_cycle = others[:2] + [last] + others[2:]
+    new_pass = [video_id for _, video_id in queue.next_cycle]
+    assert queue.next() == new_pass[0]
+    assert queue.previous() == last[1]
+    assert queue.cursor == 0
+    assert order_ids(queue)[1:] == new_pass
+    assert [queue.next() for _ in range(6)] == new_pass
+
+
+def test_previous_finds_the_earlier_copy_of_a_repeated_song(queue):
+    queue.load(['a', 'b', 'a', 'c'])
+    queue.next()
+    queue.next()
+    queue.next()
+    assert queue.previous() == 'a'
+    assert queue.cursor == 2
+
+
+def test_previous_returns_to_a_song_from_an_earlier_queue(queue):
+    queue.load(['x'])
+    queue.load(['a', 'b'])
+    assert queue.previous() == 'x'
+    assert order_ids(queue) == ['x', 'a', 'b']
+    assert queue.next() == 'a'
+
+
+def test_insert_next_and_enqueue(queue):
+    queue.load(['a', 'b'])
+    assert queue.enqueue('c') == 1
+    queue.insert_next('z')
+    assert queue.upcoming(5) == ['z', 'b', 'c']
+    assert queue.jump('y') == 'y'
+    assert queue.previous() == 'a'
+
+
+def test_shuffle_keeps_the_current_song_and_lookahead_is_exact(queue):
+    random.seed(7)
+    queue.load(['a', 'b', 'c', 'd'], start=2)
+    queue.set_mode('shuffle')
+    assert queue.current == 'c'
+    assert sorted(order_ids(queue)) == ['a', 'b', 'c', 'd']
+    for _ in range(3):
+        queue.next()
+    upcoming = queue.upcoming(4)
+    assert [queue.next() for _ in range(4)] == upcoming
+    queue.set_mode('off')
+    assert order_ids(queue) == ['a', 'b', 'c', 'd']
+
+
+def test_shuffle_mid_pass_only_shuffles_the_songs_still_to_come(queue):
+    queue.load(['a', 'b', 'c', 'd', 'e', 'f'])
+    queue.next()
+    queue.next()
+    queue.set_mode('shuffle')
+    assert order_ids(queue)[:3] == ['a', 'b', 'c']
+    assert queue.current == 'c'
+    assert sorted(queue.upcoming(3)) == ['d', 'e', 'f']
+    assert sorted(queue.next() for _ in range(3)) == ['d', 'e', 'f']
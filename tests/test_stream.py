@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+import benchmark
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+CHUNK = 16 * 1024
+RATE = 24 * 1024  # Bytes/s per connection, so a 40 s song takes a few seconds to download
+
+
+# Range server that sends slowly and notes the Range header of every request
+class SlowHandler(benchmark.RangeRequestHandler):
+    ranges = []
+
+    def send_head(self):
+        self.ranges.append(self.headers.get('Range'))
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, 'remaining', None)
+        while remaining is None or remaining > 0:
+            data = source.read(4096 if remaining is None else min(4096, remaining))
+            if not data:
+                break
+            outputfile.write(data)
+            if remaining is not None:
+                remaining -= len(data)
+            time.sleep(len(data) / RATE)
+
+
+def test_ring_buffer_blocks_writers_while_full(ytune):
+    ring = ytune.AudioRingBuffer(8)
+    writer = threading.Thread(target=ring.write, args=(bytes(range(12)),))
+    writer.start()
+    time.sleep(0.1)
+    assert writer.is_alive()
+    assert ring.read(8) == bytes(range(8))
+    writer.join(1)
+    assert not writer.is_alive()
+    assert ring.read(8) == bytes(range(8, 12))
+
+
+def test_ring_buffer_reads_whole_frames_and_drains_after_finish(ytune):
+    ring = ytune.AudioRingBuffer(16)
+    ring.write(b'abcdefg')
+    assert ring.read(16, align=4) == b'abcd'
+    ring.finish()
+    assert ring.read(16, align=4) == b''  # Three bytes left are less than a frame
+
+
+def test_ring_buffer_keeps_data_in_order_across_wraps(ytune):
+    ring = ytune.AudioRingBuffer(1000)
+    data = os.urandom(100_000)
+
+    def write():
+        for offset in range(0, len(data), 777):
+            ring.write(data[offset:offset + 777])
+        ring.finish()
+    threading.Thread(target=write).start()
+    received = bytearray()
+    while chunk := ring.read(333):
+        received += chunk
+    assert received == data
+
+
+def test_ring_buffer_preroll_waits_for_enough_audio(ytune):
+    ring = ytune.AudioRingBuffer(100)
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(ring.wait_for(50)))
+    waiter.start()
+    ring.write(bytes(30))
+    time.sleep(0.1)
+    assert waiter.is_alive()
+    ring.write(bytes(20))
+    waiter.join(1)
+    assert result == [True]
+
+    ended = ytune.AudioRingBuffer(100)
+    ended.finish()
+    assert ended.wait_for(50) is False
+
+
+def test_ring_buffer_close_wakes_blocked_readers_and_writers(ytune):
+    ring = ytune.AudioRingBuffer(4)
+    results = []
+    writer = threading.Thread(target=lambda: results.append(ring.write(bytes(8))))
+    writer.start()
+    empty = ytune.AudioRingBuffer(4)
+    reader = threading.Thread(target=lambda: results.append(empty.read(4)))
+    reader.start()
+    time.sleep(0.1)
+    ring.close()
+    empty.close()
+    writer.join(1)
+    reader.join(1)
+    assert sorted(results, key=repr) == [False, b'']
+
+
+@pytest.fixture
+def mixer():
+    import pygame
+    pygame.mixer.init(44100, -16, 2)
+    yield
+    pygame.mixer.quit()
+
+
+@pytest.fixture(scope='module')
+def song(ytune, tmp_path_factory):
+    ffmpeg = ytune.get_ffmpeg_executable()
+    if not shutil.which(ffmpeg):
+        pytest.skip("ffmpeg is not installed")
+    path = tmp_path_factory.mktemp('song') / 'tone.opus'
+    subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'sine=f=440:d=40',
+         '-ac', '2', '-c:a', 'libopus', '-b:a', '64k', str(path)],
+        check=True)
+    return path.read_bytes()
+
+
+# A player without a window: UI callbacks are collected instead of run, with the download
+# progress at the moment each one was posted
+@pytest.fixture
+def player(ytune, monkeypatch, mixer):
+    ytune.create_data_dirs()
+    posted = []
+    monkeypatch.setattr(ytune, 'DOWNLOAD_CHUNK_BYTES', CHUNK)
+    monkeypatch.setattr(ytune, 'timings', ytune.SpanRecorder(100))
+    monkeypatch.setattr(ytune, 'post_ui', lambda callback, *args, key=None: posted.append((callback.__name__, args)))
+    SlowHandler.ranges = []
+    return posted
+
+
+def start(ytune, url, content, video_id):
+    info = {'id': video_id, 'url': url, 'ext': 'opus', 'acodec': 'opus', 'format_id': '251',
+            'filesize': len(content), 'duration': 40}
+    extension, cache_args = ytune.get_stream_cache_format(info)
+    stream = ytune.ProgressiveStream(f"https://www.youtube.com/watch?v={video_id}", video_id, ytune.TrackMeta.from_info(info))
+    done = threading.Event()
+    stream.start(info, os.path.join(ytune.CACHE_DIR, f"{video_id}.{extension}"), cache_args, done.set)
+    return stream, done
+
+
+def wait_until(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_stream_plays_before_the_download_ends_and_lands_in_the_cache(ytune, player, serve, song):
+    folder, url = serve(SlowHandler)
+    (folder / 'song.opus').write_bytes(song)
+    stream, done = start(ytune, url, song, 'streamed1')
+    try:
+        wait_until(lambda: stream.started_at is not None)
+        assert ('start_stream_playback', (stream,)) in player
+        assert stream.download.available < stream.download.size
+        assert not stream.remuxed.is_set()
+
+        wait_until(lambda: stream.bytes_fed > 0)
+        assert done.wait(30)
+        assert stream.cached_path and os.path.isfile(stream.cached_path)
+        assert ytune.cache_index['streamed1']['file'] == os.path.basename(stream.cached_path)
+        assert not os.path.exists(stream.download.part_path)
+        assert stream.seekable_until() == 40
+    finally:
+        stream.stop()
+
+
+def test_seek_within_the_downloaded_part(ytune, player, serve, song):
+    folder, url = serve(SlowHandler)
+    (folder / 'song.opus').write_bytes(song)
+    stream, done = start(ytune, url, song, 'streamed2')
+    try:
+        wait_until(lambda: stream.started_at is not None and stream.seekable_until() > 12)
+        assert stream.seekable_until() < 40
+        stream.seek(10)
+        wait_until(lambda: stream.bytes_fed > 0)
+        time.sleep(0.3)
+        assert 10 <= stream.position() < 12
+    finally:
+        stream.stop()
+        done.wait(10)
+
+
+def test_stopped_stream_keeps_its_download_for_the_next_play(ytune, player, serve, song):
+    folder, url = serve(SlowHandler)
+    (folder / 'song.opus').write_bytes(song)
+    stream, done = start(ytune, url, song, 'streamed3')
+    wait_until(lambda: stream.download.available >= 3 * CHUNK)
+    stream.stop()
+    assert done.wait(10)
+    assert not stream.cached_path
+    assert 'streamed3' not in ytune.cache_index
+    with open(stream.download.state_path, encoding='utf-8') as f:
+        kept = set(json.load(f)['done'])
+    assert kept
+
+    SlowHandler.ranges = []
+    stream, done = start(ytune, url, song, 'streamed3')
+    try:
+        assert done.wait(30)
+        assert ytune.cache_index['streamed3']['file'] == os.path.basename(stream.cached_path)
+        fetched = [request for request in SlowHandler.ranges if request != 'bytes=0-0']
+        assert not set(fetched) & {f"bytes={index * CHUNK}-{(index + 1) * CHUNK - 1}" for index in kept}
+        assert len(fetched) == -(-len(song) // CHUNK) - len(kept)
+    finally:
+        stream.stop()